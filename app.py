@@ -9,10 +9,25 @@ import threading
 import requests
 import websocket
 import math
-
+import queue
+import struct
+import select
+import socket
+import ssl
+import shutil
+import tempfile
+import hashlib
+import ipaddress
+import urllib.parse
+import concurrent.futures
+from collections import OrderedDict
+
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
 from flask import Flask, request, jsonify, Response, send_file
 from werkzeug.utils import secure_filename
-from PIL import Image
+from PIL import Image, ImageOps
 
 import workflows  # workflows package (workflows/__init__.py)
 
@@ -26,115 +41,1969 @@ COMFY_PORT = os.environ.get("COMFYUI_PORT", "8188")
 COMFY_URL = f"http://{COMFY_HOST}:{COMFY_PORT}"
 WS_URL = f"ws://{COMFY_HOST}:{COMFY_PORT}/ws"
 
+# Several ComfyUI instances (e.g. one per GPU): comma-separated host:port or URLs,
+# e.g. "10.0.0.5:8188,10.0.0.6:8188". Defaults to the COMFYUI_HOST/PORT backend.
+_BACKENDS = [b.strip() for b in (os.environ.get("COMFYUI_BACKENDS") or "").split(",") if b.strip()] or [COMFY_URL]
+# Health/queue poll of every backend; a backend failing this many polls in a row is
+# ejected. Each poll is a single try with this timeout, so a dead backend fails fast.
+_HEALTH_INTERVAL_SECONDS = float(os.environ.get("COMFYUI_HEALTH_INTERVAL_SECONDS", "5"))
+_HEALTH_FAILURES = int(os.environ.get("COMFYUI_HEALTH_FAILURES", "2"))
+_HEALTH_TIMEOUT_SECONDS = float(os.environ.get("COMFYUI_HEALTH_TIMEOUT_SECONDS", "2"))
+# Model affinity: extra load (in queued prompts) charged to a backend that would
+# have to load the requested model's weights; higher values favour warm backends
+_AFFINITY_PENALTY = float(os.environ.get("COMFYUI_AFFINITY_PENALTY", "3"))
+
 PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL")  # optional, e.g. https://api.example.com
 
+# HTTP connection pool to ComfyUI: sized to the gunicorn thread count by default
+_HTTP_POOL_SIZE = int(os.environ.get("COMFYUI_POOL_SIZE", os.environ.get("GUNICORN_THREADS", "4")))
+_HTTP_TIMEOUT = (
+    float(os.environ.get("COMFYUI_CONNECT_TIMEOUT_SECONDS", "5")),
+    float(os.environ.get("COMFYUI_READ_TIMEOUT_SECONDS", "60")),
+)
+_HTTP_UPLOAD_TIMEOUT = (_HTTP_TIMEOUT[0], float(os.environ.get("COMFYUI_UPLOAD_TIMEOUT_SECONDS", "300")))
+_HTTP_GET_RETRIES = int(os.environ.get("COMFYUI_GET_RETRIES", "3"))
+# Uploaded input images remembered per backend (content hash -> ComfyUI filename)
+_UPLOAD_CACHE_SIZE = int(os.environ.get("COMFYUI_UPLOAD_CACHE_SIZE", "1024"))
+# Input images are hashed, decoded and uploaded in chunks of this size; inputs
+# larger than _SPOOL_MAX_MEMORY_BYTES are spooled to a temp file
+_UPLOAD_CHUNK_BYTES = 256 * 1024
+_SPOOL_MAX_MEMORY_BYTES = int(os.environ.get("SPOOL_MAX_MEMORY_BYTES", str(1024 * 1024)))
+# Threads shared by all requests for uploading edit images to ComfyUI; the
+# images of one request are uploaded concurrently
+_UPLOAD_WORKERS = int(os.environ.get("COMFYUI_UPLOAD_WORKERS", "8"))
+# Edit inputs larger than their workflow slot's pixel budget (INPUT_MEGAPIXELS
+# in the workflow module) are downscaled on this many threads before upload,
+# exactly as the workflow's ImageScaleToTotalPixels node would (INPUT_RESAMPLE)
+_DOWNSCALE_INPUTS = os.environ.get("COMFYUI_DOWNSCALE_INPUTS", "true").lower() in ("1", "true", "yes")
+_IMAGE_WORKERS = int(os.environ.get("COMFYUI_IMAGE_WORKERS", str(os.cpu_count() or 4)))
+# Largest accepted request body (multipart files or base64 JSON), refused with
+# 413 from Content-Length before the body is read
+_MAX_INPUT_BYTES = int(os.environ.get("MAX_INPUT_BYTES", str(64 * 1024 * 1024)))
+
+# Shared WebSocket: reconnect backoff and keepalive ping interval
+_WS_RECONNECT_MAX_SECONDS = float(os.environ.get("COMFYUI_WS_RECONNECT_MAX_SECONDS", "10"))
+_WS_PING_SECONDS = float(os.environ.get("COMFYUI_WS_PING_SECONDS", "20"))
+
+# Opt-in: receive output images as binary WebSocket frames (SaveImageWebsocket)
+# instead of /history + /view round trips
+_WS_IMAGE_OUTPUT = os.environ.get("COMFYUI_WS_IMAGE_OUTPUT", "false").lower() in ("1", "true", "yes")
+
+# Deadline (seconds from submission) after which a prompt is removed from the
+# ComfyUI queue or interrupted. COMFYUI_MODEL_DEADLINES overrides it per model,
+# e.g. {"qwen-image-2025": 1200, "z-image-turbo": 120}
+_DEADLINE_SECONDS = float(os.environ.get("COMFYUI_DEADLINE_SECONDS", "900"))
+_MODEL_DEADLINES = json.loads(os.environ.get("COMFYUI_MODEL_DEADLINES") or "{}")
+
+# SSE: heartbeat comment interval and /queue poll cache for queue positions
+_SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+_QUEUE_CACHE_SECONDS = float(os.environ.get("COMFYUI_QUEUE_CACHE_SECONDS", "1"))
+
+# n > 1: ask for up to this many images per ComfyUI execution (latent batch_size)
+# when the model's workflow supports it; otherwise one execution per image
+_NATIVE_BATCH = os.environ.get("COMFYUI_NATIVE_BATCH", "true").lower() in ("1", "true", "yes")
+_MAX_BATCH_SIZE = max(1, int(os.environ.get("COMFYUI_MAX_BATCH_SIZE", "4")))
+
+# Wrapper-side scheduler in front of each backend's /prompt: at most this many of
+# our prompts are in ComfyUI at once (running + queued; 2 keeps the GPU busy), the
+# rest are held and released same-model first. 0 sends prompts straight to ComfyUI.
+_RELEASE_DEPTH = int(os.environ.get("COMFYUI_RELEASE_DEPTH", "2"))
+# A held prompt of any lane waiting this long is released next, ahead of higher
+# lanes and even if it switches models, so no lane starves
+_SCHEDULER_MAX_WAIT_SECONDS = float(os.environ.get("COMFYUI_SCHEDULER_MAX_WAIT_SECONDS", "30"))
+
+# Admission control (0 disables a limit): requests admitted and not finished,
+# overall and per model (COMFYUI_MODEL_MAX_INFLIGHT overrides per model, e.g.
+# {"flux-2-dev": 4}), and the longest estimated queue wait (from measured
+# per-model execution times) a new request may face
+_MAX_INFLIGHT = int(os.environ.get("COMFYUI_MAX_INFLIGHT", "64"))
+_MAX_INFLIGHT_PER_MODEL = int(os.environ.get("COMFYUI_MAX_INFLIGHT_PER_MODEL", "0"))
+_MODEL_MAX_INFLIGHT = json.loads(os.environ.get("COMFYUI_MODEL_MAX_INFLIGHT") or "{}")
+_WAIT_SLO_SECONDS = float(os.environ.get("COMFYUI_WAIT_SLO_SECONDS", "600"))
+
+# Priority lanes ("priority": "high" | "normal" | "low"): high prompts are
+# released first and go to the front of ComfyUI's queue; low (bulk) prompts
+# are released only while fewer than COMFYUI_LOW_PRIORITY_DEPTH of ours are in
+# ComfyUI. COMFYUI_KEY_PRIORITIES pins API keys (Authorization: Bearer ...) to
+# a lane, e.g. {"sk-backfill": "low"}; a pinned key cannot pick another lane.
+_PRIORITIES = {"high": 0, "normal": 1, "low": 2}  # lane -> release rank
+_LOW_PRIORITY_DEPTH = int(os.environ.get("COMFYUI_LOW_PRIORITY_DEPTH", "1"))
+_KEY_PRIORITIES = json.loads(os.environ.get("COMFYUI_KEY_PRIORITIES") or "{}")
+
+# How often a waiting request checks whether its HTTP client went away; the
+# prompt is then deleted from the queue or interrupted
+_DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", "1"))
+# Smoothing factor of the per-model execution time average (used to estimate GPU time saved)
+_EXEC_TIME_ALPHA = float(os.environ.get("EXEC_TIME_EWMA_ALPHA", "0.2"))
+
+# Model warm-up: these models run once on every backend at startup (and again
+# every COMFYUI_WARMUP_INTERVAL_SECONDS if > 0, and on a re-admitted backend) as a
+# 256x256, 1-step workflow so that no user request pays the weight loads; /ready
+# answers 503 until each has warmed on at least one backend. Failed startup
+# warm-ups are retried after COMFYUI_WARMUP_RETRY_SECONDS, doubling up to
+# COMFYUI_WARMUP_RETRY_MAX_SECONDS. Comma separated model ids, e.g. "z-image-turbo,flux-2-dev"
+_WARMUP_MODELS = [m.strip() for m in os.environ.get("COMFYUI_WARMUP_MODELS", "").split(",") if m.strip()]
+_WARMUP_INTERVAL_SECONDS = float(os.environ.get("COMFYUI_WARMUP_INTERVAL_SECONDS", "0"))
+_WARMUP_RETRY_SECONDS = float(os.environ.get("COMFYUI_WARMUP_RETRY_SECONDS", "5"))
+_WARMUP_RETRY_MAX_SECONDS = float(os.environ.get("COMFYUI_WARMUP_RETRY_MAX_SECONDS", "60"))
+
+# How often workflows/ is checked (by mtime) for changed, new or removed
+# models, which are then reloaded without a restart; 0 disables hot reload
+_WORKFLOW_RELOAD_SECONDS = float(os.environ.get("COMFYUI_WORKFLOW_RELOAD_SECONDS", "2"))
+
+# Async jobs ("async": true): how long a finished job stays pollable, how many
+# run at once, and the timeout of the completion webhook POST
+_JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+_JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "32"))
+_WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get("WEBHOOK_TIMEOUT_SECONDS", "10"))
+# Webhooks only go to public addresses (never loopback, private, link-local or
+# the ComfyUI backends), unless WEBHOOK_ALLOWED_HOSTS lists the hostnames they
+# may go to (comma-separated), e.g. internal.example.com,10.0.0.5. The POST
+# connects to the address that was checked, not a second DNS answer; still,
+# set the allowlist when untrusted clients can choose webhook URLs.
+_WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in (os.environ.get("WEBHOOK_ALLOWED_HOSTS") or "").split(",") if h.strip()}
+
+# Input files (POST /v1/files) that edits reference by id: kept on disk under
+# FILES_DIR for FILE_TTL_SECONDS, or a shorter expires_after[seconds]
+_FILE_TTL_SECONDS = int(os.environ.get("FILE_TTL_SECONDS", "86400"))
+_FILES_DIR = os.environ.get("FILES_DIR") or os.path.join(tempfile.gettempdir(), "comfy-api-files")
+
 # In-memory temporary URL store (for response_format="url")
 _TEMP_IMAGES = {}
 _TEMP_LOCK = threading.Lock()
 _TEMP_TTL_SECONDS = int(os.environ.get("TEMP_IMAGE_TTL_SECONDS", "3600"))
 
+# ============================================================
+# Errors
+# ============================================================
+class ApiError(Exception):
+    """
+    Error carrying the fields of an OpenAI-style error body.
+    """
+    def __init__(self, message: str, status: int = 400, param: str = None, code: str = None, err_type: str = "invalid_request_error"):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.param = param
+        self.code = code
+        self.err_type = err_type
+
+class ComfyExecutionError(ApiError):
+    """
+    ComfyUI reported execution_error for a prompt.
+    """
+    def __init__(self, data: dict):
+        self.node_id = data.get("node_id")
+        self.node_type = data.get("node_type")
+        detail = data.get("exception_message") or "unknown error"
+        if data.get("exception_type"):
+            detail = f"{data['exception_type']}: {detail}"
+        super().__init__(
+            f"ComfyUI execution failed in node {self.node_id} ({self.node_type}): {detail.strip()}",
+            status=500, code="comfyui_execution_error", err_type="server_error",
+        )
+
+class ComfyPromptError(ApiError):
+    """
+    ComfyUI rejected a prompt on /prompt (it failed validation).
+    """
+    def __init__(self, body: dict):
+        node_errors = [e for e in (body.get("node_errors") or {}).values() if isinstance(e, dict)]
+        self.node_types = {e.get("class_type") for e in node_errors}
+        detail = (body.get("error") or {}).get("message") or "validation failed"
+        for node_error in node_errors[:1]:
+            for error in (node_error.get("errors") or [])[:1]:
+                detail += f"; {node_error.get('class_type')}: {error.get('message')}: {error.get('details')}"
+        super().__init__(f"ComfyUI rejected the workflow: {detail}", status=500,
+                         code="comfyui_prompt_rejected", err_type="server_error")
+
+class ComfyInterruptedError(ApiError):
+    def __init__(self, message="ComfyUI execution was interrupted."):
+        super().__init__(message, status=500, code="comfyui_interrupted", err_type="server_error")
+
+class ComfyTimeoutError(ApiError):
+    def __init__(self, message):
+        super().__init__(message, status=504, code="timeout", err_type="server_error")
+
+class BackendUnavailableError(ApiError):
+    def __init__(self, message="No healthy ComfyUI backend is available."):
+        super().__init__(message, status=503, code="backend_unavailable", err_type="server_error")
+
+class BackendRefusedError(requests.ConnectionError):
+    """
+    A backend could not be reached before it accepted any of the request's
+    work (an upload, or a connect failure on /prompt before any prompt was
+    queued), so the request may be retried on another backend.
+    """
+
+def is_connect_error(exc) -> bool:
+    """
+    True if a requests error happened while connecting, i.e. before the
+    request reached ComfyUI (refused, unreachable, connect timeout).
+    """
+    if isinstance(exc, (requests.ConnectTimeout, BackendRefusedError)):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, urllib3.exceptions.ConnectTimeoutError)  # NewConnectionError subclasses it
+
+class OverloadedError(ApiError):
+    """
+    Request refused by admission control; retry_after is in whole seconds.
+    """
+    def __init__(self, message, retry_after: float):
+        super().__init__(message, status=429, code="rate_limit_exceeded", err_type="requests")
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class ClientDisconnectedError(ApiError):
+    # 499: nginx's "client closed request"; the response is never delivered
+    def __init__(self, message="Client disconnected; the prompt was cancelled."):
+        super().__init__(message, status=499, code="client_disconnected")
+
+# ============================================================
+# Metrics
+# ============================================================
+_METRICS_LOCK = threading.Lock()
+_METRICS = {
+    "prompts_cancelled": {},  # reason -> count
+    "gpu_seconds_saved": {},  # reason -> estimated seconds of GPU work not done
+    "gpu_seconds_unestimated": {},  # reason -> cancelled prompts of a model with no measured execution time yet
+}
+_EXEC_SECONDS = {}  # model_id -> moving average of execution time (execution_start to done)
+_LANE_SECONDS = {}  # priority -> {"wait": ..., "total": ...} moving averages from submission
+
+def metric_inc(name: str, key: str, amount=1):
+    with _METRICS_LOCK:
+        bucket = _METRICS.setdefault(name, {})
+        bucket[key] = bucket.get(key, 0) + amount
+
+def record_execution_time(model_id: str, seconds: float):
+    with _METRICS_LOCK:
+        prev = _EXEC_SECONDS.get(model_id)
+        _EXEC_SECONDS[model_id] = seconds if prev is None else prev + _EXEC_TIME_ALPHA * (seconds - prev)
+
+def record_lane_latency(priority: str, wait: float, total: float):
+    with _METRICS_LOCK:
+        lane = _LANE_SECONDS.setdefault(priority, {})
+        for key, seconds in (("wait", wait), ("total", total)):
+            prev = lane.get(key)
+            lane[key] = seconds if prev is None else prev + _EXEC_TIME_ALPHA * (seconds - prev)
+
+def estimated_execution_time(model_id: str):
+    with _METRICS_LOCK:
+        return _EXEC_SECONDS.get(model_id)
+
+def metrics_snapshot() -> dict:
+    with _METRICS_LOCK:
+        out = {
+            name: {k: round(v, 3) if isinstance(v, float) else v for k, v in bucket.items()}
+            for name, bucket in _METRICS.items()
+        }
+        out["execution_seconds_avg"] = {k: round(v, 3) for k, v in _EXEC_SECONDS.items()}
+        out["latency_seconds_avg"] = {
+            priority: {k: round(v, 3) for k, v in lane.items()} for priority, lane in _LANE_SECONDS.items()
+        }
+    affinity = out.get("model_affinity")
+    if affinity:
+        hits = affinity.get("hits", 0)
+        affinity["hit_rate"] = round(hits / (hits + affinity.get("misses", 0)), 3)
+    return out
+
 # ============================================================
 # ComfyUI Client Logic
 # ============================================================
+def spooled_file():
+    return tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_MEMORY_BYTES)
+
+def spool_copy(fileobj):
+    """
+    Copies a file object (e.g. a request's upload, closed when the request
+    ends) into a spooled temp file owned by the caller.
+    """
+    fileobj.seek(0)
+    out = spooled_file()
+    shutil.copyfileobj(fileobj, out, _UPLOAD_CHUNK_BYTES)
+    out.seek(0)
+    return out
+
+def close_edit_inputs(images):
+    """
+    Closes the file objects of (file object, filename, content_type) edit
+    inputs once they are uploaded; multipart files are left to the request.
+    """
+    for image in images or ():
+        if isinstance(image, tuple):
+            image[0].close()
+
+class MultipartBody:
+    """
+    multipart/form-data body whose file part is read from its file object
+    while sending, instead of being built in memory. It has a length, so
+    requests sends it with a Content-Length and reads it in blocks.
+    """
+    def __init__(self, fields: dict, name: str, filename: str, fileobj, content_type: str):
+        boundary = uuid.uuid4().hex
+        content_type = (content_type or "application/octet-stream").replace("\r", "").replace("\n", "")
+        head = b"".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode()
+            for key, value in fields.items()
+        )
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f"Content-Type: {content_type}\r\n\r\n").encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(0)
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self._length = len(head) + size + len(tail)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        out = b""
+        while self._parts and (size is None or size < 0 or len(out) < size):
+            chunk = self._parts[0].read(-1 if size is None or size < 0 else size - len(out))
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            out += chunk
+        return out
+
+    def __iter__(self):
+        return iter(lambda: self.read(_UPLOAD_CHUNK_BYTES), b"")
+
+class UploadCache:
+    """
+    Content hash -> filename of the images already in one backend's input
+    folder, least recently used first out. Uploads are named after their
+    hash, so identical bytes give an identical LoadImage input and ComfyUI
+    can reuse its cached results for it. Uploads in progress are tracked
+    too, so identical images sent at the same time are uploaded once.
+    """
+    def __init__(self, max_size=_UPLOAD_CACHE_SIZE):
+        self.max_size = max_size
+        self._names = OrderedDict()
+        self._inflight = {}  # key -> Future of the upload in progress
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(fileobj) -> str:
+        """
+        sha256 of a seekable file object, read in chunks; leaves it rewound.
+        """
+        fileobj.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: fileobj.read(_UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+        fileobj.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def filename(key: str, original_name: str) -> str:
+        ext = os.path.splitext(secure_filename(original_name or ""))[1].lower() or ".png"
+        return f"{key[:32]}{ext}"
+
+    def get(self, key: str):
+        with self._lock:
+            name = self._names.get(key)
+            if name is not None:
+                self._names.move_to_end(key)
+            return name
+
+    def begin(self, key: str):
+        """
+        Claims the upload of `key`: (filename, None) if the backend already
+        has it; (None, future) if another upload of it is in progress, whose
+        future gives the filename; (None, None) if the caller uploads it and
+        must then call finish().
+        """
+        with self._lock:
+            name = self._names.get(key)
+            if name is not None:
+                self._names.move_to_end(key)
+                return name, None
+            if key in self._inflight:
+                return None, self._inflight[key]
+            self._inflight[key] = concurrent.futures.Future()
+            return None, None
+
+    def finish(self, key: str, name: str = None, error: BaseException = None):
+        """
+        Ends an upload claimed with begin(): remembers its filename, or hands
+        its error to the uploads waiting on it. An upload abandoned by its
+        caller (cancelled, not failed) cancels the future, so a waiter claims
+        the upload itself.
+        """
+        if error is None:
+            self.put(key, name)
+        with self._lock:
+            future = self._inflight.pop(key)
+        if error is None:
+            future.set_result(name)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.cancel()
+
+    def put(self, key: str, name: str):
+        with self._lock:
+            self._names[key] = name
+            self._names.move_to_end(key)
+            while len(self._names) > self.max_size:
+                self._names.popitem(last=False)
+
+    def discard(self, names):
+        """
+        Forgets the entries of these filenames, so their images are uploaded again.
+        """
+        names = set(names)
+        with self._lock:
+            for key in [key for key, name in self._names.items() if name in names]:
+                del self._names[key]
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+
+# Nodes that read the uploaded edit inputs from ComfyUI's input folder
+_INPUT_NODE_TYPES = frozenset({"LoadImage", "LoadImageMask"})
+
+def is_missing_input_error(exc) -> bool:
+    """
+    True if a prompt failed in a node loading an input image, e.g. because
+    ComfyUI's input folder was cleaned since the upload cache noted it.
+    """
+    if isinstance(exc, ComfyPromptError):
+        return bool(exc.node_types & _INPUT_NODE_TYPES)
+    return isinstance(exc, ComfyExecutionError) and exc.node_type in _INPUT_NODE_TYPES
+
+def prompt_request_body(prompt_workflow, client_id: str, prompt_id: str = None, front: bool = False) -> bytes:
+    """
+    JSON body of POST /prompt. The workflow goes in as its JSON text, so a
+    rendered template (workflows.WorkflowTemplate) is never parsed and
+    re-serialized.
+    """
+    payload = {"client_id": client_id}
+    if prompt_id:
+        payload["prompt_id"] = prompt_id
+    if front:
+        payload["front"] = True
+    return ('{"prompt": ' + workflows.to_json(prompt_workflow) + ", " + json.dumps(payload)[1:]).encode("utf-8")
+
+class ComfyClient:
+    """
+    HTTP client for one ComfyUI backend.
+
+    Holds a keep-alive requests.Session whose connection pool is sized to the
+    gunicorn thread count, applies per-call timeouts, and retries idempotent
+    GETs with backoff. Also owns the backend's shared WebSocket dispatcher.
+    """
+    def __init__(self, base_url, ws_url, pool_size=None):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+        pool_size = pool_size or _HTTP_POOL_SIZE
+        retry = Retry(
+            total=_HTTP_GET_RETRIES,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # health probes: one keep-alive connection, no retries
+        self._probe_session = requests.Session()
+        probe_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self._probe_session.mount("http://", probe_adapter)
+        self._probe_session.mount("https://", probe_adapter)
+
+        self.ws = ComfyWebSocketDispatcher(ws_url, self)
+        self.scheduler = PromptScheduler(self)
+        self.uploads = UploadCache()
+
+        self._queue_lock = threading.Lock()
+        self._queue_cache = (0.0, None)  # (fetched_at, /queue response)
+
+    def _post(self, path, **kwargs):
+        kwargs.setdefault("timeout", _HTTP_TIMEOUT)
+        response = self.session.post(f"{self.base_url}{path}", **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _get(self, path, **kwargs):
+        kwargs.setdefault("timeout", _HTTP_TIMEOUT)
+        response = self.session.get(f"{self.base_url}{path}", **kwargs)
+        response.raise_for_status()
+        return response
+
+    def upload_image(self, file_storage, image_type="input"):
+        """
+        Uploads an image file to ComfyUI (see upload_image_file).
+        """
+        name = self.upload_image_file(file_storage.stream, filename=file_storage.filename or "image.png",
+                                      content_type=file_storage.content_type, image_type=image_type)
+
+        # reset
+        try:
+            file_storage.seek(0)
+        except Exception:
+            pass
+
+        return name
+
+    def upload_image_bytes(self, image_bytes: bytes, filename="image.png", content_type="image/png", image_type="input"):
+        """
+        Uploads raw bytes to ComfyUI as an image file (see upload_image_file).
+        """
+        return self.upload_image_file(io.BytesIO(image_bytes), filename=filename, content_type=content_type,
+                                      image_type=image_type)
+
+    def upload_image_file(self, fileobj, filename="image.png", content_type="image/png", image_type="input"):
+        """
+        Uploads a seekable file object to ComfyUI as an image file named after
+        its content hash; content this backend already has, or is being sent
+        by another upload, is not uploaded again. The file is hashed and sent in chunks, never read whole.
+        """
+        key = UploadCache.key(fileobj)
+        while image_type == "input":
+            cached, pending = self.uploads.begin(key)
+            if cached is None and pending is None:
+                break  # ours to upload
+            try:
+                name = cached if cached is not None else pending.result()
+            except concurrent.futures.CancelledError:
+                continue  # its uploader gave up
+            metric_inc("uploads", "deduplicated")
+            return name
+
+        final_name = UploadCache.filename(key, filename)
+        body = MultipartBody({"type": image_type, "overwrite": "true"}, "image", final_name, fileobj, content_type)
+
+        try:
+            response = self._post("/upload/image", data=body, headers={"Content-Type": body.content_type},
+                                  timeout=_HTTP_UPLOAD_TIMEOUT)
+            name = response.json().get("name", final_name)
+        except BaseException as e:
+            if image_type == "input":
+                self.uploads.finish(key, error=e)
+            raise
+        metric_inc("uploads", "uploaded")
+        if image_type == "input":
+            self.uploads.finish(key, name=name)
+        return name
+
+    def queue_prompt(self, prompt_workflow, prompt_id=None, client_id=None, front=False):
+        """
+        Queues a workflow. prompt_id may be chosen by the caller so that it can be
+        watched on the shared WebSocket before ComfyUI starts executing it.
+        front=True puts it ahead of the prompts already pending.
+        """
+        client_id = client_id or str(uuid.uuid4())
+        body = prompt_request_body(prompt_workflow, client_id, prompt_id=prompt_id, front=front)
+        try:
+            response = self._post("/prompt", data=body, headers={"Content-Type": "application/json"})
+        except requests.HTTPError as e:
+            if e.response.status_code == 400:
+                raise ComfyPromptError(e.response.json()) from e
+            raise
+        return response.json()["prompt_id"], client_id
+
+    def get_history(self, prompt_id):
+        return self._get(f"/history/{prompt_id}").json()
+
+    def get_image_raw(self, filename, subfolder, folder_type):
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        return self._get("/view", params=params).content
+
+    def get_queue(self, max_age=_QUEUE_CACHE_SECONDS, newer_than=0.0):
+        """
+        Returns ComfyUI's /queue, polled at most once per max_age seconds
+        however many requests ask for it. A cached response older than
+        newer_than (e.g. the time a prompt was queued) is refreshed.
+        """
+        with self._queue_lock:
+            fetched_at, data = self._queue_cache
+            if data is None or time.time() - fetched_at > max_age or fetched_at < newer_than:
+                data = self._get("/queue").json()
+                self._queue_cache = (time.time(), data)
+            return data
+
+    def probe(self):
+        """
+        Health check: /system_stats, then /queue, each tried once with the
+        short health timeout. Returns the /queue response, which also
+        refreshes the get_queue cache.
+        """
+        for path in ("/system_stats", "/queue"):
+            response = self._probe_session.get(f"{self.base_url}{path}", timeout=_HEALTH_TIMEOUT_SECONDS)
+            response.raise_for_status()
+        data = response.json()
+        with self._queue_lock:
+            self._queue_cache = (time.time(), data)
+        return data
+
+    def get_queue_position(self, prompt_id, queued_at=0.0):
+        held = self.scheduler.position(prompt_id)
+        if held is not None:
+            # still in the wrapper: everything in ComfyUI's queue is ahead of it
+            queue_data = self.get_queue()
+            return len(queue_data.get("queue_running") or []) + len(queue_data.get("queue_pending") or []) + held
+        return queue_position(self.get_queue(newer_than=queued_at), prompt_id)
+
+    def cancel_prompt(self, prompt_id):
+        """
+        Deletes prompt_id from ComfyUI's queue if it is pending, or interrupts it
+        if it is running. Returns "deleted", "interrupted" or None if ComfyUI no
+        longer has it.
+        """
+        state = prompt_queue_state(self.get_queue(max_age=0), prompt_id)
+        if state == "pending":
+            self._post("/queue", json={"delete": [prompt_id]})
+        elif state == "running":
+            # prompt_id makes ComfyUI ignore the interrupt if another prompt runs by now
+            self._post("/interrupt", json={"prompt_id": prompt_id})
+        return {"pending": "deleted", "running": "interrupted"}.get(state)
+
+def queue_position(queue_data, prompt_id):
+    """
+    Number of prompts ahead of prompt_id in a /queue response: 0 while it is
+    running, None if it is not in the queue (finished or not yet visible).
+    """
+    running = queue_data.get("queue_running") or []
+    if any(item[1] == prompt_id for item in running):
+        return 0
+    pending = sorted(queue_data.get("queue_pending") or [], key=lambda item: item[0])
+    for idx, item in enumerate(pending):
+        if item[1] == prompt_id:
+            return len(running) + idx
+    return None
+
+def prompt_queue_state(queue_data, prompt_id):
+    """
+    "running", "pending" or None for prompt_id in a /queue response.
+    """
+    if any(item[1] == prompt_id for item in queue_data.get("queue_running") or []):
+        return "running"
+    if any(item[1] == prompt_id for item in queue_data.get("queue_pending") or []):
+        return "pending"
+    return None
+
 def upload_image(file_storage, image_type="input"):
+    return COMFY_CLIENT.upload_image(file_storage, image_type=image_type)
+
+def upload_image_bytes(image_bytes: bytes, filename="image.png", content_type="image/png", image_type="input"):
+    return COMFY_CLIENT.upload_image_bytes(image_bytes, filename=filename, content_type=content_type, image_type=image_type)
+
+def queue_prompt(prompt_workflow, prompt_id=None, client_id=None):
+    return COMFY_CLIENT.queue_prompt(prompt_workflow, prompt_id=prompt_id, client_id=client_id)
+
+def get_history(prompt_id):
+    return COMFY_CLIENT.get_history(prompt_id)
+
+def get_image_raw(filename, subfolder, folder_type):
+    return COMFY_CLIENT.get_image_raw(filename, subfolder, folder_type)
+
+# ============================================================
+# ComfyUI WebSocket dispatcher (one shared connection per backend)
+# ============================================================
+# Binary WebSocket frames: 4-byte event type, then the payload
+_WS_BINARY_PREVIEW_IMAGE = 1
+_WS_BINARY_PREVIEW_IMAGE_WITH_METADATA = 4
+
+class PromptWatch:
+    """
+    Completion future for one prompt_id, resolved by the dispatcher thread.
+    """
+    def __init__(self, prompt_id, output_nodes=(), listener=None, model_id=None, priority="normal"):
+        self.prompt_id = prompt_id
+        self.model_id = model_id
+        self.priority = priority  # lane, see _PRIORITIES
+        self.submitted_at = time.time()
+        self.future = concurrent.futures.Future()
+        self.node = None  # node currently executing for this prompt
+        self.progress = None  # (value, max) of the running sampler
+        self.outputs = {}  # node_id -> output, from "executed" messages
+        self.output_nodes = set(output_nodes)  # SaveImageWebsocket node ids
+        self.images = []  # image bytes received from output_nodes
+        self.listener = listener  # optional callable(event, data), called on the dispatcher thread
+        self.queued_at = None  # time the prompt was accepted by /prompt
+        self.deadline = None  # absolute time after which the prompt is cancelled
+        self.cancelled = False  # set by cancel_workflow; a release in flight re-cancels
+        self.started_at = None  # time ComfyUI started executing it
+        self.finished_at = None
+
+    def emit(self, event, data):
+        if self.listener is None:
+            return
+        try:
+            self.listener(event, data)
+        except Exception as e:
+            print(f"[ws] listener for {self.prompt_id} failed: {e}")
+
+    def done(self):
+        if not self.future.done():
+            self.finished_at = time.time()
+            self.future.set_result(self.prompt_id)
+
+    def fail(self, exc):
+        if not self.future.done():
+            self.finished_at = time.time()
+            self.future.set_exception(exc)
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+class ComfyWebSocketDispatcher:
+    """
+    Owns a single long-lived WebSocket to ComfyUI and routes
+    executing/executed/progress messages to PromptWatch objects by prompt_id.
+
+    All prompts are queued with this dispatcher's client_id. The reader thread
+    is started lazily (after gunicorn forks) and reconnects with backoff; after
+    every (re)connect, pending prompts are checked against /history so that a
+    completion missed while disconnected still resolves.
+    """
+    def __init__(self, ws_url, client):
+        self.ws_url = ws_url
+        self.client_id = str(uuid.uuid4())
+        self._client = client
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._connected = threading.Event()
+        self._current = None  # watch of the prompt ComfyUI is executing; binary frames belong to it
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="comfy-ws", daemon=True)
+                self._thread.start()
+
+    def wait_connected(self, timeout=5.0):
+        self.start()
+        return self._connected.wait(timeout)
+
+    def watch(self, prompt_id, output_nodes=(), listener=None, model_id=None, priority="normal"):
+        w = PromptWatch(prompt_id, output_nodes=output_nodes, listener=listener, model_id=model_id, priority=priority)
+        with self._lock:
+            self._watches[prompt_id] = w
+        self.start()
+        return w
+
+    def unwatch(self, prompt_id):
+        with self._lock:
+            self._watches.pop(prompt_id, None)
+
+    def watch_count(self):
+        with self._lock:
+            return len(self._watches)
+
+    def _get(self, prompt_id):
+        with self._lock:
+            return self._watches.get(prompt_id)
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            ws = websocket.WebSocket()
+            try:
+                ws.connect(f"{self.ws_url}?clientId={self.client_id}", timeout=10)
+                ws.settimeout(_WS_PING_SECONDS)
+                self._connected.set()
+                backoff = 0.5
+                print(f"[ws] connected to {self.ws_url} (clientId={self.client_id})")
+                self._recover_missed()
+                while True:
+                    try:
+                        out = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        ws.ping()
+                        continue
+                    if isinstance(out, str):
+                        self._handle(json.loads(out))
+                    elif out:
+                        self._handle_binary(out)
+            except Exception as e:
+                if self._connected.is_set():
+                    print(f"[ws] connection lost: {e}; reconnecting.")
+            finally:
+                self._connected.clear()
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _WS_RECONNECT_MAX_SECONDS)
+
+    def _recover_missed(self):
+        """
+        Settles watches whose outcome happened while we were not connected:
+        finished prompts are resolved from /history, and prompts ComfyUI no
+        longer knows about (e.g. after a restart) are failed.
+        """
+        started = time.time()
+        with self._lock:
+            pending = [w for w in self._watches.values() if w.queued_at and w.queued_at < started]
+        if not pending:
+            return
+        try:
+            queue_data = self._client.get_queue(max_age=0)
+        except Exception as e:
+            print(f"[ws] /queue check after reconnect failed: {e}")
+            queue_data = None
+        for w in pending:
+            try:
+                history = self._client.get_history(w.prompt_id).get(w.prompt_id)
+                if history is not None:
+                    error = history_error(history)
+                    print(f"[ws] prompt {w.prompt_id} finished while disconnected; recovered from /history.")
+                    if error:
+                        w.fail(error)
+                    else:
+                        w.done()
+                elif queue_data is not None and prompt_queue_state(queue_data, w.prompt_id) is None:
+                    w.fail(ComfyInterruptedError("Prompt was lost by ComfyUI (restarted?)."))
+            except Exception as e:
+                print(f"[ws] history check for {w.prompt_id} failed: {e}")
+
+    def _handle(self, message):
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        w = self._get(data.get("prompt_id"))
+        if w is None:
+            return
+
+        if msg_type in ("execution_start", "executing"):
+            self._current = w
+            w.node = data.get("node")
+            if w.started_at is None:
+                w.started_at = time.time()
+            if msg_type == "executing" and w.node is None:
+                self._current = None
+                w.done()
+        elif msg_type == "progress":
+            w.progress = (data.get("value"), data.get("max"))
+            w.emit("progress", {"value": data.get("value"), "max": data.get("max"), "node": data.get("node")})
+        elif msg_type == "executed":
+            w.outputs[data.get("node")] = data.get("output") or {}
+        elif msg_type == "execution_success":
+            self._current = None
+            w.done()
+        elif msg_type == "execution_error":
+            self._current = None
+            w.fail(ComfyExecutionError(data))
+        elif msg_type == "execution_interrupted":
+            self._current = None
+            w.fail(ComfyInterruptedError())
+
+    def _handle_binary(self, frame):
+        """
+        Routes a binary frame (image bytes) to the prompt currently executing.
+        Frames sent while one of the prompt's SaveImageWebsocket nodes runs are outputs.
+        """
+        if len(frame) < 8:
+            return
+        event_type = struct.unpack(">I", frame[:4])[0]
+        w = self._current
+        if event_type == _WS_BINARY_PREVIEW_IMAGE:
+            image = frame[8:]  # skip the 4-byte image format
+        elif event_type == _WS_BINARY_PREVIEW_IMAGE_WITH_METADATA:
+            meta_len = struct.unpack(">I", frame[4:8])[0]
+            try:
+                meta = json.loads(frame[8:8 + meta_len])
+                w = self._get(meta.get("prompt_id")) or w
+            except Exception:
+                pass
+            image = frame[8 + meta_len:]
+        else:
+            return
+
+        if w is None:
+            return
+        if w.node in w.output_nodes:
+            w.images.append(image)
+        else:
+            # latent preview of the running sampler (sent when ComfyUI runs with --preview-method)
+            w.emit("preview", {"image": image, "progress": w.progress})
+
+# ============================================================
+# Prompt scheduler (one per backend)
+# ============================================================
+class PromptScheduler:
+    """
+    Wrapper-side queue in front of one backend's /prompt.
+
+    Only _RELEASE_DEPTH of our prompts are in ComfyUI at a time, which is
+    enough to keep the GPU busy; the rest are held here. The highest priority
+    lane with held prompts is released first; low priority prompts wait until
+    fewer than _LOW_PRIORITY_DEPTH of ours are in ComfyUI. Within a lane,
+    prompts loading the same weights as the last released one go first, so
+    an A-B-A-B mix of models runs as A-A-B-B and pays fewer model loads. A
+    prompt of any lane held for _SCHEDULER_MAX_WAIT_SECONDS is released next
+    regardless of lanes and models, so steady high/normal traffic cannot
+    starve the lower lanes.
+
+    Prompt ids are assigned before release, so watches, cancellation and
+    deadlines work the same for held and released prompts.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._held = []  # [(watch, workflow, signature, held_at)] in arrival order
+        self._released = set()  # prompt ids in ComfyUI that have not finished
+        self._last_signature = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="comfy-scheduler", daemon=True)
+                self._thread.start()
+
+    def submit(self, watch, workflow_dict, signature):
+        watch.future.add_done_callback(lambda _f: self.forget(watch.prompt_id))
+        with self._cond:
+            self._held.append((watch, workflow_dict, signature, time.time()))
+            self._cond.notify()
+        self.start()
+
+    def discard(self, prompt_id) -> bool:
+        """
+        Drops a held prompt; True if it had not been released to ComfyUI yet.
+        """
+        with self._cond:
+            for idx, item in enumerate(self._held):
+                if item[0].prompt_id == prompt_id:
+                    del self._held[idx]
+                    return True
+        return False
+
+    def discard_all(self, prompt_ids) -> set:
+        """
+        Drops several held prompts at once; returns the ids that were still held.
+        """
+        prompt_ids = set(prompt_ids)
+        with self._cond:
+            dropped = {item[0].prompt_id for item in self._held if item[0].prompt_id in prompt_ids}
+            self._held = [item for item in self._held if item[0].prompt_id not in dropped]
+        return dropped
+
+    def forget(self, prompt_id):
+        """
+        Frees the release slot of a finished or cancelled prompt.
+        """
+        with self._cond:
+            self._released.discard(prompt_id)
+            self._cond.notify()
+
+    def position(self, prompt_id):
+        """
+        Number of held prompts released before this one (same or higher lane
+        and earlier, or higher lane and later), or None if not held.
+        """
+        with self._cond:
+            for idx, item in enumerate(self._held):
+                if item[0].prompt_id == prompt_id:
+                    rank = _PRIORITIES[item[0].priority]
+                    return (sum(1 for other in self._held[:idx] if _PRIORITIES[other[0].priority] <= rank) +
+                            sum(1 for other in self._held[idx + 1:] if _PRIORITIES[other[0].priority] < rank))
+        return None
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {"held": len(self._held), "released": len(self._released)}
+
+    def _next_index(self):
+        """
+        Index of the held prompt to release next, or None if none may go yet.
+        """
+        if not self._held or len(self._released) >= _RELEASE_DEPTH:
+            return None
+        # _held is in arrival order, so its head is the oldest prompt of any lane
+        if time.time() - self._held[0][3] >= _SCHEDULER_MAX_WAIT_SECONDS:
+            metric_inc("scheduler", "max_wait_releases")
+            return 0
+        rank = min(_PRIORITIES[item[0].priority] for item in self._held)
+        if rank == _PRIORITIES["low"] and len(self._released) >= _LOW_PRIORITY_DEPTH:
+            return None
+        lane = [idx for idx, item in enumerate(self._held) if _PRIORITIES[item[0].priority] == rank]
+        for idx in lane:
+            if self._held[idx][2] == self._last_signature:
+                return idx
+        return lane[0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                idx = self._next_index()
+                while idx is None:
+                    self._cond.wait()
+                    idx = self._next_index()
+                watch, workflow_dict, signature, _held_at = self._held.pop(idx)
+                self._released.add(watch.prompt_id)
+                if signature != self._last_signature:
+                    metric_inc("scheduler", "model_switches")
+                self._last_signature = signature
+            metric_inc("scheduler", "releases")
+
+            try:
+                self._client.queue_prompt(workflow_dict, prompt_id=watch.prompt_id, client_id=self._client.ws.client_id,
+                                          front=watch.priority == "high")
+            except Exception as e:
+                print(f"[api] could not queue prompt {watch.prompt_id}: {e}")
+                watch.fail(e)
+                continue
+            watch.queued_at = time.time()
+            COMFY_POOL.record_submission(self._client, watch.model_id, signature)
+            if watch.cancelled:
+                # cancel_workflow ran while the prompt was being queued
+                try:
+                    self._client.cancel_prompt(watch.prompt_id)
+                except Exception as e:
+                    print(f"[api] could not cancel prompt {watch.prompt_id}: {e}")
+                self.forget(watch.prompt_id)
+
+# ============================================================
+# ComfyUI backend pool
+# ============================================================
+def backend_urls(spec: str):
+    """
+    "host:port" or "http(s)://host:port" -> (base_url, ws_url)
     """
-    Uploads an image file to ComfyUI.
-    Adds a unique prefix to filename to prevent overwriting.
+    base = spec.strip().rstrip("/")
+    if "://" not in base:
+        base = f"http://{base}"
+    ws_base = "wss" + base[len("https"):] if base.startswith("https") else "ws" + base[len("http"):]
+    return base, f"{ws_base}/ws"
+
+class BackendPool:
     """
-    original_name = secure_filename(file_storage.filename)
-    if not original_name:
-        original_name = "image.png"
+    The ComfyUI backends this wrapper drives, one ComfyClient each.
 
-    unique_prefix = str(uuid.uuid4())[:8]
-    filename = f"{unique_prefix}_{original_name}"
+    A background thread polls /system_stats (health) and /queue (depth) of
+    every backend. A backend failing _HEALTH_FAILURES polls in a row is
+    ejected, and re-admitted on its next successful poll. Each request picks
+    the least loaded healthy backend and sends all its ComfyUI calls there.
 
-    files = {"image": (filename, file_storage.read(), file_storage.content_type)}
-    data = {"type": image_type, "overwrite": "true"}
+    The pool also remembers the weight files of the last workflow submitted
+    to each backend; a backend missing the requested model's weights is
+    charged _AFFINITY_PENALTY extra load, so same-model requests stick to a
+    warm GPU unless its queue is much deeper.
+    """
+    def __init__(self, specs):
+        self.clients = [ComfyClient(*backend_urls(spec)) for spec in specs]
+        self._state = {
+            c.base_url: {"healthy": True, "failures": 0, "queue_depth": 0, "models": frozenset()}
+            for c in self.clients
+        }
+        self._signatures = {}  # model_id -> weight files its last workflow loaded
+        self._lock = threading.Lock()
+        self._thread = None
+        self._turn = 0  # rotates the tie-break between equally loaded backends
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="comfy-pool", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            for client in self.clients:
+                self._check(client)
+            time.sleep(_HEALTH_INTERVAL_SECONDS)
 
-    response = requests.post(f"{COMFY_URL}/upload/image", files=files, data=data)
-    response.raise_for_status()
+    def _check(self, client):
+        try:
+            queue_data = client.probe()
+            depth = len(queue_data.get("queue_running", [])) + len(queue_data.get("queue_pending", []))
+        except Exception as e:
+            with self._lock:
+                state = self._state[client.base_url]
+                state["failures"] += 1
+                if state["healthy"] and state["failures"] >= _HEALTH_FAILURES:
+                    state["healthy"] = False
+                    print(f"[pool] ejecting {client.base_url}: {e}")
+            return
+        with self._lock:
+            state = self._state[client.base_url]
+            readmitted = not state["healthy"]
+            if readmitted:
+                print(f"[pool] re-admitting {client.base_url}")
+                # it may have restarted with a different input folder
+                client.uploads.clear()
+            state.update(healthy=True, failures=0, queue_depth=depth)
+        if readmitted:
+            # ... and with no weights loaded
+            MODEL_WARMER.rewarm(client)
+
+    def report_failure(self, client, exc):
+        """
+        Ejects a backend that failed a request (the poller re-admits it) and
+        returns the error to report to the caller.
+        """
+        with self._lock:
+            state = self._state[client.base_url]
+            state["failures"] = max(state["failures"], _HEALTH_FAILURES)
+            if state["healthy"]:
+                state["healthy"] = False
+                print(f"[pool] ejecting {client.base_url}: {exc}")
+        return BackendUnavailableError(f"ComfyUI backend {client.base_url} is unreachable.")
+
+    def record_submission(self, client, model_id, signature):
+        """
+        Notes the weight files of a workflow just queued on a backend.
+        """
+        with self._lock:
+            self._state[client.base_url]["models"] = signature
+            if model_id and signature:
+                self._signatures[model_id] = signature
+
+    def is_healthy(self, client) -> bool:
+        with self._lock:
+            return self._state[client.base_url]["healthy"]
+
+    def healthy_count(self) -> int:
+        with self._lock:
+            return sum(1 for state in self._state.values() if state["healthy"])
+
+    def load(self, client) -> int:
+        # prompts this wrapper waits on also count submissions since the last /queue poll
+        return max(self._state[client.base_url]["queue_depth"], client.ws.watch_count())
+
+    def _cold_fraction(self, client, wanted) -> float:
+        return len(wanted - self._state[client.base_url]["models"]) / len(wanted)
+
+    def choose(self, model_id=None):
+        """
+        Returns the ComfyClient of the healthy backend with the lowest load,
+        counting the affinity penalty when the model's weights are not warm there.
+        """
+        self.start()
+        with self._lock:
+            healthy = [c for c in self.clients if self._state[c.base_url]["healthy"]]
+            if not healthy:
+                raise BackendUnavailableError()
+            self._turn = (self._turn + 1) % len(healthy)
+            ordered = healthy[self._turn:] + healthy[:self._turn]
+            wanted = self._signatures.get(model_id)
+            if not wanted:
+                return min(ordered, key=self.load)
+            best = min(ordered, key=lambda c: self.load(c) + _AFFINITY_PENALTY * self._cold_fraction(c, wanted))
+            warm = self._cold_fraction(best, wanted) == 0
+        metric_inc("model_affinity", "hits" if warm else "misses")
+        return best
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [
+                dict(self._state[c.base_url], url=c.base_url, waiting=c.ws.watch_count(),
+                     models=sorted(self._state[c.base_url]["models"]), **c.scheduler.snapshot())
+                for c in self.clients
+            ]
+
+COMFY_POOL = BackendPool(_BACKENDS)
+COMFY_CLIENT = COMFY_POOL.clients[0]  # default for the module-level helpers
+
+def run_with_failover(params: dict, attempt):
+    """
+    Returns attempt(client) run on the backend chosen for the request. If it
+    raises BackendRefusedError, that backend is ejected and attempt runs once
+    more on another healthy backend; any other connection error ejects the
+    backend and raises BackendUnavailableError.
+    """
+    client = COMFY_POOL.choose(params["model_id"])
+    try:
+        return attempt(client)
+    except BackendRefusedError as e:
+        COMFY_POOL.report_failure(client, e)
+        client = COMFY_POOL.choose(params["model_id"])  # BackendUnavailableError if none is left
+        metric_inc("backend_failovers", "retries")
+        print(f"[pool] retrying the request on {client.base_url}")
+    except requests.ConnectionError as e:
+        raise COMFY_POOL.report_failure(client, e)
+    try:
+        return attempt(client)
+    except requests.ConnectionError as e:
+        raise COMFY_POOL.report_failure(client, e)
 
-    # reset
+# ============================================================
+# Workflow registry
+# ============================================================
+# Workflow models (manifests and modules in workflows/) are indexed once here
+# and served from that index; WORKFLOW_RELOADER swaps in a new index when
+# the files change. A request resolves its model once (parse_image_params)
+# and keeps that version to the end.
+_MODEL_REGISTRY = workflows.load_registry()
+print(f"[model] Registered {len(_MODEL_REGISTRY.models)} models: {', '.join(sorted(_MODEL_REGISTRY.models))}")
+
+class WorkflowReloader:
+    """
+    Polls workflows/ every `interval` seconds and reloads the registry when a
+    file was added, removed or modified. A model that fails to load keeps its
+    previous version (see workflows.load_registry).
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self.interval > 0 and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="workflow-reload", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if workflows.registry_changed():
+                    self.reload()
+            except Exception as e:
+                print(f"[model] workflow reload failed: {e}")
+                metric_inc("workflow_reloads", "failures")
+
+    def reload(self):
+        registry = workflows.load_registry()
+        metric_inc("workflow_reloads", "reloads")
+        if registry.errors:
+            metric_inc("workflow_reloads", "failures")
+        print(f"[model] Reloaded workflows (version {registry.version}): {', '.join(sorted(registry.models))}")
+        return registry
+
+    @staticmethod
+    def snapshot() -> dict:
+        registry = workflows.get_registry()
+        return {
+            "version": registry.version,
+            "loaded_at": int(registry.loaded_at),
+            "models": len(registry.models),
+            "errors": dict(registry.errors),
+        }
+
+WORKFLOW_RELOADER = WorkflowReloader(_WORKFLOW_RELOAD_SECONDS)
+
+# ============================================================
+# Admission control
+# ============================================================
+_ADMISSION_LOCK = threading.Lock()
+_INFLIGHT = {}  # model_id -> [requests, executions] admitted and not yet finished
+
+def execution_estimate(model_id: str) -> float:
+    """
+    Measured average execution time of the model; for a model not measured
+    yet, the average over measured models (0 if none).
+    """
+    estimate = estimated_execution_time(model_id)
+    if estimate is not None:
+        return estimate
+    with _METRICS_LOCK:
+        known = list(_EXEC_SECONDS.values())
+    return sum(known) / len(known) if known else 0.0
+
+def _backlog_seconds() -> float:
+    # caller holds _ADMISSION_LOCK
+    return sum(execution_estimate(model_id) * executions for model_id, (_, executions) in _INFLIGHT.items())
+
+def projected_wait() -> float:
+    """
+    Estimated seconds before a new request starts: admitted, unfinished work
+    spread over the healthy backends.
+    """
+    with _ADMISSION_LOCK:
+        backlog = _backlog_seconds()
+    return backlog / max(1, COMFY_POOL.healthy_count())
+
+def admit(params: dict):
+    """
+    Admits a request against the in-flight caps and the wait SLO, or raises
+    OverloadedError. Returns the callable that releases the admission.
+    """
+    model_id = params["model_id"]
+    executions = len(plan_batches(params, params["n"]))
+    backends = max(1, COMFY_POOL.healthy_count())
+
+    with _ADMISSION_LOCK:
+        total = sum(requests_ for requests_, _ in _INFLIGHT.values())
+        model_requests = _INFLIGHT.get(model_id, [0, 0])[0]
+        model_cap = int(_MODEL_MAX_INFLIGHT.get(model_id, _MAX_INFLIGHT_PER_MODEL))
+        wait = _backlog_seconds() / backends
+        # a slot frees up when one of the admitted requests finishes
+        slot_eta = execution_estimate(model_id)
+
+        if _MAX_INFLIGHT and total >= _MAX_INFLIGHT:
+            reason, error = "global_cap", OverloadedError(
+                f"Too many image requests in flight ({total}); retry later.", slot_eta)
+        elif model_cap and model_requests >= model_cap:
+            reason, error = "model_cap", OverloadedError(
+                f"Too many requests in flight for model {model_id} ({model_requests}); retry later.", slot_eta)
+        elif _WAIT_SLO_SECONDS and wait > _WAIT_SLO_SECONDS:
+            reason, error = "wait_slo", OverloadedError(
+                f"Estimated queue wait of {wait:.0f}s exceeds {_WAIT_SLO_SECONDS:.0f}s; retry later.",
+                wait - _WAIT_SLO_SECONDS)
+        else:
+            reason, error = None, None
+            entry = _INFLIGHT.setdefault(model_id, [0, 0])
+            entry[0] += 1
+            entry[1] += executions
+
+    if error is not None:
+        metric_inc("admission_rejected", reason)
+        print(f"[api] rejected {model_id} request: {error.message}")
+        raise error
+
+    released = threading.Event()
+
+    def release():
+        if released.is_set():
+            return
+        released.set()
+        with _ADMISSION_LOCK:
+            entry[0] -= 1
+            entry[1] -= executions
+            if entry[0] <= 0:
+                _INFLIGHT.pop(model_id, None)
+
+    return release
+
+def admission_snapshot() -> dict:
+    with _ADMISSION_LOCK:
+        inflight = {model_id: requests_ for model_id, (requests_, _) in _INFLIGHT.items()}
+    return {"inflight": inflight, "projected_wait_seconds": round(projected_wait(), 1)}
+
+def history_error(history: dict):
+    """
+    Returns the ApiError recorded in a failed /history entry, or None.
+    """
+    status = history.get("status") or {}
+    if status.get("status_str") != "error":
+        return None
+    for name, data in status.get("messages") or []:
+        if name == "execution_error":
+            return ComfyExecutionError(data)
+    return ComfyInterruptedError()
+
+def deadline_for(model_id: str) -> float:
+    return float(_MODEL_DEADLINES.get(model_id, _DEADLINE_SECONDS))
+
+def submit_workflow(workflow_dict, client=None, listener=None, timeout=None, model_id=None, priority="normal"):
+    """
+    Queues a workflow on the backend (through its scheduler) and returns its PromptWatch.
+    listener(event, data) receives "progress" and "preview" events while it runs.
+    After `timeout` seconds collect_workflow cancels the prompt.
+    priority is the lane the prompt is released in (see PromptScheduler).
+    """
+    client = client or COMFY_CLIENT
+    dispatcher = client.ws
+    if not dispatcher.wait_connected():
+        raise BackendRefusedError(f"ComfyUI websocket {dispatcher.ws_url} is not connected.")
+
+    prompt_id = str(uuid.uuid4())
+    watch = dispatcher.watch(prompt_id, output_nodes=workflows.websocket_output_nodes(workflow_dict),
+                             listener=listener, model_id=model_id, priority=priority)
+    if timeout:
+        watch.deadline = time.time() + timeout
+    signature = workflows.model_signature(workflow_dict)
+
+    if _RELEASE_DEPTH > 0:
+        # queue_prompt errors then surface through the watch's future
+        client.scheduler.submit(watch, workflow_dict, signature)
+        return watch
     try:
-        file_storage.seek(0)
+        client.queue_prompt(workflow_dict, prompt_id=prompt_id, client_id=dispatcher.client_id,
+                            front=priority == "high")
     except Exception:
-        pass
+        dispatcher.unwatch(prompt_id)
+        raise
+    watch.queued_at = time.time()
+    COMFY_POOL.record_submission(client, model_id, signature)
+    return watch
 
-    result = response.json()
-    return result.get("name", filename)
+def record_execution(watch):
+    """
+    Feeds a finished prompt's execution time into the per-model average and
+    its wait and total time since submission into its lane's averages.
+    Internal prompts (no model_id, e.g. warm-ups) are not recorded.
+    """
+    if watch.model_id and watch.started_at and watch.finished_at:
+        record_execution_time(watch.model_id, watch.finished_at - watch.started_at)
+        record_lane_latency(watch.priority, watch.started_at - watch.submitted_at, watch.finished_at - watch.submitted_at)
 
-def upload_image_bytes(image_bytes: bytes, filename="image.png", content_type="image/png", image_type="input"):
+def record_cancellation(watch, action, reason: str):
+    """
+    Counts a cancelled prompt and the GPU time it would still have used:
+    the model's average execution time if it was deleted from the queue,
+    minus the time already spent if it was interrupted. Without a measured
+    average the prompt is counted under gpu_seconds_unestimated instead.
+    """
+    metric_inc("prompts_cancelled", reason)
+    if action not in ("deleted", "interrupted"):
+        return
+    estimate = estimated_execution_time(watch.model_id) if watch.model_id else None
+    if estimate is None:
+        # nothing measured for this model yet (e.g. right after startup); counting 0 would understate the savings
+        metric_inc("gpu_seconds_unestimated", reason)
+        return
+    saved = estimate
+    if action == "interrupted":
+        saved = max(0.0, estimate - (time.time() - (watch.started_at or time.time())))
+    metric_inc("gpu_seconds_saved", reason, round(saved, 3))
+
+def cancel_workflow(watch, client=None, reason="cancelled"):
     """
-    Uploads raw bytes to ComfyUI as an image file.
+    Deletes the prompt from the ComfyUI queue or interrupts it if running,
+    stops watching it and records the cancellation. Returns the action taken.
     """
-    safe_name = secure_filename(filename) or "image.png"
-    unique_prefix = str(uuid.uuid4())[:8]
-    final_name = f"{unique_prefix}_{safe_name}"
+    client = client or COMFY_CLIENT
+    watch.cancelled = True
+    return _cancel_released(watch, client, reason, client.scheduler.discard(watch.prompt_id))
 
-    files = {"image": (final_name, image_bytes, content_type)}
-    data = {"type": image_type, "overwrite": "true"}
+def cancel_workflows(watches, client=None, reason="cancelled"):
+    """
+    cancel_workflow for several prompts of one request. All of them leave the
+    scheduler before any is cancelled in ComfyUI: cancelling a released prompt
+    frees a release slot, which would otherwise send a held sibling to
+    ComfyUI just before it is cancelled too.
+    """
+    client = client or COMFY_CLIENT
+    for watch in watches:
+        watch.cancelled = True
+    held = client.scheduler.discard_all([w.prompt_id for w in watches])
+    for watch in watches:
+        _cancel_released(watch, client, reason, watch.prompt_id in held)
+
+def _cancel_released(watch, client, reason, was_held):
+    if was_held:
+        action = "deleted"  # still held by the wrapper; ComfyUI never saw it
+    else:
+        try:
+            action = client.cancel_prompt(watch.prompt_id)
+        except Exception as e:
+            print(f"[api] could not cancel prompt {watch.prompt_id}: {e}")
+            action = None
+    client.scheduler.forget(watch.prompt_id)
+    client.ws.unwatch(watch.prompt_id)
+    record_cancellation(watch, action, reason)
+    print(f"[api] prompt {watch.prompt_id} cancelled, {reason} ({action or 'no longer queued'}).")
+    return action
+
+def expire_workflow(watch, client=None):
+    """
+    Cancels a prompt that ran past its deadline and raises ComfyTimeoutError.
+    """
+    cancel_workflow(watch, client, reason="deadline")
+    raise ComfyTimeoutError("Image generation exceeded its deadline and was cancelled.")
 
-    response = requests.post(f"{COMFY_URL}/upload/image", files=files, data=data)
-    response.raise_for_status()
-    result = response.json()
-    return result.get("name", final_name)
+def abandon_workflow(watch, client=None):
+    """
+    Cancels a prompt whose HTTP client went away and raises ClientDisconnectedError.
+    """
+    cancel_workflow(watch, client, reason="client_disconnected")
+    raise ClientDisconnectedError()
 
-def queue_prompt(prompt_workflow):
-    client_id = str(uuid.uuid4())
-    payload = {"prompt": prompt_workflow, "client_id": client_id}
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(f"{COMFY_URL}/prompt", json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()["prompt_id"], client_id
+def collect_workflow(watch, client=None, is_disconnected=None):
+    """
+    Waits for a submitted prompt and returns its output images as raw bytes.
+    With is_disconnected, the wait is sliced so a gone client cancels the prompt.
+    """
+    client = client or COMFY_CLIENT
+    try:
+        while True:
+            remaining = watch.remaining()
+            wait = remaining
+            if is_disconnected is not None:
+                wait = _DISCONNECT_POLL_SECONDS if remaining is None else min(_DISCONNECT_POLL_SECONDS, remaining)
+            try:
+                watch.future.result(timeout=wait)
+                break
+            except concurrent.futures.TimeoutError:
+                if watch.remaining() == 0.0:
+                    expire_workflow(watch, client)
+                if is_disconnected is not None and is_disconnected():
+                    abandon_workflow(watch, client)
+    finally:
+        client.ws.unwatch(watch.prompt_id)
+    record_execution(watch)
 
-def get_history(prompt_id):
-    response = requests.get(f"{COMFY_URL}/history/{prompt_id}")
-    response.raise_for_status()
-    return response.json()
+    if watch.output_nodes:
+        return watch.images
 
-def get_image_raw(filename, subfolder, folder_type):
-    params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    response = requests.get(f"{COMFY_URL}/view", params=params)
-    response.raise_for_status()
-    return response.content
+    history = client.get_history(watch.prompt_id).get(watch.prompt_id, {})
+    return [client.get_image_raw(*ref) for ref in history_image_refs(history)]
 
-def execute_workflow(workflow_dict):
+def iter_completed(watches, client=None, is_disconnected=None):
+    """
+    Yields (watch, raw images) for submitted prompts in completion order, so
+    results are downloaded while the remaining prompts still execute.
+    Deadlines and client disconnects apply to all of them; when iteration
+    stops early for any reason, the prompts still pending are cancelled.
+    """
+    client = client or COMFY_CLIENT
+    pending = list(watches)
+    reason = "request_failed"
+    try:
+        while pending:
+            if any(w.remaining() == 0.0 for w in pending):
+                reason = "deadline"
+                raise ComfyTimeoutError("Image generation exceeded its deadline and was cancelled.")
+            if is_disconnected is not None and is_disconnected():
+                reason = "client_disconnected"
+                raise ClientDisconnectedError()
+            deadlines = [w.remaining() for w in pending if w.deadline is not None]
+            wait = min(deadlines) if deadlines else None
+            if is_disconnected is not None:
+                wait = _DISCONNECT_POLL_SECONDS if wait is None else min(_DISCONNECT_POLL_SECONDS, wait)
+            concurrent.futures.wait([w.future for w in pending], timeout=wait,
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for w in [w for w in pending if w.future.done()]:
+                pending.remove(w)
+                yield w, collect_workflow(w, client)
+    finally:
+        for w in pending:
+            if w.future.done():
+                client.ws.unwatch(w.prompt_id)
+        cancel_workflows([w for w in pending if not w.future.done()], client, reason=reason)
+
+def execute_workflow(workflow_dict, client=None, timeout=None, model_id=None, is_disconnected=None):
     """
     Full execution: Queue -> WS wait -> Download.
     Returns a list of raw image bytes.
     """
-    prompt_id, client_id = queue_prompt(workflow_dict)
+    watch = submit_workflow(workflow_dict, client=client, timeout=timeout, model_id=model_id)
+    return collect_workflow(watch, client=client, is_disconnected=is_disconnected)
 
-    ws = websocket.WebSocket()
-    ws.connect(f"{WS_URL}?clientId={client_id}")
+class PartialImageSampler:
+    """
+    Picks up to `count` evenly spaced preview frames out of a sampler run:
+    the first frame at or past each of the steps max*i/(count+1), i=1..count.
+    """
+    def __init__(self, count):
+        self.count = count
+        self.emitted = 0
+
+    def accept(self, progress) -> bool:
+        if self.emitted >= self.count or not progress:
+            return False
+        value, maximum = progress
+        if not value or not maximum:
+            return False
+        if value >= math.ceil(maximum * (self.emitted + 1) / (self.count + 1)):
+            self.emitted += 1
+            return True
+        return False
 
-    try:
+# ============================================================
+# Model warm-up
+# ============================================================
+class ModelWarmer:
+    """
+    Runs each of _WARMUP_MODELS once per backend so ComfyUI has its weights
+    loaded: at startup, again on a backend the pool re-admits, then every
+    _WARMUP_INTERVAL_SECONDS if set. Warm-ups go in the low priority lane and
+    are left out of the execution time averages. A model counts as warm once
+    it has run on at least one healthy backend; the startup pass retries the
+    others with backoff and `ready` is set once none are pending.
+    """
+    def __init__(self, model_ids, interval):
+        self.model_ids = list(model_ids)
+        self.interval = interval
+        self.ready = threading.Event()
+        self.pending = list(self.model_ids)  # models not yet warmed on any backend
+        self._readmitted = []  # backends to warm again, see rewarm()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        if not self.model_ids:
+            self.ready.set()
+
+    def start(self):
+        with self._lock:
+            if self.model_ids and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="comfy-warmup", daemon=True)
+                self._thread.start()
+
+    def rewarm(self, client):
+        """
+        Queues a warm-up of every model on a backend that was re-admitted
+        (it may have restarted with nothing loaded).
+        """
+        if not self.model_ids:
+            return
+        with self._lock:
+            if client not in self._readmitted:
+                self._readmitted.append(client)
+        self._wake.set()
+
+    def _run(self):
+        COMFY_POOL.start()  # its health checks decide where to warm, and report re-admissions
+        delay = _WARMUP_RETRY_SECONDS
         while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message.get("type") == "executing":
-                    data = message.get("data", {})
-                    if data.get("node") is None and data.get("prompt_id") == prompt_id:
-                        break
-    finally:
+            with self._lock:
+                pending = list(self.pending)
+            for model_id in pending:
+                if self.warm_all([model_id]):
+                    with self._lock:
+                        self.pending.remove(model_id)
+            with self._lock:
+                pending = list(self.pending)
+            if not pending:
+                break
+            metric_inc("warmup", "retries")
+            print(f"[model] warm-up of {', '.join(pending)} retrying in {delay:.0f}s")
+            # a re-admitted backend is worth trying right away
+            self._wake.wait(delay)
+            self._wake.clear()
+            with self._lock:
+                self._readmitted.clear()
+            delay = min(delay * 2, _WARMUP_RETRY_MAX_SECONDS)
+        self.ready.set()
+        print(f"[model] warm-up done: {', '.join(self.model_ids)}")
+
+        next_pass = time.time() + self.interval if self.interval > 0 else None
+        while True:
+            self._wake.wait(None if next_pass is None else max(0.0, next_pass - time.time()))
+            self._wake.clear()
+            with self._lock:
+                readmitted, self._readmitted = self._readmitted, []
+            for client in readmitted:
+                self.warm_all(self.model_ids, clients=[client])
+            if next_pass is not None and time.time() >= next_pass:
+                self.warm_all(self.model_ids)
+                next_pass = time.time() + self.interval
+
+    def warm_all(self, model_ids, clients=None):
+        """
+        Warms model_ids on every healthy backend (of `clients` if given) and
+        returns the ones that warmed on at least one.
+        """
+        warmed = []
+        for model_id in model_ids:
+            ok = False
+            for client in clients or COMFY_POOL.clients:
+                if COMFY_POOL.is_healthy(client):
+                    ok = self.warm(client, model_id) or ok
+            if ok:
+                warmed.append(model_id)
+        return warmed
+
+    def warm(self, client, model_id) -> bool:
+        started = time.time()
         try:
-            ws.close()
-        except Exception:
-            pass
+            wf = self._workflow(client, model_id)
+            watch = submit_workflow(wf, client=client, timeout=deadline_for(model_id), priority="low")
+            collect_workflow(watch, client=client)
+        except Exception as e:
+            metric_inc("warmup", "failures")
+            print(f"[model] warm-up of {model_id} on {client.base_url} failed: {e}")
+            return False
+        # submitted without model_id (to stay out of the averages), so note its weights here
+        COMFY_POOL.record_submission(client, model_id, workflows.model_signature(wf))
+        metric_inc("warmup", "runs")
+        print(f"[model] warmed {model_id} on {client.base_url} in {time.time() - started:.1f}s")
+        return True
+
+    @staticmethod
+    def _workflow(client, model_id):
+        params = parse_image_params({"model": model_id, "prompt": "warm-up", "size": "256x256"}, "gen")
+        try:
+            wf = build_workflow(params, seed=1)
+        except ValueError:
+            # edit-only model: warm it on a blank input image
+            params["mode"] = "edit"
+            blank = io.BytesIO()
+            Image.new("RGB", (256, 256), (255, 255, 255)).save(blank, "PNG")
+            wf = build_workflow(params, seed=1, images=[client.upload_image_bytes(blank.getvalue(), filename="warmup.png")])
+        return workflows.set_steps(wf, 1)
 
-    history = get_history(prompt_id).get(prompt_id, {})
-    outputs = history.get("outputs", {})
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"ready": self.ready.is_set(), "pending": list(self.pending)}
 
-    images = []
-    for node_id in outputs:
-        node_output = outputs[node_id]
-        if "images" in node_output:
-            for img in node_output["images"]:
-                raw = get_image_raw(img["filename"], img["subfolder"], img["type"])
-                images.append(raw)
+MODEL_WARMER = ModelWarmer(_WARMUP_MODELS, _WARMUP_INTERVAL_SECONDS)  # started at the end of this module
+
+# ============================================================
+# Async job store
+# ============================================================
+# A job outlives the request that created it: the request answers with the
+# job id right away and a worker runs the generation. Finished jobs are kept
+# for _JOB_TTL_SECONDS, like temp images.
+_JOBS = {}  # job_id -> job dict (see create_job)
+_JOBS_LOCK = threading.Lock()
+_JOB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=_JOB_WORKERS, thread_name_prefix="job")
+
+def create_job(params: dict) -> dict:
+    cleanup_jobs()
+    job = {
+        "id": f"imgjob_{uuid.uuid4().hex}",
+        "status": "queued",  # queued -> in_progress -> completed | failed
+        "model": params["raw_model_id"],
+        "created_at": _now(),
+        "finished_at": None,
+        "progress": None,  # (step, max_steps) of the running execution
+        "result": None,
+        "error": None,
+        "webhook_url": params["webhook_url"],
+        "expires_at": None,
+    }
+    with _JOBS_LOCK:
+        _JOBS[job["id"]] = job
+    return job
+
+def update_job_progress(job_id: str, step: int, max_steps: int):
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if job is not None and job["status"] in ("queued", "in_progress"):
+            job["status"] = "in_progress"
+            job["progress"] = (step, max_steps)
+
+def finish_job(job_id: str, result: dict = None, error: dict = None) -> dict:
+    with _JOBS_LOCK:
+        job = _JOBS[job_id]
+        job["status"] = "failed" if error else "completed"
+        job["result"] = result
+        job["error"] = error
+        job["finished_at"] = _now()
+        job["expires_at"] = time.time() + _JOB_TTL_SECONDS
+        return job_view(job)
+
+def get_job(job_id: str):
+    cleanup_jobs()
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        return job_view(job) if job is not None else None
+
+def cleanup_jobs():
+    now = time.time()
+    with _JOBS_LOCK:
+        dead = [k for k, job in _JOBS.items() if job["expires_at"] is not None and job["expires_at"] < now]
+        for k in dead:
+            _JOBS.pop(k, None)
 
-    return images
+def job_view(job: dict) -> dict:
+    """
+    Public shape of a job, as returned by the jobs endpoint and the webhook.
+    """
+    view = {
+        "id": job["id"],
+        "object": "image.job",
+        "status": job["status"],
+        "model": job["model"],
+        "created_at": job["created_at"],
+    }
+    if job["progress"] is not None:
+        step, max_steps = job["progress"]
+        view["progress"] = {"step": step, "max_steps": max_steps}
+    if job["finished_at"] is not None:
+        view["finished_at"] = job["finished_at"]
+    if job["result"] is not None:
+        view["result"] = job["result"]
+    if job["error"] is not None:
+        view["error"] = job["error"]
+    return view
+
+def webhook_url_error(url):
+    """
+    Why the job of a request may not be POSTed to `url`, or None if it may.
+    With WEBHOOK_ALLOWED_HOSTS set, only those hosts are allowed. Otherwise
+    the host must not be a ComfyUI backend, and if it is an IP address it
+    must be public. Hostnames are resolved and checked by resolve_webhook
+    when the job is POSTed, since resolving blocks.
+    """
+    if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+        return "webhook_url must be an http(s) URL"
+    try:
+        parts = urllib.parse.urlsplit(url)
+        parts.port  # a bad port raises ValueError
+    except ValueError:
+        return "webhook_url is not a valid URL"
+    host = (parts.hostname or "").lower()
+    if not host:
+        return "webhook_url must be an http(s) URL"
+    if _WEBHOOK_ALLOWED_HOSTS:
+        return None if host in _WEBHOOK_ALLOWED_HOSTS else f"webhook host '{host}' is not allowed"
+    if host in {urllib.parse.urlsplit(backend_urls(spec)[0]).hostname for spec in _BACKENDS}:
+        return f"webhook host '{host}' is not allowed"
+    try:
+        if not ipaddress.ip_address(host).is_global:
+            return f"webhook host '{host}' is not a public address"
+    except ValueError:
+        pass
+    return None
+
+def resolve_webhook(url):
+    """
+    (address, error) for POSTing a job to `url`: the address its host
+    resolves to now, if every address it resolves to is public, else an
+    error. The POST connects to that address instead of resolving the host
+    again, so DNS cannot re-point it (rebinding) between check and connect.
+    An allowlisted host is trusted as is and not resolved: (None, None).
+    """
+    error = webhook_url_error(url)
+    if error or _WEBHOOK_ALLOWED_HOSTS:
+        return None, error
+    parts = urllib.parse.urlsplit(url)
+    host = parts.hostname.lower()
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            infos = socket.getaddrinfo(host, parts.port or (443 if parts.scheme == "https" else 80),
+                                       proto=socket.IPPROTO_TCP)
+        except socket.gaierror:
+            return None, f"webhook host '{host}' does not resolve"
+        addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    if not all(addr.is_global for addr in addresses):
+        return None, f"webhook host '{host}' is not a public address"
+    return str(addresses[0]), None
+
+class PinnedAdapter(HTTPAdapter):
+    """
+    Connects to `address` whatever the URL's host resolves to by then. The
+    Host header and TLS (SNI and the certificate check) keep the URL's host.
+    """
+    def __init__(self, address: str):
+        self.address = address
+        super().__init__()
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        if host_params["scheme"] == "https":
+            pool_kwargs["server_hostname"] = host_params["host"]
+            pool_kwargs["assert_hostname"] = host_params["host"]
+        host_params["host"] = self.address
+        return host_params, pool_kwargs
+
+    def send(self, request, **kwargs):
+        request.headers.setdefault("Host", urllib.parse.urlsplit(request.url).netloc.rpartition("@")[2])
+        return super().send(request, **kwargs)
+
+def notify_webhook(url: str, job: dict):
+    """
+    POSTs the finished job to its webhook. Best-effort: failures are only logged.
+    Redirects are not followed, since they could lead to a disallowed host.
+    """
+    address, error = resolve_webhook(url)
+    if error:
+        print(f"[api] webhook for {job['id']} skipped: {error}")
+        return
+    try:
+        with requests.Session() as session:
+            if address:
+                session.mount(url.split("://", 1)[0] + "://", PinnedAdapter(address))
+            r = session.post(url, json=job, timeout=_WEBHOOK_TIMEOUT_SECONDS, allow_redirects=False)
+        if r.status_code >= 400:
+            print(f"[api] webhook for {job['id']} returned {r.status_code}")
+    except requests.RequestException as e:
+        print(f"[api] webhook for {job['id']} failed: {e}")
+
+# ============================================================
+# Input file store
+# ============================================================
+# An image uploaded once to POST /v1/files and referenced by id in later edit
+# requests. Each use reopens the same bytes, so the backend's UploadCache
+# recognizes them and nothing is sent to ComfyUI again.
+_FILES = {}  # file_id -> file dict (see store_input_file)
+_FILES_LOCK = threading.Lock()
+
+def store_input_file(fileobj, filename: str, purpose: str = "vision", ttl: int = _FILE_TTL_SECONDS) -> dict:
+    """
+    Copies an uploaded image into FILES_DIR; raises ApiError if PIL cannot read it.
+    """
+    cleanup_files()
+    try:
+        fileobj.seek(0)
+        image_format = Image.open(fileobj).format
+    except Exception:
+        raise ApiError("The uploaded file is not a supported image.", param="file")
+
+    file_id = f"file-{uuid.uuid4().hex}"
+    path = os.path.join(_FILES_DIR, file_id)
+    os.makedirs(_FILES_DIR, exist_ok=True)
+    fileobj.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, _UPLOAD_CHUNK_BYTES)
+
+    created_at = _now()
+    record = {
+        "id": file_id,
+        "filename": secure_filename(filename or "") or "image.png",
+        "content_type": Image.MIME.get(image_format, "image/png"),
+        "purpose": purpose,
+        "bytes": os.path.getsize(path),
+        "created_at": created_at,
+        "expires_at": created_at + ttl,
+        "path": path,
+    }
+    with _FILES_LOCK:
+        _FILES[file_id] = record
+    return record
+
+def get_input_file(file_id: str):
+    cleanup_files()
+    with _FILES_LOCK:
+        return _FILES.get(file_id)
+
+def delete_input_file(file_id: str) -> bool:
+    with _FILES_LOCK:
+        record = _FILES.pop(file_id, None)
+    if record is None:
+        return False
+    _remove_file(record["path"])
+    return True
+
+def open_input_file(file_id: str):
+    """
+    Resolves a file id from an edit request to (file object, filename,
+    content_type). The open handle keeps the bytes readable even if the file
+    expires while the request runs.
+    """
+    record = get_input_file(file_id)
+    try:
+        if record is None:
+            raise OSError
+        return (open(record["path"], "rb"), record["filename"], record["content_type"])
+    except OSError:
+        raise ApiError(f"No file with id '{file_id}'; it may have expired.", param="image", code="file_not_found")
+
+def cleanup_files():
+    now = _now()
+    with _FILES_LOCK:
+        dead = [_FILES.pop(k) for k, record in list(_FILES.items()) if record["expires_at"] < now]
+    for record in dead:
+        _remove_file(record["path"])
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def file_view(record: dict) -> dict:
+    return {
+        "id": record["id"],
+        "object": "file",
+        "bytes": record["bytes"],
+        "created_at": record["created_at"],
+        "expires_at": record["expires_at"],
+        "filename": record["filename"],
+        "purpose": record["purpose"],
+    }
+
+def file_ref(value):
+    """
+    The file id an edit 'image' value refers to ("file-..." or {"file_id": ...}), else None.
+    """
+    if isinstance(value, dict):
+        value = value.get("file_id")
+    if isinstance(value, str) and value.startswith("file-"):
+        return value
+    return None
 
 # ============================================================
 # Helpers: OpenAI-ish parsing and formatting
@@ -264,12 +2133,36 @@ def cleanup_temp_images():
         for k in dead:
             _TEMP_IMAGES.pop(k, None)
 
-def make_public_url(path: str) -> str:
+def make_public_url(path: str, base: str = None) -> str:
     # prefer configured public base URL, else infer from request
-    base = PUBLIC_BASE_URL or request.host_url.rstrip("/")
+    base = PUBLIC_BASE_URL or base or request.host_url.rstrip("/")
     return f"{base}{path}"
 
-def openai_error(message: str, status: int = 400, param: str = None, code: str = None, err_type: str = "invalid_request_error"):
+def disconnect_checker(environ):
+    """
+    Returns a callable telling whether the HTTP client closed its connection,
+    or None when the server does not expose the socket (or it is TLS, which
+    cannot be peeked). Works with gunicorn and the werkzeug dev server.
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None or isinstance(sock, ssl.SSLSocket):
+        return None
+
+    def is_disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            # readable with no data pending means the peer sent FIN
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except (BlockingIOError, InterruptedError):
+            return False
+        except (OSError, ValueError):
+            return True
+
+    return is_disconnected
+
+def openai_error(message: str, status: int = 400, param: str = None, code: str = None, err_type: str = "invalid_request_error", headers: dict = None):
     payload = {
         "error": {
             "message": message,
@@ -278,9 +2171,11 @@ def openai_error(message: str, status: int = 400, param: str = None, code: str =
             "code": code
         }
     }
+    if headers:
+        return jsonify(payload), status, headers
     return jsonify(payload), status
 
-def build_images_response(created: int, data_list, response_format: str, output_format: str = None, size: str = None, quality: str = None, background: str = None):
+def images_response_body(created: int, data_list, output_format: str = None, size: str = None, quality: str = None, background: str = None) -> dict:
     """
     OpenAI Images API response shape:
       { created, data: [ {b64_json|url} ... ] }
@@ -296,11 +2191,374 @@ def build_images_response(created: int, data_list, response_format: str, output_
         resp["quality"] = quality
     if background:
         resp["background"] = background
-    return jsonify(resp)
+    return resp
+
+def build_images_response(created: int, data_list, response_format: str, output_format: str = None, size: str = None, quality: str = None, background: str = None):
+    return jsonify(images_response_body(created, data_list, output_format=output_format, size=size, quality=quality, background=background))
 
 def sse_format(event_name: str, data_obj: dict) -> str:
     return f"event: {event_name}\ndata: {json.dumps(data_obj, separators=(',', ':'))}\n\n"
 
+def bearer_token(headers):
+    """
+    API key from an "Authorization: Bearer <key>" header, or None.
+    """
+    auth = headers.get("Authorization") or ""
+    if auth.lower().startswith("bearer "):
+        return auth[7:].strip() or None
+    return None
+
+def parse_image_params(data, mode: str, is_json: bool = True, api_key: str = None) -> dict:
+    """
+    Parses the OpenAI Images API parameters shared by generations and edits.
+    `data` is the JSON body (dict) or the multipart form (MultiDict).
+    api_key selects the priority lane if it is pinned in _KEY_PRIORITIES.
+    Raises ApiError on invalid input.
+    """
+    default_model = "flux-krea-dev" if mode == "gen" else "flux-kontext-dev"
+    raw_model_id = data.get("model", default_model)
+    model_id = normalize_model_id(raw_model_id)
+    model = workflows.get_model(model_id)  # this version serves the whole request, even across a reload
+    if model is not None:
+        model_id = model.model_id  # an alias (e.g. the workflow's file name) resolves to the registered id
+
+    prompt_text = data.get("prompt")
+    if not prompt_text:
+        raise ApiError("Missing required parameter: prompt", param="prompt")
+
+    # OpenAI Image API params we accept (best-effort)
+    response_format = (data.get("response_format") or "b64_json").lower()
+    if response_format not in ("b64_json", "url"):
+        raise ApiError("response_format must be 'b64_json' or 'url'", param="response_format")
+
+    output_format = (data.get("output_format") or "png").lower()
+    if output_format not in ("png", "jpeg", "webp"):
+        raise ApiError("output_format must be 'png', 'jpeg', or 'webp'", param="output_format")
+
+    if is_json:
+        stream = bool(data.get("stream") or False)
+        run_async = bool(data.get("async") or False)
+    else:
+        stream = (str(data.get("stream", "false")).lower() == "true")
+        run_async = (str(data.get("async", "false")).lower() == "true")
+    if stream and run_async:
+        raise ApiError("stream and async cannot be combined", param="async")
+
+    n = clamp_int(data.get("n"), 1, 1, 10, "n")
+    if stream and n != 1:
+        # set here, so admission control charges the one image that runs
+        print("[api] stream=true with n!=1: only the first image will be streamed; others ignored.")
+        n = 1
+
+    webhook_url = data.get("webhook_url") or None
+    if webhook_url is not None:
+        if not run_async:
+            raise ApiError("webhook_url requires async=true", param="webhook_url")
+        error = webhook_url_error(webhook_url)
+        if error:
+            raise ApiError(error, param="webhook_url")
+
+    priority = _KEY_PRIORITIES.get(api_key) if api_key else None
+    if priority is None:
+        priority = (data.get("priority") or "normal").lower()
+    if priority not in _PRIORITIES:
+        raise ApiError("priority must be 'high', 'normal', or 'low'", param="priority")
+
+    size_str = data.get("size", "auto")
+    width, height = parse_size(size_str, mode, max_megapixels=workflows.max_megapixels(model_id))
+
+    # Warn about unsupported but ignore
+    ignored = ("moderation", "style", "user") if mode == "gen" else ("user", "moderation", "input_fidelity")
+    for k in ignored:
+        if data.get(k) not in (None, "", [], {}):
+            print(f"[{model_id}] Ignoring unsupported parameter: {k}")
+
+    return {
+        "mode": mode,
+        "raw_model_id": raw_model_id,
+        "model_id": model_id,
+        "workflow_model": model,  # workflows.WorkflowModel, or None for an unknown model
+        "prompt": prompt_text,
+        "n": n,
+        "width": width,
+        "height": height,
+        "response_format": response_format,
+        "output_format": output_format,
+        "output_compression": clamp_int(data.get("output_compression"), 100, 0, 100, "output_compression"),
+        "background": data.get("background"),  # transparent/opaque/auto (best-effort)
+        "quality": data.get("quality"),        # ignored by most comfy workflows
+        "partial_images": clamp_int(data.get("partial_images"), 0, 0, 3, "partial_images"),
+        "stream": stream,
+        "async": run_async,
+        "webhook_url": webhook_url,
+        "priority": priority,
+    }
+
+def decode_base64_file(text: str, start: int = 0):
+    """
+    Decodes text[start:] (base64, whitespace allowed) chunk by chunk into a
+    spooled temp file, so the decoded image never sits in memory whole next
+    to its base64 form. Raises binascii.Error (a ValueError) on bad input.
+    """
+    out = spooled_file()
+    step = _UPLOAD_CHUNK_BYTES // 3 * 4
+    carry = ""
+    for offset in range(start, len(text), step):
+        piece = carry + "".join(text[offset:offset + step].split())
+        cut = len(piece) - len(piece) % 4
+        out.write(base64.b64decode(piece[:cut]))
+        carry = piece[cut:]
+    if carry:
+        out.write(base64.b64decode(carry))
+    out.seek(0)
+    return out
+
+def decode_json_images(data: dict):
+    """
+    Decodes the 'image' (or 'images') field of a JSON edit request (data URLs,
+    raw base64 or file ids from POST /v1/files) into a list of (file object,
+    filename, content_type). Raises ApiError for an unknown file id.
+    The field is popped off `data` and each base64 string is dropped once it
+    is spooled, so the request holds no copy of it while uploads run.
+    """
+    items = data.pop("image", None) or data.pop("images", None)
+    if not isinstance(items, list):
+        items = [items]
+
+    out = []
+    for idx in range(len(items)):
+        item, items[idx] = items[idx], None
+        file_id = file_ref(item)
+        if file_id:
+            try:
+                out.append(open_input_file(file_id))
+            except ApiError:
+                close_edit_inputs(out)
+                raise
+            continue
+        if not isinstance(item, str):
+            print("[api] JSON image item is not a string; ignoring.")
+            continue
+        start = 0
+        content_type = "image/png"
+        filename = f"image_{idx}.png"
+        if item.startswith("data:"):
+            # data:image/png;base64,<data> (sliced by offset, not copied)
+            comma = item.find(",", 0, 256)
+            if comma != -1:
+                header = item[:comma]
+                start = comma + 1
+                if ";base64" in header:
+                    content_type = header[5:].split(";")[0]
+                    ext = content_type.split("/")[-1]
+                    filename = f"image_{idx}.{ext}"
+        try:
+            fileobj = decode_base64_file(item, start)
+        except Exception:
+            print("[api] Could not base64-decode a JSON image; ignoring.")
+            continue
+        out.append((fileobj, filename, content_type))
+    return out
+
+_IMAGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=_IMAGE_WORKERS, thread_name_prefix="image")
+
+def _float32(value: float) -> float:
+    return struct.unpack("<f", struct.pack("<f", value))[0]
+
+def _nearest_exact_indices(size_in: int, size_out: int) -> list:
+    """
+    Source index of each output index under torch's "nearest-exact"
+    interpolation, which computes floorf((i + 0.5) * scale) with a float32 scale.
+    """
+    scale = _float32(size_in / size_out)
+    return [min(int(math.floor(_float32((i + 0.5) * scale))), size_in - 1) for i in range(size_out)]
+
+def _resize_nearest_exact(img, size):
+    # whole columns, then whole rows, are picked from the source
+    columns = _nearest_exact_indices(img.size[0], size[0])
+    wide = Image.new(img.mode, (size[0], img.size[1]))
+    for x, src in enumerate(columns):
+        wide.paste(img.crop((src, 0, src + 1, img.size[1])), (x, 0))
+    rows = _nearest_exact_indices(img.size[1], size[1])
+    out = Image.new(img.mode, size)
+    for y, src in enumerate(rows):
+        out.paste(wide.crop((0, src, size[0], src + 1)), (0, y))
+    return out
+
+# upscale_method of ComfyUI's scaler nodes -> a resize producing the same
+# pixels ("lanczos" is PIL's LANCZOS in ComfyUI too). Other methods run in
+# torch with no PIL equivalent, so their inputs are not downscaled.
+_RESAMPLERS = {
+    "lanczos": lambda img, size: img.resize(size, Image.LANCZOS),
+    "nearest-exact": _resize_nearest_exact,
+}
+
+def total_pixels_size(width: int, height: int, megapixels: float) -> tuple:
+    """
+    Output size of ComfyUI's ImageScaleToTotalPixels (resolution_steps 1).
+    """
+    scale = math.sqrt(megapixels * 1024 * 1024 / float(width * height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def downscale_input(image, megapixels, resample: str = "lanczos"):
+    """
+    Returns an edit input as (file object, filename, content_type), resized
+    to `megapixels` (ComfyUI megapixels, 1024*1024 px) if it is larger. The
+    workflow's ImageScaleToTotalPixels node would scale it to that size
+    anyway, so this saves upload bytes and decode time without changing the
+    output: the size is ComfyUI's, the resize is the node's upscale_method
+    (`resample`), and the result is re-encoded losslessly as PNG, so the
+    node finds the image already at its size and leaves it as is. Like
+    ComfyUI's LoadImage, EXIF orientation is applied and the color channels
+    are resized apart from alpha. Anything within budget, that PIL cannot
+    read, or whose method cannot be reproduced passes through untouched.
+    `image` is a FileStorage or such a tuple.
+    """
+    if not isinstance(image, tuple):
+        image = (image.stream, image.filename or "image.png", image.content_type or "image/png")
+    fileobj, filename, content_type = image
+    if not megapixels or resample not in _RESAMPLERS:
+        return image
+
+    try:
+        fileobj.seek(0)
+        img = Image.open(fileobj)
+        if img.size[0] * img.size[1] <= megapixels * 1024 * 1024 or \
+                img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "CMYK", "YCbCr"):
+            return image
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        size = total_pixels_size(width, height, megapixels)
+        if total_pixels_size(size[0], size[1], megapixels) != size:
+            return image  # the node would resize our result again
+
+        has_alpha = img.mode in ("LA", "RGBA") or (img.mode == "P" and "transparency" in img.info)
+        rgb = _RESAMPLERS[resample](img.convert("RGB"), size)
+        if has_alpha:
+            alpha = _RESAMPLERS[resample](img.convert("RGBA").getchannel("A"), size)
+            rgb.putalpha(alpha)
+
+        out = spooled_file()
+        rgb.save(out, format="PNG")
+        out.seek(0)
+        filename = os.path.splitext(filename)[0] + ".png"
+        print(f"[api] downscaled {filename} from {width}x{height} to {size[0]}x{size[1]}")
+        return (out, filename, "image/png")
+    except Exception as e:
+        print(f"[api] could not downscale {filename}: {e}; uploading as is")
+        fileobj.seek(0)
+        return image
+
+def prepare_edit_inputs(model, images) -> list:
+    """
+    Downscales the edit inputs to their slots' pixel budgets on the shared
+    image executor; returns (file object, filename, content_type) in order.
+    `model` is a model id or a workflows.WorkflowModel.
+    """
+    budgets = workflows.input_megapixels(model, len(images)) if _DOWNSCALE_INPUTS else [None] * len(images)
+    resample = workflows.input_resample(model)
+    return list(_IMAGE_EXECUTOR.map(lambda image, megapixels: downscale_input(image, megapixels, resample),
+                                    images, budgets))
+
+def request_model(params: dict):
+    """
+    The WorkflowModel the request resolved, else its model id.
+    """
+    return params.get("workflow_model") or params["model_id"]
+
+def plan_batches(params: dict, count: int) -> list:
+    """
+    Batch sizes of the ComfyUI executions needed for `count` images: latent
+    batches where the model's workflow supports them, else one per image.
+    """
+    per_run = 1
+    if _NATIVE_BATCH and params["mode"] in workflows.batch_modes(request_model(params)):
+        per_run = _MAX_BATCH_SIZE
+    return [min(per_run, count - i) for i in range(0, count, per_run)]
+
+def build_workflow(params: dict, seed: int, images=None, batch_size: int = 1) -> dict:
+    kwargs = dict(
+        mode=params["mode"],
+        prompt=params["prompt"],
+        width=params["width"],
+        height=params["height"],
+        seed=seed,
+        quality=params["quality"],
+        background=params["background"],
+    )
+    if params["mode"] == "edit":
+        kwargs["images"] = images
+    wf = workflows.get_workflow(request_model(params), websocket_output=_WS_IMAGE_OUTPUT, batch_size=batch_size, **kwargs)
+    if not wf:
+        kind = "generations" if params["mode"] == "gen" else "edits"
+        raise ValueError(f"Model {params['model_id']} (raw: {params['raw_model_id']}) not supported for {kind}.")
+    return wf
+
+def history_image_refs(history: dict):
+    """
+    Returns (filename, subfolder, type) for every image in a /history entry.
+    """
+    refs = []
+    outputs = history.get("outputs", {})
+    for node_id in outputs:
+        node_output = outputs[node_id]
+        if "images" in node_output:
+            for img in node_output["images"]:
+                refs.append((img["filename"], img["subfolder"], img["type"]))
+    return refs
+
+def convert_outputs(raw_images, params: dict):
+    # Convert each returned image into requested output_format
+    return [
+        convert_image_bytes(b, output_format=params["output_format"], output_compression=params["output_compression"], background=params["background"])
+        for b in raw_images
+    ]
+
+def build_data_items(images_bytes, params: dict, base_url: str = None):
+    items = []
+    if params["response_format"] == "b64_json":
+        for b in images_bytes:
+            items.append({"b64_json": base64.b64encode(b).decode("utf-8")})
+    else:
+        for b in images_bytes:
+            token = store_temp_image(b, params["output_format"])
+            items.append({"url": make_public_url(f"/v1/images/tmp/{token}", base=base_url)})
+    return items
+
+def images_response_kwargs(params: dict) -> dict:
+    return {
+        "output_format": params["output_format"],
+        "size": f"{params['width']}x{params['height']}",
+        "quality": params["quality"] or "auto",
+        "background": params["background"] or "auto",
+    }
+
+def stream_event(params: dict, kind: str, created_at: int, **fields):
+    """
+    Builds one SSE event for the streaming Images API.
+    kind is e.g. "partial_image" or "completed"; the event is named
+    image_generation.<kind> for generations and image_edit.<kind> for edits.
+    """
+    prefix = "image_generation" if params["mode"] == "gen" else "image_edit"
+    event_name = f"{prefix}.{kind}"
+    payload = {"type": event_name}
+    payload.update(fields)
+    payload["created_at"] = created_at
+    payload.update(images_response_kwargs(params))
+    return sse_format(event_name, payload)
+
+# ============================================================
+# Routes: request size limit
+# ============================================================
+# Werkzeug refuses bodies over this from Content-Length (or while reading a
+# chunked body) before buffering them
+app.config["MAX_CONTENT_LENGTH"] = _MAX_INPUT_BYTES
+
+@app.errorhandler(413)
+def request_too_large(_e):
+    return openai_error(f"Request body exceeds the {_MAX_INPUT_BYTES} byte input limit.", status=413,
+                        param="image", code="request_too_large")
+
 # ============================================================
 # Routes: temp image serving (for response_format="url")
 # ============================================================
@@ -326,8 +2584,7 @@ def get_temp_image(token):
 @app.route("/v1/models", methods=["GET"])
 def list_models():
     """
-    Dynamically lists available models based on workflows/*.py files
-    via workflows.get_supported_models().
+    Lists the models in the workflow registry (workflows.get_supported_models()).
     """
     if not hasattr(workflows, "get_supported_models"):
         # Safety fallback (should not happen in the refactored layout)
@@ -344,113 +2601,240 @@ def list_models():
         ]
     })
 
-# ------------------------------------------------------------
-# POST /v1/images/generations
-# ------------------------------------------------------------
-@app.route("/v1/images/generations", methods=["POST"])
-def images_generations():
-    if not request.is_json:
-        return openai_error("Request must be application/json", param="Content-Type")
-
-    data = request.get_json(silent=True) or {}
-
-    raw_model_id = data.get("model", "flux-krea-dev")
-    model_id = normalize_model_id(raw_model_id)
+def _run_images(params: dict, uploaded_names=None, is_disconnected=None, client=None, listener=None):
+    """
+    Runs the workflow until n images are collected; returns converted image bytes.
 
-    prompt_text = data.get("prompt")
-    if not prompt_text:
-        return openai_error("Missing required parameter: prompt", param="prompt")
+    All executions needed for the missing images are queued up front with
+    distinct seeds and collected as they finish, so ComfyUI does not idle
+    while earlier results are downloaded and converted.
+    """
+    out_images = []
+    watches = []
+    try:
+        while len(out_images) < params["n"]:
+            if is_disconnected is not None and is_disconnected():
+                raise ClientDisconnectedError()
+            batches = plan_batches(params, params["n"] - len(out_images))
+            seeds = random.sample(range(1, 10**15), len(batches))
+            watches = []
+            try:
+                for seed, batch_size in zip(seeds, batches):
+                    wf = build_workflow(params, seed, images=uploaded_names, batch_size=batch_size)
+                    watches.append(submit_workflow(wf, client=client, listener=listener,
+                                                   timeout=deadline_for(params["model_id"]), model_id=params["model_id"],
+                                                   priority=params["priority"]))
+            except Exception:
+                cancel_workflows(watches, client, reason="request_failed")
+                raise
 
-    n = clamp_int(data.get("n"), 1, 1, 10, "n")
-    size_str = data.get("size", "auto")
-    width, height = parse_size(size_str, "gen")
+            received = 0
+            completed = iter_completed(watches, client=client, is_disconnected=is_disconnected)
+            try:
+                for _watch, raw_images in completed:
+                    received += len(raw_images)
+                    out_images.extend(convert_outputs(raw_images, params))
+            finally:
+                completed.close()
+            if not received:
+                raise ValueError("No images returned from workflow execution.")
+    except requests.ConnectionError as e:
+        if not out_images and is_connect_error(e) and not any(w.queued_at for w in watches):
+            raise BackendRefusedError(*e.args) from e
+        if isinstance(e, BackendRefusedError):
+            # part of the request already ran on this backend
+            raise requests.ConnectionError(*e.args) from e
+        raise
+    return out_images[:params["n"]]
+
+def _with_admission(params: dict, handler):
+    """
+    Runs handler() (which uploads and generates) only if admit() lets the
+    request in; otherwise answers 429 with Retry-After before any upload.
+    The admission is released when the response is closed, i.e. after the
+    last streamed byte or when the client goes away.
+    """
+    try:
+        release = admit(params)
+    except OverloadedError as e:
+        return _overloaded_error(e)
+    try:
+        response = app.make_response(handler())
+    except BaseException:
+        release()
+        raise
+    response.call_on_close(release)
+    return response
+
+def _overloaded_error(e):
+    return openai_error(e.message, status=e.status, code=e.code, err_type=e.err_type,
+                        headers={"Retry-After": str(e.retry_after)})
+
+def _start_job(params: dict, images=None):
+    """
+    Admits the request and hands it to a job worker; answers 202 with the job.
+    Multipart files are copied here, before the request that owns them ends.
+    """
+    try:
+        release = admit(params)
+    except OverloadedError as e:
+        close_edit_inputs(images)
+        return _overloaded_error(e)
+    images = [
+        image if isinstance(image, tuple) else (spool_copy(image.stream), image.filename or "image.png", image.content_type or "image/png")
+        for image in images or []
+    ]
+    # result URLs are built after the request is gone
+    base_url = PUBLIC_BASE_URL or request.host_url.rstrip("/")
+    job = create_job(params)
+    try:
+        _JOB_EXECUTOR.submit(_run_job, job["id"], params, images, base_url, release)
+    except BaseException:
+        close_edit_inputs(images)
+        release()
+        raise
+    print(f"[api] job {job['id']} accepted ({params['model_id']}, n={params['n']})")
+    return jsonify(job_view(job)), 202, {"Location": f"/v1/images/jobs/{job['id']}"}
+
+def _run_job(job_id: str, params: dict, images, base_url: str, release):
+    def listener(event, data):
+        if event == "progress":
+            update_job_progress(job_id, data["value"], data["max"])
+
+    result = error = None
+    prepared = None
+    try:
+        prepared = prepare_edit_inputs(request_model(params), images) if images else None
+        created = _now()
+        out_images = run_with_failover(params, lambda client: run_edit(
+            client, prepared, lambda names: _run_images(params, names, client=client, listener=listener)))
+        result = images_response_body(created, build_data_items(out_images, params, base_url=base_url),
+                                      **images_response_kwargs(params))
+    except ApiError as e:
+        error = {"message": e.message, "type": e.err_type, "param": e.param, "code": e.code}
+    except Exception as e:
+        error = {"message": str(e), "type": "server_error"}
+    finally:
+        close_edit_inputs(images)
+        close_edit_inputs(prepared)
+        release()
 
-    # OpenAI Image API params we accept (best-effort)
-    response_format = (data.get("response_format") or "b64_json").lower()
-    if response_format not in ("b64_json", "url"):
-        return openai_error("response_format must be 'b64_json' or 'url'", param="response_format")
+    job = finish_job(job_id, result=result, error=error)
+    print(f"[api] job {job_id} {job['status']}")
+    if params["webhook_url"]:
+        notify_webhook(params["webhook_url"], job)
 
-    output_format = (data.get("output_format") or "png").lower()
-    output_compression = clamp_int(data.get("output_compression"), 100, 0, 100, "output_compression")
-    background = data.get("background")  # transparent/opaque/auto (best-effort)
-    quality = data.get("quality")        # ignored by most comfy workflows
-    partial_images = clamp_int(data.get("partial_images"), 0, 0, 3, "partial_images")
-    stream = bool(data.get("stream") or False)
+def _queue_position_or_none(watch, client=None):
+    try:
+        return (client or COMFY_CLIENT).get_queue_position(watch.prompt_id, queued_at=watch.queued_at or 0.0)
+    except Exception as e:
+        print(f"[api] /queue poll failed: {e}")
+        return None
 
-    # Warn about unsupported but ignore
-    for k in ("moderation", "style", "user"):
-        if data.get(k) not in (None, "", [], {}):
-            print(f"[{model_id}] Ignoring unsupported parameter: {k}")
+def _images_response(params: dict, images=None):
+    """
+    Runs a generation, or an edit of the prepared input `images`. All ComfyUI
+    calls of a request go to one backend, which also gets the uploads; one
+    that cannot be reached is swapped for another (run_with_failover).
+    """
+    def upload(client):
+        return upload_edit_images(client, images) if images else None
 
-    def run_generation_once():
-        seed = random.randint(1, 10**15)
-        wf = workflows.get_workflow(
-            model_id,
-            mode="gen",
-            prompt=prompt_text,
-            width=width,
-            height=height,
-            seed=seed,
-            quality=quality,
-            background=background,
-        )
-        if not wf:
-            raise ValueError(f"Model {model_id} (raw: {raw_model_id}) not supported for generations.")
-
-        raw_images = execute_workflow(wf)
-        if not raw_images:
-            raise ValueError("No images returned from workflow execution.")
-
-        # Convert each returned image into requested output_format
-        converted = [convert_image_bytes(b, output_format=output_format, output_compression=output_compression, background=background) for b in raw_images]
-        return converted
-
-    def build_data_items(images_bytes):
-        items = []
-        if response_format == "b64_json":
-            for b in images_bytes:
-                items.append({"b64_json": base64.b64encode(b).decode("utf-8")})
-        else:
-            for b in images_bytes:
-                token = store_temp_image(b, output_format)
-                items.append({"url": make_public_url(f"/v1/images/tmp/{token}")})
-        return items
+    # Checked while waiting on ComfyUI so abandoned requests stop using the GPU
+    is_disconnected = disconnect_checker(request.environ)
 
     # Streaming (SSE) per OpenAI Image Streaming: partial + completed events
-    if stream:
-        if n != 1:
-            print("[api] stream=true with n!=1: only the first image will be streamed; others ignored.")
-            n = 1
+    if params["stream"]:
+        try:
+            client, uploaded_names = run_with_failover(params, lambda c: (c, upload(c)))
+        except ApiError as e:
+            return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
 
         def gen():
             created_at = _now()
+            events = queue.Queue()
+            sampler = PartialImageSampler(params["partial_images"])
+
+            def listener(event, data):
+                if event == "progress" or sampler.accept(data["progress"]):
+                    events.put((event, data))
+
+            # Flush headers and first bytes before touching ComfyUI
+            yield ": stream opened\n\n"
+            watch = None
             try:
-                imgs = run_generation_once()
+                wf = build_workflow(params, random.randint(1, 10**15), images=uploaded_names)
+                watch = submit_workflow(wf, client=client, listener=listener, timeout=deadline_for(params["model_id"]),
+                                        model_id=params["model_id"], priority=params["priority"])
+                watch.future.add_done_callback(lambda _f: events.put(("done", None)))
+
+                position = _queue_position_or_none(watch, client)
+                yield stream_event(params, "queued", created_at, queue_position=position)
+
+                # Relay progress and sampler previews (as partial images) while the job runs;
+                # heartbeat comments keep proxies from timing out a quiet stream.
+                partial_index = 0
+                started = False
+                next_heartbeat = time.time() + _SSE_HEARTBEAT_SECONDS
+                while True:
+                    remaining = watch.remaining()
+                    if remaining is not None and remaining <= 0:
+                        expire_workflow(watch, client)
+                    if is_disconnected is not None and is_disconnected():
+                        cancel_workflow(watch, client, reason="client_disconnected")
+                        return
+                    wait = max(0.0, next_heartbeat - time.time())
+                    if is_disconnected is not None:
+                        wait = min(wait, _DISCONNECT_POLL_SECONDS)
+                    if remaining is not None:
+                        wait = min(wait, remaining)
+                    try:
+                        event, data = events.get(timeout=wait)
+                    except queue.Empty:
+                        if time.time() < next_heartbeat:
+                            continue
+                        next_heartbeat = time.time() + _SSE_HEARTBEAT_SECONDS
+                        if not started:
+                            new_position = _queue_position_or_none(watch, client)
+                            if new_position is not None and new_position != position:
+                                position = new_position
+                                yield stream_event(params, "queued", created_at, queue_position=position)
+                        yield ": heartbeat\n\n"
+                        continue
+                    if event == "done":
+                        break
+                    if event == "progress":
+                        started = True
+                        yield stream_event(params, "progress", created_at, step=data["value"], max_steps=data["max"])
+                        continue
+                    partial = convert_outputs([data["image"]], params)[0]
+                    yield stream_event(params, "partial_image", created_at,
+                                       b64_json=base64.b64encode(partial).decode("utf-8"),
+                                       partial_image_index=partial_index)
+                    partial_index += 1
+
                 # Only one "image" conceptually; we may still have multiple outputs from Comfy.
-                final_img = imgs[0]
-
-                # Emit a "partial_image" if requested (best-effort; we send the same bytes)
-                if partial_images > 0:
-                    yield sse_format("image_generation.partial_image", {
-                        "type": "image_generation.partial_image",
-                        "b64_json": base64.b64encode(final_img).decode("utf-8"),
-                        "created_at": created_at,
-                        "size": f"{width}x{height}",
-                        "quality": quality or "auto",
-                        "background": background or "auto",
-                        "output_format": output_format,
-                        "partial_image_index": 0
-                    })
-
-                yield sse_format("image_generation.completed", {
-                    "type": "image_generation.completed",
-                    "b64_json": base64.b64encode(final_img).decode("utf-8"),
-                    "created_at": created_at,
-                    "size": f"{width}x{height}",
-                    "quality": quality or "auto",
-                    "background": background or "auto",
-                    "output_format": output_format,
-                })
+                raw_images = collect_workflow(watch, client)
+                if not raw_images:
+                    raise ValueError("No images returned from workflow execution.")
+                final_img = convert_outputs(raw_images[:1], params)[0]
+                b64 = base64.b64encode(final_img).decode("utf-8")
+
+                yield stream_event(params, "completed", created_at, b64_json=b64)
+            except requests.ConnectionError as e:
+                e = COMFY_POOL.report_failure(client, e)
+                yield sse_format("error", {"error": {"message": e.message, "type": e.err_type, "param": None, "code": e.code}})
+            except GeneratorExit:
+                # the server closes the generator when a write to the client fails
+                if watch is not None and not watch.future.done():
+                    cancel_workflow(watch, client, reason="client_disconnected")
+                raise
+            except ApiError as e:
+                if uploaded_names and is_missing_input_error(e):
+                    # events were sent already, so only the next request uploads them again
+                    client.uploads.discard(uploaded_names)
+                err = {"error": {"message": e.message, "type": e.err_type, "param": e.param, "code": e.code}}
+                yield sse_format("error", err)
             except Exception as e:
                 err = {"error": {"message": str(e), "type": "server_error"}}
                 yield sse_format("error", err)
@@ -462,244 +2846,208 @@ def images_generations():
 
     # Non-streaming
     created = _now()
-    out_images = []
     try:
-        while len(out_images) < n:
-            imgs = run_generation_once()
-            out_images.extend(imgs)
-        out_images = out_images[:n]
+        out_images = run_with_failover(params, lambda client: run_edit(
+            client, images, lambda names: _run_images(params, names, is_disconnected=is_disconnected, client=client)))
+    except ApiError as e:
+        return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
     except Exception as e:
         return openai_error(str(e), status=400)
 
     return build_images_response(
         created=created,
-        data_list=build_data_items(out_images),
-        response_format=response_format,
-        output_format=output_format,
-        size=f"{width}x{height}",
-        quality=quality or "auto",
-        background=background or "auto",
+        data_list=build_data_items(out_images, params),
+        response_format=params["response_format"],
+        **images_response_kwargs(params),
     )
 
+# ------------------------------------------------------------
+# POST /v1/images/generations
+# ------------------------------------------------------------
+@app.route("/v1/images/generations", methods=["POST"])
+def images_generations():
+    if not request.is_json:
+        return openai_error("Request must be application/json", param="Content-Type")
+
+    data = request.get_json(silent=True, cache=False) or {}
+    try:
+        params = parse_image_params(data, "gen", api_key=bearer_token(request.headers))
+    except ApiError as e:
+        return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
+
+    if params["async"]:
+        return _start_job(params)
+    return _with_admission(params, lambda: _images_response(params))
+
 # ------------------------------------------------------------
 # POST /v1/images/edits
 # ------------------------------------------------------------
 @app.route("/v1/images/edits", methods=["POST"])
 def images_edits():
     # OpenAI expects multipart/form-data for edits, but we also allow JSON fallback.
-    prompt_text = None
-    raw_model_id = None
-    response_format = None
-    output_format = None
-    output_compression = None
-    size_str = None
-    n = 1
-    stream = False
-    partial_images = 0
-    background = None
-    quality = None
-    input_fidelity = None
-
-    uploaded_names = []
-
     if request.is_json:
-        data = request.get_json(silent=True) or {}
-        prompt_text = data.get("prompt")
-        raw_model_id = data.get("model", "flux-kontext-dev")
-        response_format = (data.get("response_format") or "b64_json").lower()
-        output_format = (data.get("output_format") or "png").lower()
-        output_compression = clamp_int(data.get("output_compression"), 100, 0, 100, "output_compression")
-        size_str = data.get("size", "auto")
-        n = clamp_int(data.get("n"), 1, 1, 10, "n")
-        stream = bool(data.get("stream") or False)
-        partial_images = clamp_int(data.get("partial_images"), 0, 0, 3, "partial_images")
-        background = data.get("background")
-        quality = data.get("quality")
-        input_fidelity = data.get("input_fidelity")
+        data = request.get_json(silent=True, cache=False) or {}
+        try:
+            params = parse_image_params(data, "edit", is_json=True, api_key=bearer_token(request.headers))
+        except ApiError as e:
+            return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
 
-        images_field = data.get("image") or data.get("images")
-        if not images_field:
+        if not (data.get("image") or data.get("images")):
             return openai_error("No image provided. Provide 'image' (string or array) or use multipart/form-data.", param="image")
 
-        if not isinstance(images_field, list):
-            images_field = [images_field]
-
-        # Accept data URLs ("data:image/png;base64,...") or raw base64
-        for idx, item in enumerate(images_field):
-            if not isinstance(item, str):
-                print("[api] JSON image item is not a string; ignoring.")
-                continue
-            b64_part = item
-            content_type = "image/png"
-            filename = f"image_{idx}.png"
-            if item.startswith("data:"):
-                try:
-                    header, b64_part = item.split(",", 1)
-                    # data:image/png;base64
-                    if header.startswith("data:") and ";base64" in header:
-                        content_type = header[5:].split(";")[0]
-                        ext = content_type.split("/")[-1]
-                        filename = f"image_{idx}.{ext}"
-                except Exception:
-                    pass
-            try:
-                image_bytes = base64.b64decode(b64_part)
-            except Exception:
-                print("[api] Could not base64-decode a JSON image; ignoring.")
-                continue
-
-            uploaded_names.append(upload_image_bytes(image_bytes, filename=filename, content_type=content_type))
+        # Accept data URLs ("data:image/png;base64,..."), raw base64 or file ids
+        try:
+            images = decode_json_images(data)
+        except ApiError as e:
+            return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
 
     else:
         # multipart/form-data
-        prompt_text = request.form.get("prompt")
-        raw_model_id = request.form.get("model", "flux-kontext-dev")
-        response_format = (request.form.get("response_format") or "b64_json").lower()
-        output_format = (request.form.get("output_format") or "png").lower()
-        output_compression = clamp_int(request.form.get("output_compression"), 100, 0, 100, "output_compression")
-        size_str = request.form.get("size", "auto")
-        n = clamp_int(request.form.get("n"), 1, 1, 10, "n")
-        stream = (request.form.get("stream", "false").lower() == "true")
-        partial_images = clamp_int(request.form.get("partial_images"), 0, 0, 3, "partial_images")
-        background = request.form.get("background")
-        quality = request.form.get("quality")
-        input_fidelity = request.form.get("input_fidelity")
-
-        # Collect images from common OpenAI styles:
-        files = []
-        for key in ("image", "image[]", "file", "file[]"):
-            files.extend(request.files.getlist(key))
+        try:
+            params = parse_image_params(request.form, "edit", is_json=False, api_key=bearer_token(request.headers))
+        except ApiError as e:
+            return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
+
+        # Collect images from common OpenAI styles, in field order; a text
+        # value of an image field is a file id from POST /v1/files
+        images = []
+        try:
+            for key in ("image", "image[]", "file", "file[]"):
+                images.extend(request.files.getlist(key))
+                images.extend(open_input_file(file_ref(v)) for v in request.form.getlist(key) if file_ref(v))
+        except ApiError as e:
+            close_edit_inputs(images)
+            return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
 
         # Fallback: collect all file keys
-        if not files and request.files:
+        if not images and request.files:
             print(f"[api] Warning: 'image' key not found. Found keys: {list(request.files.keys())}")
             for key in request.files:
-                files.extend(request.files.getlist(key))
+                images.extend(request.files.getlist(key))
 
-        if not files:
+        if not images:
             return openai_error("No image provided. Ensure multipart/form-data includes an image file.", param="image")
 
         # mask is supported by OpenAI edits API, but may not be supported by your Comfy workflows
         if "mask" in request.files:
             print("[api] mask provided but not supported by current workflows; ignoring.")
 
-        for f in files:
-            uploaded_names.append(upload_image(f))
-
-    if not prompt_text:
-        return openai_error("Missing required parameter: prompt", param="prompt")
-
-    if response_format not in ("b64_json", "url"):
-        return openai_error("response_format must be 'b64_json' or 'url'", param="response_format")
-
-    if output_format not in ("png", "jpeg", "webp"):
-        return openai_error("output_format must be 'png', 'jpeg', or 'webp'", param="output_format")
-
-    width, height = parse_size(size_str, "edit")
-    model_id = normalize_model_id(raw_model_id)
-
-    # Log/ignore unsupported OpenAI params
-    if input_fidelity not in (None, "", [], {}):
-        print(f"[{model_id}] Ignoring unsupported parameter: input_fidelity={input_fidelity}")
-    for k in ("user", "moderation"):
-        if (request.form.get(k) if not request.is_json else (request.get_json(silent=True) or {}).get(k)) not in (None, "", [], {}):
-            print(f"[{model_id}] Ignoring unsupported parameter: {k}")
-
-    def run_edit_once():
-        seed = random.randint(1, 10**15)
-        wf = workflows.get_workflow(
-            model_id,
-            mode="edit",
-            prompt=prompt_text,
-            width=width,
-            height=height,
-            seed=seed,
-            images=uploaded_names,
-            quality=quality,
-            background=background
-        )
-        if not wf:
-            raise ValueError(f"Model {model_id} (raw: {raw_model_id}) not supported for edits.")
+    if params["async"]:
+        return _start_job(params, images)  # the job closes them
+    try:
+        return _with_admission(params, lambda: _edit_response(params, images))
+    finally:
+        close_edit_inputs(images)
 
-        raw_images = execute_workflow(wf)
-        if not raw_images:
-            raise ValueError("No images returned from workflow execution.")
+_UPLOAD_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=_UPLOAD_WORKERS, thread_name_prefix="upload")
 
-        converted = [convert_image_bytes(b, output_format=output_format, output_compression=output_compression, background=background) for b in raw_images]
-        return converted
+def _upload_edit_image(client, image):
+    """
+    Uploads a multipart FileStorage or a decoded (file object, filename, content_type) tuple.
+    """
+    if isinstance(image, tuple):
+        fileobj, filename, content_type = image
+        return client.upload_image_file(fileobj, filename=filename, content_type=content_type)
+    return client.upload_image(image)
 
-    def build_data_items(images_bytes):
-        items = []
-        if response_format == "b64_json":
-            for b in images_bytes:
-                items.append({"b64_json": base64.b64encode(b).decode("utf-8")})
-        else:
-            for b in images_bytes:
-                token = store_temp_image(b, output_format)
-                items.append({"url": make_public_url(f"/v1/images/tmp/{token}")})
-        return items
+def upload_edit_images(client, images) -> list:
+    """
+    Uploads the images of one request concurrently on the shared upload
+    executor; names come back in input order, so images[i] still feeds the
+    workflow's i-th LoadImage. The first failure is raised; a connection
+    error as BackendRefusedError, since no prompt was queued yet.
+    """
+    try:
+        if len(images) == 1:
+            return [_upload_edit_image(client, images[0])]
+        return list(_UPLOAD_EXECUTOR.map(lambda image: _upload_edit_image(client, image), images))
+    except requests.ConnectionError as e:
+        raise BackendRefusedError(*e.args) from e
 
-    # Streaming SSE for edits
-    if stream:
-        if n != 1:
-            print("[api] stream=true with n!=1: only the first image will be streamed; others ignored.")
-            n = 1
+def run_edit(client, images, run):
+    """
+    Uploads the edit `images` to the backend and returns run(uploaded_names)
+    (run(None) without images). If the prompt cannot load an input (see
+    is_missing_input_error), their cached names are dropped and the images
+    uploaded and run once more.
+    """
+    if not images:
+        return run(None)
+    names = upload_edit_images(client, images)
+    try:
+        return run(names)
+    except ApiError as e:
+        if not is_missing_input_error(e):
+            raise
+        client.uploads.discard(names)
+        metric_inc("uploads", "reuploads")
+        print(f"[api] {client.base_url} could not load an input ({e.message}); uploading again")
+    return run(upload_edit_images(client, images))
+
+def _edit_response(params: dict, images):
+    # uploads are done when this returns, a stream's included
+    prepared = prepare_edit_inputs(request_model(params), images)
+    try:
+        return _images_response(params, prepared)
+    finally:
+        close_edit_inputs(prepared)
 
-        def gen():
-            created_at = _now()
-            try:
-                imgs = run_edit_once()
-                final_img = imgs[0]
-
-                if partial_images > 0:
-                    yield sse_format("image_edit.partial_image", {
-                        "type": "image_edit.partial_image",
-                        "b64_json": base64.b64encode(final_img).decode("utf-8"),
-                        "created_at": created_at,
-                        "size": f"{width}x{height}",
-                        "quality": quality or "auto",
-                        "background": background or "auto",
-                        "output_format": output_format,
-                        "partial_image_index": 0
-                    })
-
-                yield sse_format("image_edit.completed", {
-                    "type": "image_edit.completed",
-                    "b64_json": base64.b64encode(final_img).decode("utf-8"),
-                    "created_at": created_at,
-                    "size": f"{width}x{height}",
-                    "quality": quality or "auto",
-                    "background": background or "auto",
-                    "output_format": output_format,
-                })
-            except Exception as e:
-                err = {"error": {"message": str(e), "type": "server_error"}}
-                yield sse_format("error", err)
+# ------------------------------------------------------------
+# POST /v1/files, GET/DELETE /v1/files/<file_id> (edit inputs by reference)
+# ------------------------------------------------------------
+@app.route("/v1/files", methods=["POST"])
+def create_file():
+    upload = request.files.get("file")
+    if upload is None:
+        return openai_error("No file provided. Upload the image as multipart/form-data field 'file'.", param="file")
+    ttl = clamp_int(request.form.get("expires_after[seconds]"), _FILE_TTL_SECONDS, 60, _FILE_TTL_SECONDS, "expires_after")
+    try:
+        record = store_input_file(upload.stream, upload.filename, request.form.get("purpose") or "vision", ttl)
+    except ApiError as e:
+        return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
+    print(f"[api] stored {record['id']} ({record['bytes']} bytes, expires in {ttl}s)")
+    return jsonify(file_view(record))
+
+@app.route("/v1/files/<file_id>", methods=["GET"])
+def get_file(file_id):
+    record = get_input_file(file_id)
+    if record is None:
+        return openai_error("File not found or expired.", status=404, param="file_id")
+    return jsonify(file_view(record))
+
+@app.route("/v1/files/<file_id>", methods=["DELETE"])
+def delete_file(file_id):
+    if not delete_input_file(file_id):
+        return openai_error("File not found or expired.", status=404, param="file_id")
+    return jsonify({"id": file_id, "object": "file", "deleted": True})
 
-        return Response(gen(), mimetype="text/event-stream", headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-        })
+# ------------------------------------------------------------
+# GET /v1/images/jobs/<job_id> (requests made with "async": true)
+# ------------------------------------------------------------
+@app.route("/v1/images/jobs/<job_id>", methods=["GET"])
+def get_image_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return openai_error("Job not found or expired.", status=404, param="job_id")
+    return jsonify(job)
 
-    created = _now()
-    out_images = []
-    try:
-        while len(out_images) < n:
-            imgs = run_edit_once()
-            out_images.extend(imgs)
-        out_images = out_images[:n]
-    except Exception as e:
-        return openai_error(str(e), status=400)
+# ------------------------------------------------------------
+# GET /ready (503 until the startup model warm-up has finished)
+# ------------------------------------------------------------
+@app.route("/ready", methods=["GET"])
+def get_ready():
+    warmup = MODEL_WARMER.snapshot()
+    if not warmup["ready"]:
+        return jsonify({"status": "warming_up", "pending": warmup["pending"]}), 503
+    return jsonify({"status": "ready"})
 
-    return build_images_response(
-        created=created,
-        data_list=build_data_items(out_images),
-        response_format=response_format,
-        output_format=output_format,
-        size=f"{width}x{height}",
-        quality=quality or "auto",
-        background=background or "auto",
-    )
+# ------------------------------------------------------------
+# GET /metrics
+# ------------------------------------------------------------
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return jsonify(dict(metrics_snapshot(), backends=COMFY_POOL.snapshot(), admission=admission_snapshot(),
+                        workflows=WORKFLOW_RELOADER.snapshot()))
 
 # ------------------------------------------------------------
 # POST /v1/images/variations (not implemented in this wrapper)
@@ -708,5 +3056,9 @@ def images_edits():
 def images_variations():
     return openai_error("images/variations is not supported by this ComfyUI wrapper.", status=501)
 
+# These threads use the helpers above, so they start once those are defined
+MODEL_WARMER.start()
+WORKFLOW_RELOADER.start()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,960 @@
+"""
+ASGI serving mode for the wrapper.
+
+    uvicorn app_async:app --host 0.0.0.0 --port 5000
+
+In this mode a request waiting on ComfyUI costs a coroutine instead of a
+gunicorn thread: HTTP calls to ComfyUI go through an aiohttp session and
+prompt completion is awaited on the futures of the shared WebSocket
+dispatcher. Request parsing, workflow building and image conversion are
+shared with the Flask app in app.py, which remains the sync mode.
+"""
+import io
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import base64
+import contextlib
+
+import aiohttp
+import requests
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import app as sync_app
+import workflows
+
+# ============================================================
+# Configuration
+# ============================================================
+_ASYNC_POOL_SIZE = int(os.environ.get("COMFYUI_ASYNC_POOL_SIZE", "100"))
+_ASYNC_TIMEOUT = aiohttp.ClientTimeout(
+    sock_connect=sync_app._HTTP_TIMEOUT[0],
+    sock_read=sync_app._HTTP_TIMEOUT[1],
+)
+_ASYNC_UPLOAD_TIMEOUT = aiohttp.ClientTimeout(
+    sock_connect=sync_app._HTTP_UPLOAD_TIMEOUT[0],
+    sock_read=sync_app._HTTP_UPLOAD_TIMEOUT[1],
+)
+
+# Backend unreachable: from aiohttp calls, or from a release by the (threaded) prompt scheduler
+_CONNECT_ERRORS = (aiohttp.ClientConnectorError, requests.ConnectionError)
+
+# ============================================================
+# Async ComfyUI Client
+# ============================================================
+async def _file_chunks(fileobj):
+    # file reads run off the event loop (a spooled file may be on disk)
+    while True:
+        chunk = await asyncio.to_thread(fileobj.read, sync_app._UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+class AsyncComfyClient:
+    """
+    asyncio counterpart of app.ComfyClient for one ComfyUI backend.
+
+    Shares the backend's WebSocket dispatcher with the sync client, so both
+    serving modes multiplex over the same connection.
+    """
+    def __init__(self, client):
+        self.base_url = client.base_url
+        self.ws = client.ws
+        self.scheduler = client.scheduler
+        self.uploads = client.uploads  # shared with the sync client
+        self._session = None
+        self._queue_lock = asyncio.Lock()
+        self._queue_cache = (0.0, None)  # (fetched_at, /queue response)
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=_ASYNC_POOL_SIZE)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=_ASYNC_TIMEOUT)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _post(self, path, **kwargs):
+        async with self._get_session().post(f"{self.base_url}{path}", **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _get(self, path, read_json=True, **kwargs):
+        # idempotent GETs are retried with backoff, like the sync client
+        delay = 0.3
+        for attempt in range(sync_app._HTTP_GET_RETRIES + 1):
+            try:
+                async with self._get_session().get(f"{self.base_url}{path}", **kwargs) as response:
+                    if response.status in (502, 503, 504) and attempt < sync_app._HTTP_GET_RETRIES:
+                        raise aiohttp.ClientConnectionError(f"HTTP {response.status}")
+                    response.raise_for_status()
+                    if read_json:
+                        return await response.json(content_type=None)
+                    return await response.read()
+            except aiohttp.ClientConnectionError:
+                if attempt >= sync_app._HTTP_GET_RETRIES:
+                    raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def upload_image_bytes(self, image_bytes: bytes, filename="image.png", content_type="image/png", image_type="input"):
+        """
+        Uploads raw bytes to ComfyUI as an image file (see upload_image_file).
+        """
+        return await self.upload_image_file(io.BytesIO(image_bytes), filename=filename, content_type=content_type,
+                                            image_type=image_type)
+
+    async def upload_image_file(self, fileobj, filename="image.png", content_type="image/png", image_type="input"):
+        """
+        Uploads a seekable file object to ComfyUI as an image file named after
+        its content hash, skipping content the backend already has or is
+        being sent (see app.UploadCache). The file is hashed and sent in chunks.
+        """
+        key = await asyncio.to_thread(sync_app.UploadCache.key, fileobj)
+        while image_type == "input":
+            cached, pending = self.uploads.begin(key)
+            if cached is None and pending is None:
+                break  # ours to upload
+            try:
+                # shielded: cancelling this request must not cancel the shared upload
+                name = cached if cached is not None else await asyncio.shield(asyncio.wrap_future(pending))
+            except asyncio.CancelledError:
+                if pending is None or not pending.cancelled():
+                    raise  # this request was cancelled
+                continue  # its uploader gave up
+            sync_app.metric_inc("uploads", "deduplicated")
+            return name
+
+        final_name = sync_app.UploadCache.filename(key, filename)
+        form = aiohttp.FormData()
+        form.add_field("image", _file_chunks(fileobj), filename=final_name, content_type=content_type or "image/png")
+        form.add_field("type", image_type)
+        form.add_field("overwrite", "true")
+
+        try:
+            result = await self._post("/upload/image", data=form, timeout=_ASYNC_UPLOAD_TIMEOUT)
+            name = result.get("name", final_name)
+        except BaseException as e:
+            if image_type == "input":
+                self.uploads.finish(key, error=e)
+            raise
+        sync_app.metric_inc("uploads", "uploaded")
+        if image_type == "input":
+            self.uploads.finish(key, name=name)
+        return name
+
+    async def queue_prompt(self, prompt_workflow, prompt_id=None, client_id=None, front=False):
+        client_id = client_id or str(uuid.uuid4())
+        body = sync_app.prompt_request_body(prompt_workflow, client_id, prompt_id=prompt_id, front=front)
+        async with self._get_session().post(f"{self.base_url}/prompt", data=body,
+                                            headers={"Content-Type": "application/json"}) as response:
+            if response.status == 400:
+                raise sync_app.ComfyPromptError(await response.json(content_type=None))
+            response.raise_for_status()
+            result = await response.json(content_type=None)
+        return result["prompt_id"], client_id
+
+    async def get_history(self, prompt_id):
+        return await self._get(f"/history/{prompt_id}")
+
+    async def get_image_raw(self, filename, subfolder, folder_type):
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        return await self._get("/view", read_json=False, params=params)
+
+    async def get_queue(self, max_age=sync_app._QUEUE_CACHE_SECONDS, newer_than=0.0):
+        """
+        Returns ComfyUI's /queue, polled at most once per max_age seconds
+        (see app.ComfyClient.get_queue).
+        """
+        async with self._queue_lock:
+            fetched_at, data = self._queue_cache
+            if data is None or time.time() - fetched_at > max_age or fetched_at < newer_than:
+                data = await self._get("/queue")
+                self._queue_cache = (time.time(), data)
+            return data
+
+    async def get_queue_position(self, prompt_id, queued_at=0.0):
+        held = self.scheduler.position(prompt_id)
+        if held is not None:
+            queue_data = await self.get_queue()
+            return len(queue_data.get("queue_running") or []) + len(queue_data.get("queue_pending") or []) + held
+        return sync_app.queue_position(await self.get_queue(newer_than=queued_at), prompt_id)
+
+    async def cancel_prompt(self, prompt_id):
+        """
+        Deletes a pending prompt or interrupts a running one (see app.ComfyClient.cancel_prompt).
+        """
+        state = sync_app.prompt_queue_state(await self.get_queue(max_age=0), prompt_id)
+        if state == "pending":
+            await self._post("/queue", json={"delete": [prompt_id]})
+        elif state == "running":
+            await self._post("/interrupt", json={"prompt_id": prompt_id})
+        return {"pending": "deleted", "running": "interrupted"}.get(state)
+
+    async def cancel_workflow(self, watch, reason="cancelled"):
+        """
+        Deletes or interrupts the prompt and records the cancellation (see app.cancel_workflow).
+        """
+        watch.cancelled = True
+        return await self._cancel_released(watch, reason, self.scheduler.discard(watch.prompt_id))
+
+    async def cancel_workflows(self, watches, reason="cancelled"):
+        """
+        Cancels several prompts of one request, all taken out of the scheduler
+        first (see app.cancel_workflows).
+        """
+        for watch in watches:
+            watch.cancelled = True
+        held = self.scheduler.discard_all([w.prompt_id for w in watches])
+        for watch in watches:
+            await self._cancel_released(watch, reason, watch.prompt_id in held)
+
+    async def _cancel_released(self, watch, reason, was_held):
+        if was_held:
+            action = "deleted"  # still held by the wrapper; ComfyUI never saw it
+        else:
+            try:
+                action = await self.cancel_prompt(watch.prompt_id)
+            except Exception as e:
+                print(f"[api] could not cancel prompt {watch.prompt_id}: {e}")
+                action = None
+        self.scheduler.forget(watch.prompt_id)
+        self.ws.unwatch(watch.prompt_id)
+        sync_app.record_cancellation(watch, action, reason)
+        print(f"[api] prompt {watch.prompt_id} cancelled, {reason} ({action or 'no longer queued'}).")
+        return action
+
+    async def expire_workflow(self, watch):
+        """
+        Cancels a prompt that ran past its deadline and raises ComfyTimeoutError.
+        """
+        await self.cancel_workflow(watch, reason="deadline")
+        raise sync_app.ComfyTimeoutError("Image generation exceeded its deadline and was cancelled.")
+
+    async def abandon_workflow(self, watch):
+        """
+        Cancels a prompt whose HTTP client went away and raises ClientDisconnectedError.
+        """
+        await self.cancel_workflow(watch, reason="client_disconnected")
+        raise sync_app.ClientDisconnectedError()
+
+    async def submit_workflow(self, workflow_dict, listener=None, timeout=None, model_id=None, priority="normal"):
+        """
+        Queues a workflow and returns its PromptWatch (see app.submit_workflow).
+        """
+        dispatcher = self.ws
+        if not dispatcher.wait_connected(0) and not await asyncio.to_thread(dispatcher.wait_connected):
+            raise sync_app.BackendRefusedError(f"ComfyUI websocket {dispatcher.ws_url} is not connected.")
+
+        prompt_id = str(uuid.uuid4())
+        watch = dispatcher.watch(prompt_id, output_nodes=workflows.websocket_output_nodes(workflow_dict),
+                                 listener=listener, model_id=model_id, priority=priority)
+        if timeout:
+            watch.deadline = time.time() + timeout
+        signature = workflows.model_signature(workflow_dict)
+
+        if sync_app._RELEASE_DEPTH > 0:
+            # the backend's scheduler thread queues it (shared with the sync mode)
+            self.scheduler.submit(watch, workflow_dict, signature)
+            return watch
+        try:
+            await self.queue_prompt(workflow_dict, prompt_id=prompt_id, client_id=dispatcher.client_id,
+                                    front=priority == "high")
+        except BaseException:
+            dispatcher.unwatch(prompt_id)
+            raise
+        watch.queued_at = time.time()
+        sync_app.COMFY_POOL.record_submission(self, model_id, signature)
+        return watch
+
+    async def collect_workflow(self, watch, is_disconnected=None):
+        """
+        Awaits a submitted prompt and returns its output images as raw bytes.
+        is_disconnected is an async callable (e.g. request.is_disconnected).
+        """
+        future = asyncio.wrap_future(watch.future)
+        try:
+            while True:
+                remaining = watch.remaining()
+                wait = remaining
+                if is_disconnected is not None:
+                    wait = sync_app._DISCONNECT_POLL_SECONDS if remaining is None else min(sync_app._DISCONNECT_POLL_SECONDS, remaining)
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=wait)
+                    break
+                except asyncio.TimeoutError:
+                    if watch.remaining() == 0.0:
+                        await self.expire_workflow(watch)
+                    if is_disconnected is not None and await is_disconnected():
+                        await self.abandon_workflow(watch)
+        finally:
+            self.ws.unwatch(watch.prompt_id)
+        sync_app.record_execution(watch)
+
+        if watch.output_nodes:
+            return watch.images
+
+        history = (await self.get_history(watch.prompt_id)).get(watch.prompt_id, {})
+        refs = sync_app.history_image_refs(history)
+        return list(await asyncio.gather(*(self.get_image_raw(*ref) for ref in refs)))
+
+    async def iter_completed(self, watches, is_disconnected=None):
+        """
+        Yields (watch, raw images) in completion order; cancels the prompts
+        still pending if iteration stops early (see app.iter_completed).
+        """
+        pending = {asyncio.wrap_future(w.future): w for w in watches}
+        reason = "request_failed"
+        try:
+            while pending:
+                if any(w.remaining() == 0.0 for w in pending.values()):
+                    reason = "deadline"
+                    raise sync_app.ComfyTimeoutError("Image generation exceeded its deadline and was cancelled.")
+                if is_disconnected is not None and await is_disconnected():
+                    reason = "client_disconnected"
+                    raise sync_app.ClientDisconnectedError()
+                deadlines = [w.remaining() for w in pending.values() if w.deadline is not None]
+                wait = min(deadlines) if deadlines else None
+                if is_disconnected is not None:
+                    wait = sync_app._DISCONNECT_POLL_SECONDS if wait is None else min(sync_app._DISCONNECT_POLL_SECONDS, wait)
+                finished, _ = await asyncio.wait(list(pending), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    w = pending.pop(future)
+                    yield w, await self.collect_workflow(w)
+        finally:
+            for w in pending.values():
+                if w.future.done():
+                    self.ws.unwatch(w.prompt_id)
+            await self.cancel_workflows([w for w in pending.values() if not w.future.done()], reason=reason)
+
+    async def execute_workflow(self, workflow_dict, timeout=None, model_id=None, is_disconnected=None):
+        """
+        Full execution: Queue -> WS wait -> Download.
+        Returns a list of raw image bytes.
+        """
+        watch = await self.submit_workflow(workflow_dict, timeout=timeout, model_id=model_id)
+        return await self.collect_workflow(watch, is_disconnected=is_disconnected)
+
+# One async client per backend of app.COMFY_POOL; the pool's health poller picks for both modes
+ASYNC_CLIENTS = {c.base_url: AsyncComfyClient(c) for c in sync_app.COMFY_POOL.clients}
+ASYNC_COMFY_CLIENT = ASYNC_CLIENTS[sync_app.COMFY_CLIENT.base_url]
+
+def choose_client(model_id=None):
+    return ASYNC_CLIENTS[sync_app.COMFY_POOL.choose(model_id).base_url]
+
+def _is_connect_error(exc) -> bool:
+    if isinstance(exc, requests.ConnectionError):
+        return sync_app.is_connect_error(exc)
+    return isinstance(exc, aiohttp.ClientConnectorError)
+
+async def _with_failover(params: dict, attempt):
+    """
+    Awaits attempt(client) with one retry on another backend after a
+    BackendRefusedError (see app.run_with_failover).
+    """
+    client = choose_client(params["model_id"])
+    try:
+        return await attempt(client)
+    except sync_app.BackendRefusedError as e:
+        sync_app.COMFY_POOL.report_failure(client, e)
+        client = choose_client(params["model_id"])  # BackendUnavailableError if none is left
+        sync_app.metric_inc("backend_failovers", "retries")
+        print(f"[pool] retrying the request on {client.base_url}")
+    except _CONNECT_ERRORS as e:
+        raise sync_app.COMFY_POOL.report_failure(client, e)
+    try:
+        return await attempt(client)
+    except _CONNECT_ERRORS as e:
+        raise sync_app.COMFY_POOL.report_failure(client, e)
+
+async def _upload_edit_images(client, uploads) -> list:
+    """
+    Uploads the prepared edit inputs concurrently; names in input order. A
+    connection error is raised as BackendRefusedError (see app.upload_edit_images).
+    """
+    try:
+        return list(await asyncio.gather(*(
+            client.upload_image_file(fileobj, filename=filename, content_type=content_type)
+            for fileobj, filename, content_type in uploads
+        )))
+    except _CONNECT_ERRORS as e:
+        raise sync_app.BackendRefusedError(str(e)) from e
+
+async def _run_edit(client, uploads, run):
+    """
+    Awaits run(uploaded_names) with one re-upload if an input cannot be
+    loaded (see app.run_edit).
+    """
+    if not uploads:
+        return await run(None)
+    names = await _upload_edit_images(client, uploads)
+    try:
+        return await run(names)
+    except sync_app.ApiError as e:
+        if not sync_app.is_missing_input_error(e):
+            raise
+        client.uploads.discard(names)
+        sync_app.metric_inc("uploads", "reuploads")
+        print(f"[api] {client.base_url} could not load an input ({e.message}); uploading again")
+    return await run(await _upload_edit_images(client, uploads))
+
+# Cancellations started from a cancelled stream run as their own tasks; keep references
+_BACKGROUND_TASKS = set()
+
+def _spawn(coro):
+    task = asyncio.ensure_future(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+# ============================================================
+# Helpers
+# ============================================================
+def openai_error(message: str, status: int = 400, param: str = None, code: str = None, err_type: str = "invalid_request_error", headers: dict = None):
+    payload = {
+        "error": {
+            "message": message,
+            "type": err_type,
+            "param": param,
+            "code": code
+        }
+    }
+    return JSONResponse(payload, status_code=status, headers=headers)
+
+def _api_error(e):
+    return openai_error(e.message, status=e.status, param=e.param, code=e.code, err_type=e.err_type)
+
+class _BodyTooLarge(Exception):
+    pass
+
+def _body_too_large():
+    return openai_error(f"Request body exceeds the {sync_app._MAX_INPUT_BYTES} byte input limit.", status=413,
+                        param="image", code="request_too_large")
+
+def _limited_request(request):
+    """
+    The request with its body capped at app._MAX_INPUT_BYTES: reading past
+    it (a chunked body has no Content-Length to check up front) raises
+    _BodyTooLarge instead of buffering the rest.
+    """
+    receive = request.receive
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        received += len(message.get("body", b""))
+        if received > sync_app._MAX_INPUT_BYTES:
+            raise _BodyTooLarge()
+        return message
+
+    return Request(request.scope, limited_receive)
+
+async def _read_json(request):
+    """
+    Parses a JSON body off the request stream. Unlike Request.json(), this
+    keeps no copy of the raw body on the request for its lifetime.
+    """
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+    return await asyncio.to_thread(json.loads, body)
+
+def _overloaded_error(e):
+    return openai_error(e.message, status=e.status, code=e.code, err_type=e.err_type,
+                        headers={"Retry-After": str(e.retry_after)})
+
+async def _start_job(request, params: dict, uploads=(), files=()):
+    """
+    Admits the request and runs it as a background task; answers 202 with the
+    job (see app._start_job).
+    """
+    try:
+        release = sync_app.admit(params)
+    except sync_app.OverloadedError as e:
+        sync_app.close_edit_inputs(list(uploads) + list(files))
+        return _overloaded_error(e)
+    try:
+        uploads = list(uploads)
+        for f in files:
+            if isinstance(f, tuple):
+                uploads.append(f)
+                continue
+            # the request closes its form files when it ends
+            uploads.append((await asyncio.to_thread(sync_app.spool_copy, f.file), f.filename or "image.png",
+                            f.content_type or "image/png"))
+    except BaseException:
+        sync_app.close_edit_inputs(uploads)
+        sync_app.close_edit_inputs(files)
+        release()
+        raise
+    base_url = str(request.base_url).rstrip("/")
+    job = sync_app.create_job(params)
+    _spawn(_run_job(job["id"], params, uploads, base_url, release))
+    print(f"[api] job {job['id']} accepted ({params['model_id']}, n={params['n']})")
+    return JSONResponse(sync_app.job_view(job), status_code=202, headers={"Location": f"/v1/images/jobs/{job['id']}"})
+
+async def _run_job(job_id: str, params: dict, uploads, base_url: str, release):
+    def listener(event, data):
+        if event == "progress":
+            sync_app.update_job_progress(job_id, data["value"], data["max"])
+
+    async def attempt(client):
+        return await _run_edit(client, uploads, lambda names: _run_images(params, names, client=client, listener=listener))
+
+    result = error = None
+    inputs = uploads
+    try:
+        if uploads:
+            uploads = await _prepare_edit_inputs(params, uploads)
+        created = sync_app._now()
+        out_images = await _with_failover(params, attempt)
+        result = sync_app.images_response_body(created, sync_app.build_data_items(out_images, params, base_url=base_url),
+                                               **sync_app.images_response_kwargs(params))
+    except sync_app.ApiError as e:
+        error = {"message": e.message, "type": e.err_type, "param": e.param, "code": e.code}
+    except Exception as e:
+        error = {"message": str(e), "type": "server_error"}
+    finally:
+        sync_app.close_edit_inputs(inputs)
+        sync_app.close_edit_inputs(uploads)
+        release()
+
+    job = sync_app.finish_job(job_id, result=result, error=error)
+    print(f"[api] job {job_id} {job['status']}")
+    if params["webhook_url"]:
+        await asyncio.to_thread(sync_app.notify_webhook, params["webhook_url"], job)
+
+async def _with_admission(params: dict, handler):
+    """
+    Awaits handler() (which uploads and generates) only if app.admit() lets
+    the request in; otherwise answers 429 with Retry-After before any upload.
+    A streamed response keeps its admission until the stream ends.
+    """
+    try:
+        release = sync_app.admit(params)
+    except sync_app.OverloadedError as e:
+        return _overloaded_error(e)
+    try:
+        response = await handler()
+    except BaseException:
+        release()
+        raise
+    if not isinstance(response, StreamingResponse):
+        release()
+        return response
+
+    body = response.body_iterator
+
+    async def released_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+
+    response.body_iterator = released_body()
+    return response
+
+async def _run_images(params: dict, uploaded_names=None, is_disconnected=None, client=None, listener=None):
+    """
+    Runs the workflow until n images are collected; returns converted image bytes.
+    All executions are queued up front and collected as they finish (see app._run_images).
+    """
+    client = client or ASYNC_COMFY_CLIENT
+    out_images = []
+    watches = []
+    try:
+        while len(out_images) < params["n"]:
+            if is_disconnected is not None and await is_disconnected():
+                raise sync_app.ClientDisconnectedError()
+            batches = sync_app.plan_batches(params, params["n"] - len(out_images))
+            seeds = random.sample(range(1, 10**15), len(batches))
+            watches = []
+            try:
+                for seed, batch_size in zip(seeds, batches):
+                    wf = sync_app.build_workflow(params, seed, images=uploaded_names, batch_size=batch_size)
+                    watches.append(await client.submit_workflow(wf, listener=listener,
+                                                                timeout=sync_app.deadline_for(params["model_id"]),
+                                                                model_id=params["model_id"], priority=params["priority"]))
+            except Exception:
+                await client.cancel_workflows(watches, reason="request_failed")
+                raise
+
+            received = 0
+            completed = client.iter_completed(watches, is_disconnected=is_disconnected)
+            try:
+                async for _watch, raw_images in completed:
+                    received += len(raw_images)
+                    out_images.extend(await asyncio.to_thread(sync_app.convert_outputs, raw_images, params))
+            finally:
+                await completed.aclose()
+            if not received:
+                raise ValueError("No images returned from workflow execution.")
+    except _CONNECT_ERRORS as e:
+        # a backend gone before it queued any prompt of the request (see app._run_images)
+        if not out_images and _is_connect_error(e) and not any(w.queued_at for w in watches):
+            raise sync_app.BackendRefusedError(str(e)) from e
+        if isinstance(e, sync_app.BackendRefusedError):
+            # part of the request already ran on this backend
+            raise requests.ConnectionError(*e.args) from e
+        raise
+    return out_images[:params["n"]]
+
+async def _images_response(request, params: dict, uploads=None):
+    """
+    Runs a generation, or an edit of the prepared `uploads`, on one backend
+    with failover (see app._images_response).
+    """
+    async def upload(client):
+        return await _upload_edit_images(client, uploads) if uploads else None
+
+    # Streaming (SSE) per OpenAI Image Streaming: partial + completed events
+    if params["stream"]:
+        async def upload_to(client):
+            return client, await upload(client)
+
+        try:
+            client, uploaded_names = await _with_failover(params, upload_to)
+        except sync_app.ApiError as e:
+            return _api_error(e)
+
+        async def gen():
+            created_at = sync_app._now()
+            loop = asyncio.get_running_loop()
+            events = asyncio.Queue()
+            sampler = sync_app.PartialImageSampler(params["partial_images"])
+
+            # called on the dispatcher thread
+            def listener(event, data):
+                if event == "progress" or sampler.accept(data["progress"]):
+                    loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+            async def position_or_none(watch):
+                try:
+                    return await client.get_queue_position(watch.prompt_id, queued_at=watch.queued_at or 0.0)
+                except Exception as e:
+                    print(f"[api] /queue poll failed: {e}")
+                    return None
+
+            # Flush headers and first bytes before touching ComfyUI
+            yield ": stream opened\n\n"
+            watch = None
+            try:
+                wf = sync_app.build_workflow(params, random.randint(1, 10**15), images=uploaded_names)
+                watch = await client.submit_workflow(wf, listener=listener, timeout=sync_app.deadline_for(params["model_id"]),
+                                                     model_id=params["model_id"], priority=params["priority"])
+                watch.future.add_done_callback(lambda _f: loop.call_soon_threadsafe(events.put_nowait, ("done", None)))
+
+                position = await position_or_none(watch)
+                yield sync_app.stream_event(params, "queued", created_at, queue_position=position)
+
+                # Relay progress and sampler previews (as partial images) while the job runs;
+                # heartbeat comments keep proxies from timing out a quiet stream.
+                partial_index = 0
+                started = False
+                while True:
+                    remaining = watch.remaining()
+                    if remaining is not None and remaining <= 0:
+                        await client.expire_workflow(watch)
+                    wait = sync_app._SSE_HEARTBEAT_SECONDS if remaining is None else min(sync_app._SSE_HEARTBEAT_SECONDS, remaining)
+                    try:
+                        event, data = await asyncio.wait_for(events.get(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        if not started:
+                            new_position = await position_or_none(watch)
+                            if new_position is not None and new_position != position:
+                                position = new_position
+                                yield sync_app.stream_event(params, "queued", created_at, queue_position=position)
+                        yield ": heartbeat\n\n"
+                        continue
+                    if event == "done":
+                        break
+                    if event == "progress":
+                        started = True
+                        yield sync_app.stream_event(params, "progress", created_at, step=data["value"], max_steps=data["max"])
+                        continue
+                    partial = (await asyncio.to_thread(sync_app.convert_outputs, [data["image"]], params))[0]
+                    yield sync_app.stream_event(params, "partial_image", created_at,
+                                                b64_json=base64.b64encode(partial).decode("utf-8"),
+                                                partial_image_index=partial_index)
+                    partial_index += 1
+
+                raw_images = await client.collect_workflow(watch)
+                if not raw_images:
+                    raise ValueError("No images returned from workflow execution.")
+                final_img = (await asyncio.to_thread(sync_app.convert_outputs, raw_images[:1], params))[0]
+                b64 = base64.b64encode(final_img).decode("utf-8")
+
+                yield sync_app.stream_event(params, "completed", created_at, b64_json=b64)
+            except _CONNECT_ERRORS as e:
+                e = sync_app.COMFY_POOL.report_failure(client, e)
+                yield sync_app.sse_format("error", {"error": {"message": e.message, "type": e.err_type, "param": None, "code": e.code}})
+            except (asyncio.CancelledError, GeneratorExit):
+                # Starlette cancels the stream when the client disconnects; awaiting here
+                # would be cancelled too, so the ComfyUI cancellation runs as its own task
+                if watch is not None and not watch.future.done():
+                    _spawn(client.cancel_workflow(watch, reason="client_disconnected"))
+                raise
+            except sync_app.ApiError as e:
+                if uploaded_names and sync_app.is_missing_input_error(e):
+                    # events were sent already, so only the next request uploads them again
+                    client.uploads.discard(uploaded_names)
+                err = {"error": {"message": e.message, "type": e.err_type, "param": e.param, "code": e.code}}
+                yield sync_app.sse_format("error", err)
+            except Exception as e:
+                err = {"error": {"message": str(e), "type": "server_error"}}
+                yield sync_app.sse_format("error", err)
+
+        return StreamingResponse(gen(), media_type="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+
+    async def attempt(client):
+        return await _run_edit(client, uploads, lambda names: _run_images(
+            params, names, is_disconnected=request.is_disconnected, client=client))
+
+    created = sync_app._now()
+    try:
+        out_images = await _with_failover(params, attempt)
+    except sync_app.ApiError as e:
+        return _api_error(e)
+    except Exception as e:
+        return openai_error(str(e), status=400)
+
+    base_url = str(request.base_url).rstrip("/")
+    data_list = sync_app.build_data_items(out_images, params, base_url=base_url)
+    return JSONResponse(sync_app.images_response_body(created, data_list, **sync_app.images_response_kwargs(params)))
+
+# ============================================================
+# Routes
+# ============================================================
+async def get_temp_image(request):
+    token = request.path_params["token"]
+    sync_app.cleanup_temp_images()
+    with sync_app._TEMP_LOCK:
+        item = sync_app._TEMP_IMAGES.get(token)
+    if not item:
+        return openai_error("Image URL expired or not found.", status=404)
+
+    image_bytes, output_format, _exp = item
+    return Response(image_bytes, media_type=sync_app.mime_for_output_format(output_format), headers={
+        "Content-Disposition": f'inline; filename="image.{output_format}"',
+    })
+
+async def list_models(request):
+    supported = workflows.get_supported_models()
+    created = sync_app._now()
+    return JSONResponse({
+        "object": "list",
+        "data": [
+            {"id": model_id, "object": "model", "created": created, "owned_by": "comfyui"}
+            for model_id in supported
+        ]
+    })
+
+async def images_generations(request):
+    if "application/json" not in request.headers.get("content-type", ""):
+        return openai_error("Request must be application/json", param="Content-Type")
+    if int(request.headers.get("content-length") or 0) > sync_app._MAX_INPUT_BYTES:
+        return _body_too_large()
+
+    try:
+        data = await _read_json(_limited_request(request))
+    except _BodyTooLarge:
+        return _body_too_large()
+    except Exception:
+        data = {}
+    try:
+        params = sync_app.parse_image_params(data or {}, "gen", api_key=sync_app.bearer_token(request.headers))
+    except sync_app.ApiError as e:
+        return _api_error(e)
+
+    if params["async"]:
+        return await _start_job(request, params)
+    return await _with_admission(params, lambda: _images_response(request, params))
+
+async def images_edits(request):
+    if int(request.headers.get("content-length") or 0) > sync_app._MAX_INPUT_BYTES:
+        return _body_too_large()
+    limited = _limited_request(request)
+    try:
+        return await _images_edits(request, limited)
+    finally:
+        await limited.close()  # its form files; Starlette only closes those of `request`
+
+async def _images_edits(request, limited):
+    # OpenAI expects multipart/form-data for edits, but we also allow JSON fallback.
+    uploads = []  # decoded (file object, filename, content_type); multipart files join once admitted
+    files = []
+
+    if "application/json" in request.headers.get("content-type", ""):
+        try:
+            data = await _read_json(limited)
+        except _BodyTooLarge:
+            return _body_too_large()
+        except Exception:
+            data = {}
+        data = data or {}
+        try:
+            params = sync_app.parse_image_params(data, "edit", is_json=True, api_key=sync_app.bearer_token(request.headers))
+        except sync_app.ApiError as e:
+            return _api_error(e)
+
+        if not (data.get("image") or data.get("images")):
+            return openai_error("No image provided. Provide 'image' (string or array) or use multipart/form-data.", param="image")
+
+        # decoding a large data URL takes a while, so not on the event loop
+        try:
+            uploads.extend(await asyncio.to_thread(sync_app.decode_json_images, data))
+        except sync_app.ApiError as e:
+            return _api_error(e)
+
+    else:
+        try:
+            form = await limited.form()
+        except _BodyTooLarge:
+            return _body_too_large()
+        try:
+            params = sync_app.parse_image_params(form, "edit", is_json=False, api_key=sync_app.bearer_token(request.headers))
+        except sync_app.ApiError as e:
+            return _api_error(e)
+
+        # form files, or (file object, filename, content_type) for file ids, in field order
+        try:
+            for key in ("image", "image[]", "file", "file[]"):
+                for f in form.getlist(key):
+                    if isinstance(f, UploadFile):
+                        files.append(f)
+                    elif sync_app.file_ref(f):
+                        files.append(await asyncio.to_thread(sync_app.open_input_file, sync_app.file_ref(f)))
+        except sync_app.ApiError as e:
+            sync_app.close_edit_inputs(files)
+            return _api_error(e)
+
+        # Fallback: collect all file fields
+        if not files:
+            files = [v for _, v in form.multi_items() if isinstance(v, UploadFile) and v is not form.get("mask")]
+            if files:
+                print(f"[api] Warning: 'image' key not found. Found keys: {list(form.keys())}")
+
+        if not files:
+            return openai_error("No image provided. Ensure multipart/form-data includes an image file.", param="image")
+
+        if isinstance(form.get("mask"), UploadFile):
+            print("[api] mask provided but not supported by current workflows; ignoring.")
+
+    if params["async"]:
+        return await _start_job(request, params, uploads, files)  # the job closes them
+    try:
+        return await _with_admission(params, lambda: _edit_response(request, params, uploads, files))
+    finally:
+        sync_app.close_edit_inputs(uploads)
+        sync_app.close_edit_inputs(files)
+
+async def _prepare_edit_inputs(params: dict, uploads) -> list:
+    """Downscales the edit inputs on the shared image executor (see prepare_edit_inputs)."""
+    model = sync_app.request_model(params)
+    budgets = workflows.input_megapixels(model, len(uploads)) if sync_app._DOWNSCALE_INPUTS else [None] * len(uploads)
+    resample = workflows.input_resample(model)
+    return list(await asyncio.gather(*(
+        asyncio.wrap_future(sync_app._IMAGE_EXECUTOR.submit(sync_app.downscale_input, upload, megapixels, resample))
+        for upload, megapixels in zip(uploads, budgets)
+    )))
+
+async def _edit_response(request, params: dict, uploads, files):
+    for f in files:
+        uploads.append(f if isinstance(f, tuple) else (f.file, f.filename or "image.png", f.content_type or "image/png"))
+
+    # uploads are done when this returns, a stream's included
+    prepared = await _prepare_edit_inputs(params, uploads)
+    try:
+        return await _images_response(request, params, prepared)
+    finally:
+        sync_app.close_edit_inputs(prepared)
+
+async def create_file(request):
+    if int(request.headers.get("content-length") or 0) > sync_app._MAX_INPUT_BYTES:
+        return _body_too_large()
+    limited = _limited_request(request)
+    try:
+        form = await limited.form()
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            return openai_error("No file provided. Upload the image as multipart/form-data field 'file'.", param="file")
+        ttl = sync_app.clamp_int(form.get("expires_after[seconds]"), sync_app._FILE_TTL_SECONDS, 60,
+                                 sync_app._FILE_TTL_SECONDS, "expires_after")
+        record = await asyncio.to_thread(sync_app.store_input_file, upload.file, upload.filename,
+                                         form.get("purpose") or "vision", ttl)
+    except _BodyTooLarge:
+        return _body_too_large()
+    except sync_app.ApiError as e:
+        return _api_error(e)
+    finally:
+        await limited.close()
+    print(f"[api] stored {record['id']} ({record['bytes']} bytes, expires in {ttl}s)")
+    return JSONResponse(sync_app.file_view(record))
+
+async def get_file(request):
+    record = sync_app.get_input_file(request.path_params["file_id"])
+    if record is None:
+        return openai_error("File not found or expired.", status=404, param="file_id")
+    return JSONResponse(sync_app.file_view(record))
+
+async def delete_file(request):
+    file_id = request.path_params["file_id"]
+    if not await asyncio.to_thread(sync_app.delete_input_file, file_id):
+        return openai_error("File not found or expired.", status=404, param="file_id")
+    return JSONResponse({"id": file_id, "object": "file", "deleted": True})
+
+async def get_image_job(request):
+    job = sync_app.get_job(request.path_params["job_id"])
+    if job is None:
+        return openai_error("Job not found or expired.", status=404, param="job_id")
+    return JSONResponse(job)
+
+async def get_ready(request):
+    warmup = sync_app.MODEL_WARMER.snapshot()
+    if not warmup["ready"]:
+        return JSONResponse({"status": "warming_up", "pending": warmup["pending"]}, status_code=503)
+    return JSONResponse({"status": "ready"})
+
+async def get_metrics(request):
+    return JSONResponse(dict(sync_app.metrics_snapshot(), backends=sync_app.COMFY_POOL.snapshot(),
+                             admission=sync_app.admission_snapshot(), workflows=sync_app.WORKFLOW_RELOADER.snapshot()))
+
+async def images_variations(request):
+    return openai_error("images/variations is not supported by this ComfyUI wrapper.", status=501)
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    yield
+    for client in ASYNC_CLIENTS.values():
+        await client.close()
+
+app = Starlette(
+    routes=[
+        Route("/v1/images/tmp/{token}", get_temp_image, methods=["GET"]),
+        Route("/v1/models", list_models, methods=["GET"]),
+        Route("/v1/images/generations", images_generations, methods=["POST"]),
+        Route("/v1/images/edits", images_edits, methods=["POST"]),
+        Route("/v1/images/variations", images_variations, methods=["POST"]),
+        Route("/v1/files", create_file, methods=["POST"]),
+        Route("/v1/files/{file_id}", get_file, methods=["GET"]),
+        Route("/v1/files/{file_id}", delete_file, methods=["DELETE"]),
+        Route("/v1/images/jobs/{job_id}", get_image_job, methods=["GET"]),
+        Route("/ready", get_ready, methods=["GET"]),
+        Route("/metrics", get_metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
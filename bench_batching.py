@@ -0,0 +1,37 @@
+"""
+Wall time of n=1..10 generations: one ComfyUI execution per image (loop)
+versus latent batches (native). Runs the wrapper's own code in-process
+against the ComfyUI at COMFYUI_HOST/COMFYUI_PORT.
+
+    BENCH_MODEL=z-image-turbo BENCH_SIZE=512x512 python bench_batching.py
+"""
+import os
+import time
+
+import app
+
+MODEL = os.environ.get("BENCH_MODEL", "z-image-turbo")
+SIZE = os.environ.get("BENCH_SIZE", "512x512")
+MAX_N = int(os.environ.get("BENCH_MAX_N", "10"))
+MAX_BATCH = int(os.environ.get("BENCH_MAX_BATCH", str(MAX_N)))
+
+
+def run(n, native):
+    app._NATIVE_BATCH = native
+    app._MAX_BATCH_SIZE = MAX_BATCH
+    params = app.parse_image_params({"model": MODEL, "prompt": "A lighthouse at dusk", "size": SIZE, "n": n}, "gen")
+    started = time.perf_counter()
+    images = app._run_images(params)
+    elapsed = time.perf_counter() - started
+    assert len(images) == n, f"expected {n} images, got {len(images)}"
+    return elapsed
+
+
+if __name__ == "__main__":
+    print(f"model={MODEL} size={SIZE} max_batch={MAX_BATCH}")
+    run(1, False)  # load models before timing
+    print(f"{'n':>3} {'loop s':>9} {'native s':>9} {'speedup':>8}")
+    for n in range(1, MAX_N + 1):
+        loop = run(n, False)
+        native = run(n, True)
+        print(f"{n:>3} {loop:>9.2f} {native:>9.2f} {loop / native:>7.2f}x")
@@ -0,0 +1,59 @@
+"""
+Per-request cost of instantiating each model's workflow and serializing the
+/prompt body: the old path (copy.deepcopy of the template graph, slot
+assignment, json.dumps of the whole payload) versus the precompiled
+template (substitute slot values into pre-serialized JSON). Needs no ComfyUI.
+
+    BENCH_ROUNDS=2000 python bench_workflows.py
+"""
+import contextlib
+import copy
+import io
+import json
+import os
+import timeit
+
+import workflows
+from app import prompt_request_body
+
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", "2000"))
+CLIENT_ID = "bench-client"
+
+
+def cases():
+    """(label, rendered workflow) for each model and mode it supports."""
+    for model_id in workflows.get_supported_models():
+        for mode, images in (("gen", None), ("edit", ["a.png"]), ("edit", ["a.png", "b.png", "c.png"])):
+            kwargs = dict(mode=mode, prompt="A lighthouse at dusk", width=1024, height=1024, seed=42, images=images)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):  # "Ignoring unsupported parameters"
+                    wf = workflows.get_workflow(model_id, **kwargs)
+            except ValueError:
+                continue  # mode not supported
+            if not isinstance(wf, workflows.Workflow) or (images and "image_0" not in wf.template.slots):
+                continue  # a dict workflow, or a gen-only model that ignored the images
+            yield f"{model_id} {mode}" + (f" x{len(images)}" if images else ""), wf
+
+
+def deepcopy_path(wf):
+    """What every request did before: copy the graph, fill it, serialize it."""
+    graph = copy.deepcopy(wf.template.graph)
+    for name, targets in wf.template.slots.items():
+        for node_id, input_name in targets:
+            graph[node_id]["inputs"][input_name] = wf.values[name]
+    return json.dumps({"prompt": graph, "client_id": CLIENT_ID}).encode("utf-8")
+
+
+def template_path(wf):
+    """Now: substitute the values into the pre-serialized template."""
+    return prompt_request_body(wf.template.render(**wf.values), CLIENT_ID)
+
+
+if __name__ == "__main__":
+    print(f"rounds={ROUNDS}")
+    print(f"{'workflow':<32} {'deepcopy us':>12} {'template us':>12} {'speedup':>8}")
+    for label, wf in cases():
+        assert json.loads(deepcopy_path(wf)) == json.loads(template_path(wf))
+        before = timeit.timeit(lambda: deepcopy_path(wf), number=ROUNDS) / ROUNDS * 1e6
+        after = timeit.timeit(lambda: template_path(wf), number=ROUNDS) / ROUNDS * 1e6
+        print(f"{label:<32} {before:>12.1f} {after:>12.1f} {before / after:>7.1f}x")
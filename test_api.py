@@ -1,14 +1,19 @@
 import os
 import re
 import json
+import time
 import base64
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 API_BASE = os.environ.get("API_BASE", "http://localhost:5000/v1")
 TIMEOUT_SECONDS = 3600
 
 TEST_IMG1 = os.environ.get("TEST_IMG1", "test_input.png")
 TEST_IMG2 = os.environ.get("TEST_IMG2", "test_input2.jpg")
+# Concurrent async requests sent by test_overload_429_retry_after; to see 429s,
+# run the server with COMFYUI_MAX_INFLIGHT below this
+OVERLOAD_BURST = int(os.environ.get("OVERLOAD_BURST", "8"))
 
 
 def save_bytes(path, b):
@@ -245,6 +250,141 @@ def test_edit_stream():
                 save_b64_image(last_b64, "out/edit_stream_final.png")
 
 
+def assert_api_error(r, status, param=None, code=None):
+    assert r.status_code == status, (r.status_code, r.text)
+    err = r.json()["error"]
+    if param is not None:
+        assert err.get("param") == param, err
+    if code is not None:
+        assert err.get("code") == code, err
+    print(f"{status}:", err["message"])
+    return err
+
+
+def wait_for_job(job_id, timeout=TIMEOUT_SECONDS):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        r = requests.get(f"{API_BASE}/images/jobs/{job_id}", timeout=60)
+        r.raise_for_status()
+        job = r.json()
+        print("job:", job["id"], job["status"], job.get("progress"))
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(1)
+    raise TimeoutError(f"job {job_id} did not finish")
+
+
+def test_generation_async_job():
+    # "async": true answers 202 with a job to poll
+    payload = {
+        "model": "z-image-turbo",
+        "prompt": "A paper boat on a puddle, macro photo",
+        "size": "512x512",
+        "async": True,
+    }
+    r = requests.post(f"{API_BASE}/images/generations", json=payload, timeout=60)
+    assert r.status_code == 202, r.text
+    job = r.json()
+    assert job["object"] == "image.job" and job["status"] in ("queued", "in_progress", "completed")
+    assert r.headers["Location"].endswith(job["id"])
+
+    job = wait_for_job(job["id"])
+    assert job["status"] == "completed", job.get("error")
+    save_b64_image(job["result"]["data"][0]["b64_json"], "out/gen_async_job.png")
+
+
+def test_generation_async_job_errors():
+    base = {"model": "z-image-turbo", "prompt": "x", "size": "512x512"}
+    r = requests.post(f"{API_BASE}/images/generations", json=dict(base, stream=True, **{"async": True}), timeout=60)
+    assert_api_error(r, 400, param="async")
+    r = requests.post(f"{API_BASE}/images/generations", json=dict(base, webhook_url="https://example.com/hook"), timeout=60)
+    assert_api_error(r, 400, param="webhook_url")
+    for url in ("ftp://example.com/hook", "http://127.0.0.1/hook", "http://169.254.169.254/latest/meta-data"):
+        r = requests.post(f"{API_BASE}/images/generations", json=dict(base, webhook_url=url, **{"async": True}), timeout=60)
+        assert_api_error(r, 400, param="webhook_url")
+    r = requests.get(f"{API_BASE}/images/jobs/imgjob_does_not_exist", timeout=60)
+    assert_api_error(r, 404, param="job_id")
+
+
+def test_files_edit_by_file_id():
+    # upload once, then edit by id (JSON and multipart)
+    with open(TEST_IMG1, "rb") as img:
+        r = requests.post(f"{API_BASE}/files", files={"file": ("input.png", img, "image/png")},
+                          data={"purpose": "vision", "expires_after[seconds]": "600"}, timeout=60)
+    r.raise_for_status()
+    record = r.json()
+    file_id = record["id"]
+    assert record["object"] == "file" and record["bytes"] > 0
+    assert record["expires_at"] - record["created_at"] <= 600
+
+    r = requests.get(f"{API_BASE}/files/{file_id}", timeout=60)
+    r.raise_for_status()
+    assert r.json()["id"] == file_id
+
+    payload = {
+        "model": "flux-2-klein-4b",
+        "prompt": "Make the sky purple",
+        "response_format": "b64_json",
+        "image": file_id,
+    }
+    r = requests.post(f"{API_BASE}/images/edits", json=payload, timeout=TIMEOUT_SECONDS)
+    r.raise_for_status()
+    save_b64_image(r.json()["data"][0]["b64_json"], "out/edit_json_file_id.png")
+
+    # a text part instead of a file part
+    files = {"image": (None, file_id)}
+    data = {"model": "flux-2-klein-4b", "prompt": "Make the sky orange"}
+    r = requests.post(f"{API_BASE}/images/edits", files=files, data=data, timeout=TIMEOUT_SECONDS)
+    r.raise_for_status()
+    save_b64_image(r.json()["data"][0]["b64_json"], "out/edit_multipart_file_id.png")
+
+    r = requests.delete(f"{API_BASE}/files/{file_id}", timeout=60)
+    r.raise_for_status()
+    assert r.json() == {"id": file_id, "object": "file", "deleted": True}
+    assert_api_error(requests.get(f"{API_BASE}/files/{file_id}", timeout=60), 404, param="file_id")
+    assert_api_error(requests.delete(f"{API_BASE}/files/{file_id}", timeout=60), 404, param="file_id")
+    r = requests.post(f"{API_BASE}/images/edits", json=payload, timeout=60)
+    assert_api_error(r, 400, param="image", code="file_not_found")
+
+
+def test_files_errors():
+    r = requests.post(f"{API_BASE}/files", data={"purpose": "vision"}, timeout=60)
+    assert_api_error(r, 400, param="file")
+
+
+def test_overload_429_retry_after():
+    # async jobs are admitted when accepted, so a burst past the in-flight cap gets 429s
+    payload = {"model": "z-image-turbo", "prompt": "A field of sunflowers", "size": "512x512", "async": True}
+    with ThreadPoolExecutor(max_workers=OVERLOAD_BURST) as pool:
+        responses = list(pool.map(
+            lambda _: requests.post(f"{API_BASE}/images/generations", json=payload, timeout=60), range(OVERLOAD_BURST)))
+    accepted = [r.json()["id"] for r in responses if r.status_code == 202]
+    refused = [r for r in responses if r.status_code != 202]
+    for r in refused:
+        assert_api_error(r, 429, code="rate_limit_exceeded")
+        assert int(r.headers["Retry-After"]) >= 1
+    print(f"accepted {len(accepted)}, refused {len(refused)} with 429")
+    for job_id in accepted:
+        wait_for_job(job_id)
+
+
+def test_generation_priority():
+    for priority in ("high", "low"):
+        payload = {
+            "model": "z-image-turbo",
+            "prompt": "A red bicycle against a white wall",
+            "size": "512x512",
+            "priority": priority,
+        }
+        r = requests.post(f"{API_BASE}/images/generations", json=payload, timeout=TIMEOUT_SECONDS)
+        r.raise_for_status()
+        save_b64_image(r.json()["data"][0]["b64_json"], f"out/gen_priority_{priority}.png")
+
+    payload = {"model": "z-image-turbo", "prompt": "x", "size": "512x512", "priority": "urgent"}
+    r = requests.post(f"{API_BASE}/images/generations", json=payload, timeout=60)
+    assert_api_error(r, 400, param="priority")
+
+
 if __name__ == "__main__":
     os.makedirs("out", exist_ok=True)
 
@@ -261,4 +401,11 @@ if __name__ == "__main__":
     # test_edit_json_base64_data_url()
     # test_edit_stream()
 
+    # test_generation_async_job()
+    # test_generation_async_job_errors()
+    # test_files_edit_by_file_id()
+    # test_files_errors()
+    # test_overload_429_retry_after()
+    # test_generation_priority()
+
     print("All tests finished.")
\ No newline at end of file
@@ -1,23 +1,32 @@
 import os
+import re
+import copy
+import json
+import time
+import threading
 import importlib.util
-from typing import Optional
 
-_MODULE_CACHE = {}
+_WORKFLOWS_DIR = os.path.dirname(os.path.abspath(__file__))
+_MODULE_CACHE = {}  # path -> (mtime_ns, module)
 
 def _module_path_for_model(model_id: str) -> str:
-    return os.path.join(os.path.dirname(__file__), f"{model_id}.py")
+    return os.path.join(_WORKFLOWS_DIR, f"{model_id}.py")
 
 def load_model_module(model_id: str):
     """
     Loads a workflow module from workflows/{model_id}.py.
     This supports hyphenated filenames (e.g. qwen-image.py) by loading from file path.
+    A module is loaded again, as a new module object, once its file's mtime changes.
     """
     path = _module_path_for_model(model_id)
-    if not os.path.exists(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
         return None
 
-    if path in _MODULE_CACHE:
-        return _MODULE_CACHE[path]
+    cached = _MODULE_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
 
     module_name = f"workflow_{model_id.replace('-', '_')}"
     spec = importlib.util.spec_from_file_location(module_name, path)
@@ -25,28 +34,465 @@ def load_model_module(model_id: str):
         return None
 
     mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    _MODULE_CACHE[path] = mod
+    # compiled from source: a .pyc only records whole seconds, so it could
+    # shadow an edit made within the same second
+    with open(path, "r", encoding="utf-8") as f:
+        exec(compile(f.read(), path, "exec"), mod.__dict__)
+    _MODULE_CACHE[path] = (mtime, mod)
     return mod
 
-def get_supported_models():
+_SLOT_MARKER = "@@slot:{}@@"
+_SLOT_PATTERN = re.compile(r'"@@slot:(\w+)@@"')
+
+class WorkflowTemplate:
+    """
+    A workflow graph compiled once, when its module loads: serialized to JSON
+    with named slots (prompt, seed, width, image names, ...), each naming the
+    (node id, input name) pairs it fills. render() only substitutes values;
+    nothing is deep-copied or re-serialized per request.
+
+        FLUX_GEN = WorkflowTemplate(GRAPH, prompt=[("6", "text")], seed=[("25", "noise_seed")])
+        wf = FLUX_GEN.render(prompt="a lighthouse", seed=42)
+    """
+    def __init__(self, graph: dict, **slots):
+        self.graph = graph
+        self.slots = {name: [tuple(target) for target in targets] for name, targets in slots.items()}
+        self.signature = model_signature(graph)
+        self.save_nodes = {node_id for node_id, node in graph.items() if node.get("class_type") == "SaveImage"}
+        self._compiled = {False: self._compile(False), True: self._compile(True)}
+
+    def _compile(self, websocket_output: bool):
+        graph = copy.deepcopy(self.graph)
+        if websocket_output:
+            use_websocket_output(graph)
+        for name, targets in self.slots.items():
+            for node_id, input_name in targets:
+                graph[node_id]["inputs"][input_name] = _SLOT_MARKER.format(name)
+        # literal JSON text, slot name, literal JSON text, slot name, ...
+        pieces = _SLOT_PATTERN.split(json.dumps(graph))
+        return pieces[0::2], pieces[1::2]
+
+    def render(self, **values) -> "Workflow":
+        missing = set(self.slots) - set(values)
+        if missing:
+            raise ValueError(f"No value for workflow slots: {sorted(missing)}")
+        return Workflow(self, values)
+
+    def to_json(self, values: dict, websocket_output: bool = False) -> str:
+        literals, names = self._compiled[websocket_output]
+        out = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            out.append(json.dumps(values[name]))
+            out.append(literal)
+        return "".join(out)
+
+class Workflow:
+    """
+    A rendered WorkflowTemplate: the template plus its slot values. Stands in
+    for a workflow dict everywhere in this package (see to_json/to_dict).
+    """
+    __slots__ = ("template", "values", "websocket_output")
+
+    def __init__(self, template: WorkflowTemplate, values: dict):
+        self.template = template
+        self.values = values
+        self.websocket_output = False
+
+    def to_json(self) -> str:
+        return self.template.to_json(self.values, self.websocket_output)
+
+    def to_dict(self) -> dict:
+        return json.loads(self.to_json())
+
+def to_json(wf) -> str:
+    """The API-format JSON text of a workflow dict or rendered template."""
+    return wf.to_json() if isinstance(wf, Workflow) else json.dumps(wf)
+
+def use_websocket_output(wf):
+    """
+    Swaps every SaveImage node for a SaveImageWebsocket node, so outputs are
+    streamed to the submitting client over the WebSocket instead of being
+    written to ComfyUI's output directory.
+    """
+    if isinstance(wf, Workflow):
+        wf.websocket_output = True  # the template has that variant precompiled
+        return wf
+    for node in wf.values():
+        if node.get("class_type") == "SaveImage":
+            node["class_type"] = "SaveImageWebsocket"
+            node["inputs"] = {"images": node["inputs"]["images"]}
+            if "_meta" in node:
+                node["_meta"] = {"title": "SaveImageWebsocket"}
+    return wf
+
+def websocket_output_nodes(wf) -> set:
+    if isinstance(wf, Workflow):
+        return set(wf.template.save_nodes) if wf.websocket_output else set()
+    return {node_id for node_id, node in wf.items() if node.get("class_type") == "SaveImageWebsocket"}
+
+def model_signature(wf) -> frozenset:
+    """
+    Weight files a workflow loads (the *_name inputs of its loader nodes),
+    i.e. what ComfyUI has in memory after running it.
+    """
+    if isinstance(wf, Workflow):
+        return wf.template.signature
+    return frozenset(
+        value
+        for node in wf.values() if "Loader" in node.get("class_type", "")
+        for key, value in node.get("inputs", {}).items() if "_name" in key and isinstance(value, str)
+    )
+
+def set_steps(wf, steps: int) -> dict:
+    """
+    Overrides the step count of every sampler/scheduler node (inputs named
+    "steps"), e.g. for a cheap warm-up run that only loads the weights.
+    A rendered template comes back as a dict.
+    """
+    if isinstance(wf, Workflow):
+        wf = wf.to_dict()
+    for node in wf.values():
+        inputs = node.get("inputs", {})
+        if isinstance(inputs.get("steps"), int):
+            inputs["steps"] = int(steps)
+    return wf
+
+# ============================================================
+# Model registry
+# ============================================================
+# Every servable model, indexed once (load_registry) from workflows/:
+#   - <dir>/manifest.json: declarative, ComfyUI API-format JSON graphs plus
+#     the slots to fill (see load_manifest)
+#   - <name>.py: a Python module with get_workflow(**kwargs) (fallback)
+# A model is served under its MODEL_ID / "model_id"; the file or directory
+# name and any declared "aliases" resolve to it too. load_registry() can run
+# again at any time: it rebuilds only models whose files changed (by mtime)
+# and swaps the new index in whole, while requests keep the WorkflowModel
+# they resolved.
+_SLOT_NAMES = ("prompt", "seed", "width", "height", "batch_size")
+_IMAGE_SLOT = re.compile(r"image_\d+$")
+
+class WorkflowModel:
+    """
+    One registry entry: the model's id and capabilities, and build(**kwargs),
+    which returns its workflow (a dict or a rendered WorkflowTemplate).
+    """
+    def __init__(self, model_id: str, build, source: str, aliases=(), batch_modes=(), input_megapixels=None,
+                 input_resample: str = "lanczos", max_megapixels: float = 2.0):
+        self.model_id = model_id
+        self.build = build
+        self.source = source
+        self.files = {}  # path -> mtime_ns it was built from (set by _discover)
+        self.aliases = tuple(aliases)
+        self.batch_modes = tuple(batch_modes)
+        self.input_megapixels = input_megapixels
+        self.input_resample = input_resample
+        self.max_megapixels = float(max_megapixels)
+
+def _use_infer_size(width, height) -> bool:
+    try:
+        return width is None or height is None or int(width) <= 0 or int(height) <= 0
+    except (TypeError, ValueError):
+        return True
+
+class _ManifestWorkflows:
+    """
+    get_workflow for a declarative model: picks the template for the mode,
+    image count and size (infer-size variant for 0x0), then fills its slots.
+    """
+    def __init__(self, model_id: str, gen, edit: dict, max_images: int):
+        self.model_id = model_id
+        self.gen = gen
+        self.edit = edit  # (image count, infer size) -> WorkflowTemplate
+        self.max_images = max_images
+
+    def __call__(self, mode: str = "gen", prompt: str = "", width: int = 0, height: int = 0, seed: int = 0,
+                 batch_size: int = 1, images=None, **kwargs):
+        ignored = {k: v for k, v in kwargs.items() if v not in (None, "", [], {})}
+        if ignored:
+            print(f"[{self.model_id}] Ignoring unsupported parameters: {list(ignored.keys())}")
+
+        values = dict(prompt=prompt or "", seed=int(seed or 0), width=int(width or 0), height=int(height or 0),
+                      batch_size=int(batch_size))
+        if mode == "gen":
+            if self.gen is None:
+                raise ValueError(f"{self.model_id} does not support gen mode")
+            template = self.gen
+        else:
+            images = list(images or [])
+            if not self.edit:
+                raise ValueError(f"{self.model_id} does not support edit mode")
+            if not images:
+                raise ValueError(f"{self.model_id} edit requires at least 1 image")
+            if len(images) > self.max_images:
+                print(f"[{self.model_id}] Received {len(images)} images; only {self.max_images} supported. "
+                      "Extra images will be ignored.")
+                images = images[:self.max_images]
+            infer = _use_infer_size(width, height)
+            template = self.edit.get((len(images), infer)) or self.edit.get((len(images), not infer))
+            if template is None:
+                raise ValueError(f"{self.model_id} has no edit workflow for {len(images)} images")
+            for i, name in enumerate(images):
+                values[f"image_{i}"] = name
+        return template.render(**{name: values[name] for name in template.slots})
+
+def _manifest_template(model_dir: str, spec: dict) -> WorkflowTemplate:
+    with open(os.path.join(model_dir, spec["graph"]), "r", encoding="utf-8") as f:
+        graph = json.load(f)
+    slots = spec.get("slots") or {}
+    for name, targets in slots.items():
+        if name not in _SLOT_NAMES and not _IMAGE_SLOT.match(name):
+            raise ValueError(f"unknown slot '{name}' in {spec['graph']}")
+        for node_id, input_name in targets:
+            if node_id not in graph:
+                raise ValueError(f"slot '{name}' targets missing node {node_id} in {spec['graph']}")
+    return WorkflowTemplate(graph, **slots)
+
+def load_manifest(path: str) -> WorkflowModel:
+    """
+    Loads a declarative model from its manifest.json:
+
+        {
+          "model_id": "my-model",
+          "aliases": ["my-model-v1"],                  # optional
+          "batch_modes": ["gen"],                      # modes whose batch_size slot yields n images
+          "max_megapixels": 2.0,                       # clamp for explicit sizes (optional)
+          "input_megapixels": 1.5,                     # or {"2": [2, 1]}; see input_megapixels (optional)
+          "input_resample": "lanczos",                 # upscale_method of its scaler nodes (optional)
+          "max_images": 3,                             # optional; defaults to the largest edit variant
+          "gen": {"graph": "gen.json", "slots": {"prompt": [["6", "text"]], "seed": [["25", "noise_seed"]]}},
+          "edit": [
+            {"images": 1, "graph": "edit-1.json", "slots": {"image_0": [["46", "image"]], ...}},
+            {"images": 1, "infer_size": true, "graph": "edit-1-infer.json", "slots": {...}}
+          ]
+        }
+
+    Graphs are ComfyUI "Save (API)" exports next to the manifest. Slots are
+    prompt, seed, width, height, batch_size and image_<i> (i-th input image),
+    each a list of [node id, input name]. Raises ValueError on a bad manifest.
+    """
+    model_dir = os.path.dirname(path)
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    model_id = manifest.get("model_id") or os.path.basename(model_dir)
+
+    gen = _manifest_template(model_dir, manifest["gen"]) if manifest.get("gen") else None
+    edit = {}
+    for spec in manifest.get("edit") or []:
+        edit[(int(spec["images"]), bool(spec.get("infer_size")))] = _manifest_template(model_dir, spec)
+    if gen is None and not edit:
+        raise ValueError("manifest declares neither 'gen' nor 'edit' workflows")
+    max_images = int(manifest.get("max_images") or max([count for count, _ in edit] or [0]))
+
+    declared = manifest.get("input_megapixels")
+    if isinstance(declared, dict):
+        declared = {int(count): tuple(budgets) for count, budgets in declared.items()}
+    return WorkflowModel(
+        model_id,
+        _ManifestWorkflows(model_id, gen, edit, max_images),
+        source=path,
+        aliases=[os.path.basename(model_dir)] + list(manifest.get("aliases") or []),
+        batch_modes=manifest.get("batch_modes") or (),
+        input_megapixels=declared,
+        input_resample=manifest.get("input_resample") or "lanczos",
+        max_megapixels=manifest.get("max_megapixels") or 2.0,
+    )
+
+def _module_model(path: str):
+    stem = os.path.basename(path)[:-3]
+    mod = load_model_module(stem)
+    if not mod or not hasattr(mod, "get_workflow"):
+        return None
+    return WorkflowModel(
+        getattr(mod, "MODEL_ID", None) or stem,
+        mod.get_workflow,
+        source=path,
+        aliases=[stem],
+        batch_modes=getattr(mod, "BATCH_MODES", ()),
+        input_megapixels=getattr(mod, "INPUT_MEGAPIXELS", None),
+        input_resample=getattr(mod, "INPUT_RESAMPLE", "lanczos"),
+        max_megapixels=getattr(mod, "MAX_MEGAPIXELS", 2.0),
+    )
+
+class Registry:
     """
-    Returns model ids based on filenames inside workflows/ (excluding __init__.py).
+    An index of the models found in workflows/ at one point in time; never
+    modified after load_registry builds it.
     """
-    out = []
-    for fn in os.listdir(os.path.dirname(__file__)):
-        if not fn.endswith(".py"):
+    def __init__(self, models, files=None, errors=None, version=1):
+        self.files = files or {}    # path -> mtime_ns of every file scanned
+        self.errors = errors or {}  # source path -> load error (its previous version is kept)
+        self.version = version
+        self.loaded_at = time.time()
+        self.models = {}   # model_id -> WorkflowModel
+        self.aliases = {}  # alias -> model_id
+        for model in models:
+            if model.model_id in self.models:
+                print(f"[model] {model.source}: model id '{model.model_id}' already defined by "
+                      f"{self.models[model.model_id].source}; skipped")
+                continue
+            self.models[model.model_id] = model
+        for model in self.models.values():
+            for alias in model.aliases:
+                if alias != model.model_id and alias not in self.models:
+                    self.aliases.setdefault(alias, model.model_id)
+
+    def get(self, model_id: str):
+        return self.models.get(model_id) or self.models.get(self.aliases.get(model_id))
+
+def _scan(workflows_dir: str):
+    """
+    Model sources in workflows/ (manifests first, so a manifest replaces a
+    module of the same id) and {path: mtime_ns} of every file they read.
+    """
+    sources, files = [], {}
+    modules = []
+    for name in sorted(os.listdir(workflows_dir)):
+        path = os.path.join(workflows_dir, name)
+        manifest = os.path.join(path, "manifest.json")
+        try:
+            if os.path.isfile(manifest):
+                sources.append(manifest)
+                for fn in os.listdir(path):
+                    if fn.endswith(".json"):
+                        files[os.path.join(path, fn)] = os.stat(os.path.join(path, fn)).st_mtime_ns
+            elif name.endswith(".py") and name != "__init__.py":
+                modules.append(path)
+                files[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            continue  # removed while scanning; the next scan settles it
+    return sources + modules, files
+
+def _source_files(source: str, files: dict) -> dict:
+    if source.endswith(".py"):
+        return {source: files.get(source)}
+    model_dir = os.path.dirname(source)
+    return {path: mtime for path, mtime in files.items() if os.path.dirname(path) == model_dir}
+
+def _discover(sources, files, previous):
+    """
+    Loads each source, reusing the previous registry's models whose files are
+    unchanged. A source that fails to load keeps its previous models.
+    """
+    reusable = {}  # source -> models built from it last time
+    for model in (previous.models.values() if previous else ()):
+        reusable.setdefault(model.source, []).append(model)
+
+    models, errors = [], {}
+    for source in sources:
+        source_files = _source_files(source, files)
+        old = reusable.get(source, [])
+        if old and all(model.files == source_files for model in old):
+            models.extend(old)
             continue
-        if fn == "__init__.py":
+        try:
+            model = load_manifest(source) if source.endswith(".json") else _module_model(source)
+        except Exception as e:
+            print(f"[model] Could not load {source}: {e}")
+            errors[source] = str(e)
+            models.extend(old)
             continue
-        out.append(fn[:-3])  # strip .py
-    return sorted(out)
+        if model is not None:
+            model.files = source_files
+            models.append(model)
+            if previous is not None:
+                print(f"[model] Loaded {model.model_id} from {source}")
+    return models, errors
 
-def get_workflow(model_id: str, **kwargs) -> Optional[dict]:
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+def load_registry() -> Registry:
     """
-    Calls workflows/{model_id}.py:get_workflow(**kwargs) and returns a workflow dict.
+    Scans workflows/ and installs a new registry, rebuilding only the models
+    whose files changed since the current one.
     """
-    mod = load_model_module(model_id)
-    if not mod or not hasattr(mod, "get_workflow"):
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        previous = _REGISTRY
+        sources, files = _scan(_WORKFLOWS_DIR)
+        models, errors = _discover(sources, files, previous)
+        registry = Registry(models, files=files, errors=errors, version=previous.version + 1 if previous else 1)
+        _REGISTRY = registry
+    return registry
+
+def registry_changed() -> bool:
+    """
+    True if files in workflows/ were added, removed or modified since the
+    current registry was built (a cheap directory scan).
+    """
+    return _REGISTRY is None or _scan(_WORKFLOWS_DIR)[1] != _REGISTRY.files
+
+def get_registry() -> Registry:
+    registry = _REGISTRY
+    return registry if registry is not None else load_registry()
+
+def get_model(model_id):
+    """
+    The WorkflowModel for a model id or alias, or None. A WorkflowModel is
+    returned as is, so a request can pin the version it resolved first.
+    """
+    if isinstance(model_id, WorkflowModel):
+        return model_id
+    return get_registry().get(model_id)
+
+def get_supported_models():
+    """
+    Returns the ids of the registered models.
+    """
+    return sorted(get_registry().models)
+
+def batch_modes(model_id) -> tuple:
+    """
+    Modes ("gen"/"edit") in which the model's workflow can produce a batch
+    (BATCH_MODES in a module, "batch_modes" in a manifest).
+    """
+    model = get_model(model_id)
+    return model.batch_modes if model else ()
+
+def input_megapixels(model_id, count: int) -> list:
+    """
+    Pixel budget (ComfyUI megapixels, 1024*1024 px) of each of `count` edit
+    input slots, from the model's INPUT_MEGAPIXELS: one number for every
+    slot, or {image count: (budget per slot, ...)}. None where undeclared.
+    """
+    model = get_model(model_id)
+    declared = model.input_megapixels if model else None
+    if isinstance(declared, (int, float)):
+        return [float(declared)] * count
+    slots = tuple((declared or {}).get(count, ()))
+    return [float(slots[i]) if i < len(slots) else None for i in range(count)]
+
+def input_resample(model_id) -> str:
+    """
+    upscale_method of the ImageScaleToTotalPixels nodes that scale the edit
+    inputs to their budgets (INPUT_RESAMPLE, default "lanczos").
+    """
+    model = get_model(model_id)
+    return model.input_resample if model else "lanczos"
+
+def max_megapixels(model_id) -> float:
+    """
+    Largest explicit output size the model accepts (MAX_MEGAPIXELS, default 2).
+    """
+    model = get_model(model_id)
+    return model.max_megapixels if model else 2.0
+
+def get_workflow(model_id, websocket_output: bool = False, batch_size: int = 1, **kwargs):
+    """
+    Builds the workflow of a registered model (id, alias or WorkflowModel) from its manifest
+    or its module's get_workflow(**kwargs); returns a workflow dict or a
+    rendered WorkflowTemplate, or None for an unknown model.
+    With websocket_output=True, SaveImage nodes are replaced by SaveImageWebsocket.
+    batch_size is passed on only for the model's batch modes; otherwise the
+    workflow produces one image per execution.
+    """
+    model = get_model(model_id)
+    if model is None:
         return None
-    return mod.get_workflow(**kwargs)
\ No newline at end of file
+    if batch_size > 1 and kwargs.get("mode", "gen") in model.batch_modes:
+        kwargs["batch_size"] = batch_size
+    wf = model.build(**kwargs)
+    if wf and websocket_output:
+        use_websocket_output(wf)
+    return wf
@@ -1,7 +1,17 @@
 import copy
 
+from workflows import WorkflowTemplate
+
 MODEL_ID = "flux-2-dev-turbo"
 
+# Modes whose latent honors batch_size (n images from one execution)
+BATCH_MODES = ("gen", "edit")
+
+# Pixel budget (ComfyUI megapixels) of each edit input slot, by image count;
+# the ImageScaleToTotalPixels nodes scale the slots to these, so larger inputs
+# are downscaled before upload
+INPUT_MEGAPIXELS = {1: (2,), 2: (2, 1), 3: (2, 1, 1.5)}
+
 # --------------------------
 # Text-to-Image (Generation)
 # --------------------------
@@ -445,12 +455,39 @@ FLUX2_TURBO_EDIT_3IMG_INFER_SIZE = {
 }
 
 
+# ============================================================
+# COMPILED TEMPLATES
+# ============================================================
+# Compiled once at import; get_workflow only fills the slots. Infer-size
+# variants take their size from GetImageSize, so they have no width/height.
+_BASE_SLOTS = dict(prompt=[("6", "text")], seed=[("25", "noise_seed")], batch_size=[("47", "batch_size")])
+_SIZE_SLOTS = dict(width=[("47", "width"), ("48", "width")], height=[("47", "height"), ("48", "height")])
+# node 46 is the "main" image (megapixels=2), node 42 the "reference" image (megapixels=1)
+_IMAGE_SLOTS = {
+    1: dict(image_0=[("46", "image")]),
+    2: dict(image_0=[("46", "image")], image_1=[("42", "image")]),
+    3: dict(image_0=[("46", "image")], image_1=[("42", "image")], image_2=[("70", "image")]),
+}
+
+FLUX2_TURBO_GEN_TEMPLATE = WorkflowTemplate(FLUX2_TURBO_GEN, **_BASE_SLOTS, **_SIZE_SLOTS)
+# (image count, infer size) -> template
+FLUX2_TURBO_EDIT_TEMPLATES = {
+    (1, False): WorkflowTemplate(FLUX2_TURBO_EDIT_1IMG, **_IMAGE_SLOTS[1], **_BASE_SLOTS, **_SIZE_SLOTS),
+    (1, True): WorkflowTemplate(FLUX2_TURBO_EDIT_1IMG_INFER_SIZE, **_IMAGE_SLOTS[1], **_BASE_SLOTS),
+    (2, False): WorkflowTemplate(FLUX2_TURBO_EDIT_2IMG, **_IMAGE_SLOTS[2], **_BASE_SLOTS, **_SIZE_SLOTS),
+    (2, True): WorkflowTemplate(FLUX2_TURBO_EDIT_2IMG_INFER_SIZE, **_IMAGE_SLOTS[2], **_BASE_SLOTS),
+    (3, False): WorkflowTemplate(FLUX2_TURBO_EDIT_3IMG, **_IMAGE_SLOTS[3], **_BASE_SLOTS, **_SIZE_SLOTS),
+    (3, True): WorkflowTemplate(FLUX2_TURBO_EDIT_3IMG_INFER_SIZE, **_IMAGE_SLOTS[3], **_BASE_SLOTS),
+}
+
+
 def get_workflow(
     mode: str = "gen",
     prompt: str = "",
     width: int = 0,
     height: int = 0,
     seed: int = 0,
+    batch_size: int = 1,
     images=None,
     **kwargs
 ):
@@ -461,55 +498,28 @@ def get_workflow(
     if ignored:
         print(f"[{MODEL_ID}] Ignoring unsupported parameters: {list(ignored.keys())}")
 
-    if mode == "gen":
-        wf = copy.deepcopy(FLUX2_TURBO_GEN)
-        wf["6"]["inputs"]["text"] = prompt or ""
-        wf["25"]["inputs"]["noise_seed"] = int(seed or 0)
+    # prompt + seed
+    values = dict(prompt=prompt or "", seed=int(seed or 0), batch_size=int(batch_size))
 
+    if mode == "gen":
         # Generation always uses explicit size
-        wf["47"]["inputs"]["width"] = int(width)
-        wf["47"]["inputs"]["height"] = int(height)
-        wf["48"]["inputs"]["width"] = int(width)
-        wf["48"]["inputs"]["height"] = int(height)
-        return wf
+        return FLUX2_TURBO_GEN_TEMPLATE.render(width=int(width), height=int(height), **values)
 
     # edit mode
     if len(images) < 1:
         raise ValueError(f"{MODEL_ID} edit requires at least 1 image")
+
     if len(images) > 3:
         print(f"[{MODEL_ID}] Received {len(images)} images; only 3 supported. Extra images will be ignored.")
         images = images[:3]
 
     use_infer = _should_use_infer_size(width, height)
-
-    if len(images) == 1:
-        wf = copy.deepcopy(FLUX2_TURBO_EDIT_1IMG_INFER_SIZE if use_infer else FLUX2_TURBO_EDIT_1IMG)
-        wf["46"]["inputs"]["image"] = images[0]
-
-    elif len(images) == 2:
-        wf = copy.deepcopy(FLUX2_TURBO_EDIT_2IMG_INFER_SIZE if use_infer else FLUX2_TURBO_EDIT_2IMG)
-        # mapping chosen to match your node intent:
-        # - node 46 is the "main" image (megapixels=2)
-        # - node 42 is the "reference" image (megapixels=1)
-        wf["46"]["inputs"]["image"] = images[0]
-        wf["42"]["inputs"]["image"] = images[1]
-
-    else:
-        wf = copy.deepcopy(FLUX2_TURBO_EDIT_3IMG_INFER_SIZE if use_infer else FLUX2_TURBO_EDIT_3IMG)
-        wf["46"]["inputs"]["image"] = images[0]
-        wf["42"]["inputs"]["image"] = images[1]
-        wf["70"]["inputs"]["image"] = images[2]
-
-    # prompt + seed
-    wf["6"]["inputs"]["text"] = prompt or ""
-    wf["25"]["inputs"]["noise_seed"] = int(seed or 0)
+    for i, name in enumerate(images):
+        values[f"image_{i}"] = name
 
     # Only set output size for the NORMAL (non-infer) workflows.
     # For infer-size workflows, nodes 47/48 are wired to GetImageSize already.
     if not use_infer:
-        wf["47"]["inputs"]["width"] = int(width)
-        wf["47"]["inputs"]["height"] = int(height)
-        wf["48"]["inputs"]["width"] = int(width)
-        wf["48"]["inputs"]["height"] = int(height)
+        values.update(width=int(width), height=int(height))
 
-    return wf
\ No newline at end of file
+    return FLUX2_TURBO_EDIT_TEMPLATES[(len(images), use_infer)].render(**values)
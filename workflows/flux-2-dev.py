@@ -1,7 +1,17 @@
 import copy
 
+from workflows import WorkflowTemplate
+
 MODEL_ID = "flux-2-dev"
 
+# Modes whose latent honors batch_size (n images from one execution)
+BATCH_MODES = ("gen", "edit")
+
+# Pixel budget (ComfyUI megapixels) of each edit input slot; every slot is
+# scaled to it by ImageScaleToTotalPixels, so larger inputs are downscaled
+# before upload
+INPUT_MEGAPIXELS = 2
+
 FLUX_2_GEN = {
   "6": { "inputs": { "text": "", "clip": ["38", 0] }, "class_type": "CLIPTextEncode" },
   "8": { "inputs": { "samples": ["13", 0], "vae": ["10", 0] }, "class_type": "VAEDecode" },
@@ -71,12 +81,29 @@ FLUX_2_EDIT_3IMG = {
   "22": { "inputs": { "model": ["67", 0], "conditioning": ["71", 0] }, "class_type": "BasicGuider" }
 }
 
+# Compiled once at import; get_workflow only fills the slots
+_SLOTS = dict(
+    prompt=[("6", "text")],
+    seed=[("25", "noise_seed")],
+    width=[("47", "width"), ("48", "width")],
+    height=[("47", "height"), ("48", "height")],
+    batch_size=[("47", "batch_size")],
+)
+FLUX_2_GEN_TEMPLATE = WorkflowTemplate(FLUX_2_GEN, **_SLOTS)
+# edit templates by image count; image_<i> is the i-th uploaded image
+FLUX_2_EDIT_TEMPLATES = {
+    1: WorkflowTemplate(FLUX_2_EDIT_1IMG, image_0=[("46", "image")], **_SLOTS),
+    2: WorkflowTemplate(FLUX_2_EDIT_2IMG, image_0=[("42", "image")], image_1=[("46", "image")], **_SLOTS),
+    3: WorkflowTemplate(FLUX_2_EDIT_3IMG, image_0=[("42", "image")], image_1=[("46", "image")], image_2=[("68", "image")], **_SLOTS),
+}
+
 def get_workflow(
     mode: str = "gen",
     prompt: str = "",
     width: int = 1024,
     height: int = 1024,
     seed: int = 0,
+    batch_size: int = 1,
     images=None,
     **kwargs
 ):
@@ -87,15 +114,17 @@ def get_workflow(
     if ignored:
         print(f"[{MODEL_ID}] Ignoring unsupported parameters: {list(ignored.keys())}")
 
+    values = dict(
+        prompt=prompt or "",
+        seed=int(seed or 0),
+        # These workflows include explicit latent size nodes too
+        width=int(width),
+        height=int(height),
+        batch_size=int(batch_size),
+    )
+
     if mode == "gen":
-        wf = copy.deepcopy(FLUX_2_GEN)
-        wf["6"]["inputs"]["text"] = prompt or ""
-        wf["25"]["inputs"]["noise_seed"] = int(seed or 0)
-        wf["47"]["inputs"]["width"] = int(width)
-        wf["47"]["inputs"]["height"] = int(height)
-        wf["48"]["inputs"]["width"] = int(width)
-        wf["48"]["inputs"]["height"] = int(height)
-        return wf
+        return FLUX_2_GEN_TEMPLATE.render(**values)
 
     # edit mode
     if len(images) < 1:
@@ -105,26 +134,6 @@ def get_workflow(
         print(f"[{MODEL_ID}] Received {len(images)} images; only 3 supported. Extra images will be ignored.")
         images = images[:3]
 
-    if len(images) == 1:
-        wf = copy.deepcopy(FLUX_2_EDIT_1IMG)
-        wf["46"]["inputs"]["image"] = images[0]
-    elif len(images) == 2:
-        wf = copy.deepcopy(FLUX_2_EDIT_2IMG)
-        wf["42"]["inputs"]["image"] = images[0]
-        wf["46"]["inputs"]["image"] = images[1]
-    else:
-        wf = copy.deepcopy(FLUX_2_EDIT_3IMG)
-        wf["42"]["inputs"]["image"] = images[0]
-        wf["46"]["inputs"]["image"] = images[1]
-        wf["68"]["inputs"]["image"] = images[2]
-
-    wf["6"]["inputs"]["text"] = prompt or ""
-    wf["25"]["inputs"]["noise_seed"] = int(seed or 0)
-
-    # These workflows include explicit latent size nodes too
-    wf["47"]["inputs"]["width"] = int(width)
-    wf["47"]["inputs"]["height"] = int(height)
-    wf["48"]["inputs"]["width"] = int(width)
-    wf["48"]["inputs"]["height"] = int(height)
-
-    return wf
\ No newline at end of file
+    for i, name in enumerate(images):
+        values[f"image_{i}"] = name
+    return FLUX_2_EDIT_TEMPLATES[len(images)].render(**values)
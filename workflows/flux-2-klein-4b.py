@@ -1,7 +1,19 @@
 import copy
 
+from workflows import WorkflowTemplate
+
 MODEL_ID = "flux-2-klein-4b"
 
+# Modes whose latent honors batch_size (n images from one execution)
+BATCH_MODES = ("gen", "edit")
+
+# Pixel budget (ComfyUI megapixels) of each edit input slot; every slot is
+# scaled to it by ImageScaleToTotalPixels, so larger inputs are downscaled
+# before upload
+INPUT_MEGAPIXELS = 1.25
+# ...with this upscale_method, which the downscale must use too
+INPUT_RESAMPLE = "nearest-exact"
+
 # --------------------------
 # Text-to-Image (Generation)
 # --------------------------
@@ -193,12 +205,45 @@ FLUX_KLEIN_4B_EDIT_3IMG_INFER_SIZE = {
 }
 
 
+# --------------------------
+# Compiled templates
+# --------------------------
+# Compiled once at import; get_workflow only fills the slots. Infer-size
+# variants take their size from GetImageSize, so they have no width/height.
+FLUX_KLEIN_4B_GEN_TEMPLATE = WorkflowTemplate(
+    FLUX_KLEIN_4B_GEN,
+    prompt=[("76", "value")],
+    seed=[("75:73", "noise_seed")],
+    width=[("75:68", "value")],
+    height=[("75:69", "value")],
+    batch_size=[("75:66", "batch_size")],
+)
+
+_EDIT_SLOTS = dict(prompt=[("92:74", "text")], seed=[("92:73", "noise_seed")], batch_size=[("92:66", "batch_size")])
+_SIZE_SLOTS = dict(width=[("92:66", "width"), ("92:62", "width")], height=[("92:66", "height"), ("92:62", "height")])
+_IMAGE_SLOTS = {
+    1: dict(image_0=[("76", "image")]),
+    2: dict(image_0=[("76", "image")], image_1=[("81", "image")]),
+    3: dict(image_0=[("76", "image")], image_1=[("81", "image")], image_2=[("100", "image")]),
+}
+# (image count, infer size) -> template
+FLUX_KLEIN_4B_EDIT_TEMPLATES = {
+    (1, False): WorkflowTemplate(FLUX_KLEIN_4B_EDIT_1IMG, **_IMAGE_SLOTS[1], **_EDIT_SLOTS, **_SIZE_SLOTS),
+    (1, True): WorkflowTemplate(FLUX_KLEIN_4B_EDIT_1IMG_INFER_SIZE, **_IMAGE_SLOTS[1], **_EDIT_SLOTS),
+    (2, False): WorkflowTemplate(FLUX_KLEIN_4B_EDIT_2IMG, **_IMAGE_SLOTS[2], **_EDIT_SLOTS, **_SIZE_SLOTS),
+    (2, True): WorkflowTemplate(FLUX_KLEIN_4B_EDIT_2IMG_INFER_SIZE, **_IMAGE_SLOTS[2], **_EDIT_SLOTS),
+    (3, False): WorkflowTemplate(FLUX_KLEIN_4B_EDIT_3IMG, **_IMAGE_SLOTS[3], **_EDIT_SLOTS, **_SIZE_SLOTS),
+    (3, True): WorkflowTemplate(FLUX_KLEIN_4B_EDIT_3IMG_INFER_SIZE, **_IMAGE_SLOTS[3], **_EDIT_SLOTS),
+}
+
+
 def get_workflow(
     mode: str = "gen",
     prompt: str = "",
     width: int = 0,
     height: int = 0,
     seed: int = 0,
+    batch_size: int = 1,
     images=None,
     **kwargs
 ):
@@ -210,46 +255,33 @@ def get_workflow(
         print(f"[{MODEL_ID}] Ignoring unsupported parameters: {list(ignored.keys())}")
 
     if mode == "gen":
-        wf = copy.deepcopy(FLUX_KLEIN_4B_GEN)
-        wf["76"]["inputs"]["value"] = (prompt or "").rstrip() + "\n"
-        wf["75:73"]["inputs"]["noise_seed"] = int(seed or 0)
-        wf["75:68"]["inputs"]["value"] = int(width)
-        wf["75:69"]["inputs"]["value"] = int(height)
-        return wf
+        return FLUX_KLEIN_4B_GEN_TEMPLATE.render(
+            prompt=(prompt or "").rstrip() + "\n",
+            seed=int(seed or 0),
+            width=int(width),
+            height=int(height),
+            batch_size=int(batch_size),
+        )
 
     # edit mode
     if len(images) < 1:
         raise ValueError(f"{MODEL_ID} edit requires at least 1 image")
+
     if len(images) > 3:
         print(f"[{MODEL_ID}] Received {len(images)} images; only 3 supported. Extra images will be ignored.")
         images = images[:3]
 
     use_infer = _should_use_infer_size(width, height)
 
-    if len(images) == 1:
-        wf = copy.deepcopy(FLUX_KLEIN_4B_EDIT_1IMG_INFER_SIZE if use_infer else FLUX_KLEIN_4B_EDIT_1IMG)
-        wf["76"]["inputs"]["image"] = images[0]
-    elif len(images) == 2:
-        wf = copy.deepcopy(FLUX_KLEIN_4B_EDIT_2IMG_INFER_SIZE if use_infer else FLUX_KLEIN_4B_EDIT_2IMG)
-        wf["76"]["inputs"]["image"] = images[0]
-        wf["81"]["inputs"]["image"] = images[1]
-    else:
-        wf = copy.deepcopy(FLUX_KLEIN_4B_EDIT_3IMG_INFER_SIZE if use_infer else FLUX_KLEIN_4B_EDIT_3IMG)
-        wf["76"]["inputs"]["image"] = images[0]
-        wf["81"]["inputs"]["image"] = images[1]
-        wf["100"]["inputs"]["image"] = images[2]
-
     # prompt + seed (node ids per new workflows)
-    wf["92:74"]["inputs"]["text"] = prompt or ""
-    wf["92:73"]["inputs"]["noise_seed"] = int(seed or 0)
+    values = dict(prompt=prompt or "", seed=int(seed or 0), batch_size=int(batch_size))
+    for i, name in enumerate(images):
+        values[f"image_{i}"] = name
 
     # For NORMAL (non-infer) edit workflows, width/height are hardcoded (1232x1232) in nodes 92:66 and 92:62.
     # Your requirement says: if size is supported and non-0x0, use the normal (not infer-size) version.
     # So we *do* set those explicit dimensions from the API if provided and non-zero, to honor the request.
     if not use_infer:
-        wf["92:66"]["inputs"]["width"] = int(width)
-        wf["92:66"]["inputs"]["height"] = int(height)
-        wf["92:62"]["inputs"]["width"] = int(width)
-        wf["92:62"]["inputs"]["height"] = int(height)
+        values.update(width=int(width), height=int(height))
 
-    return wf
\ No newline at end of file
+    return FLUX_KLEIN_4B_EDIT_TEMPLATES[(len(images), use_infer)].render(**values)
@@ -1,7 +1,16 @@
 import copy
 
+from workflows import WorkflowTemplate
+
 MODEL_ID = "flux-kontext-dev"
 
+# Modes whose latent honors batch_size (n images from one execution)
+BATCH_MODES = ("edit",)
+
+# No INPUT_MEGAPIXELS: FluxKontextImageScale crops and resizes the input to a
+# ~1 MP preset chosen by aspect ratio, which a downscale before upload cannot
+# reproduce exactly, so inputs are uploaded at full size
+
 FLUX_KONTEXT_DEV = {
   "6": { "inputs": { "text": "", "clip": ["194", 0] }, "class_type": "CLIPTextEncode" },
   "8": { "inputs": { "samples": ["31", 0], "vae": ["39", 0] }, "class_type": "VAEDecode" },
@@ -20,10 +29,24 @@ FLUX_KONTEXT_DEV = {
   "194": { "inputs": { "clip_name1": "clip_l.safetensors", "clip_name2": "t5-v1_1-xxl-encoder-Q4_K_M.gguf", "type": "flux" }, "class_type": "DualCLIPLoaderGGUF" }
 }
 
+# Compiled once at import; get_workflow only fills the slots
+_SLOTS = dict(prompt=[("6", "text")], image_0=[("142", "image")], seed=[("31", "seed")])
+FLUX_KONTEXT_DEV_TEMPLATE = WorkflowTemplate(FLUX_KONTEXT_DEV, **_SLOTS)
+
+# The sampler starts from the encoded input image (124); repeat it for the batch
+FLUX_KONTEXT_DEV_BATCH = copy.deepcopy(FLUX_KONTEXT_DEV)
+FLUX_KONTEXT_DEV_BATCH["200"] = {
+    "inputs": {"samples": ["124", 0], "amount": 1},
+    "class_type": "RepeatLatentBatch",
+}
+FLUX_KONTEXT_DEV_BATCH["31"]["inputs"]["latent_image"] = ["200", 0]
+FLUX_KONTEXT_DEV_BATCH_TEMPLATE = WorkflowTemplate(FLUX_KONTEXT_DEV_BATCH, batch_size=[("200", "amount")], **_SLOTS)
+
 def get_workflow(
     prompt: str = "",
     images=None,   # list of uploaded names
     seed: int = 0,
+    batch_size: int = 1,
     width: int = 1024,   # unused
     height: int = 1024,  # unused
     **kwargs
@@ -44,8 +67,7 @@ def get_workflow(
         print(f"[{MODEL_ID}] Received {len(images)} images; only 1 supported. Extra images will be ignored.")
         images = images[:1]
 
-    wf = copy.deepcopy(FLUX_KONTEXT_DEV)
-    wf["6"]["inputs"]["text"] = prompt or ""
-    wf["142"]["inputs"]["image"] = images[0]
-    wf["31"]["inputs"]["seed"] = int(seed or 0)
-    return wf
\ No newline at end of file
+    values = dict(prompt=prompt or "", image_0=images[0], seed=int(seed or 0))
+    if int(batch_size) > 1:
+        return FLUX_KONTEXT_DEV_BATCH_TEMPLATE.render(batch_size=int(batch_size), **values)
+    return FLUX_KONTEXT_DEV_TEMPLATE.render(**values)
@@ -1,6 +1,16 @@
 import copy
 
-MODEL_ID = "qwen image 2025"
+from workflows import WorkflowTemplate
+
+MODEL_ID = "qwen-image-2025"
+
+# Modes whose latent honors batch_size (n images from one execution)
+BATCH_MODES = ("gen", "edit")
+
+# Pixel budget (ComfyUI megapixels) of each edit input slot; every slot is
+# scaled to it by ImageScaleToTotalPixels, so larger inputs are downscaled
+# before upload
+INPUT_MEGAPIXELS = 1.5
 
 # ============================================================
 # TEXT-TO-IMAGE (GENERATION)
@@ -521,6 +531,53 @@ QWEN_IMAGE_2025_EDIT_3IMG_INFER_SIZE["88"] = {
 }
 QWEN_IMAGE_2025_EDIT_3IMG_INFER_SIZE["3"]["inputs"]["latent_image"] = ["88", 0]
 
+# ============================================================
+# COMPILED TEMPLATES
+# ============================================================
+# Compiled once at import; get_workflow only fills the slots.
+QWEN_IMAGE_2025_GEN_TEMPLATE = WorkflowTemplate(
+    QWEN_IMAGE_2025_GEN,
+    prompt=[("91", "value")],
+    seed=[("92:3", "seed")],
+    width=[("92:58", "width")],
+    height=[("92:58", "height")],
+    batch_size=[("92:58", "batch_size")],
+)
+
+def _repeat_latent_batch(wf: dict) -> dict:
+    # Infer-size workflows sample on the VAEEncode latent (88); repeat it for the batch
+    wf = copy.deepcopy(wf)
+    wf["113"] = {
+        "inputs": {"samples": ["88", 0], "amount": 1},
+        "class_type": "RepeatLatentBatch",
+    }
+    wf["3"]["inputs"]["latent_image"] = ["113", 0]
+    return wf
+
+_EDIT_SLOTS = dict(prompt=[("111", "prompt")], seed=[("3", "seed")])
+_IMAGE_SLOTS = {
+    1: dict(image_0=[("78", "image")]),
+    2: dict(image_0=[("78", "image")], image_1=[("106", "image")]),
+    3: dict(image_0=[("78", "image")], image_1=[("106", "image")], image_2=[("108", "image")]),
+}
+_EDIT_GRAPHS = {
+    1: (QWEN_IMAGE_2025_EDIT_1IMG, QWEN_IMAGE_2025_EDIT_1IMG_INFER_SIZE),
+    2: (QWEN_IMAGE_2025_EDIT_2IMG, QWEN_IMAGE_2025_EDIT_2IMG_INFER_SIZE),
+    3: (QWEN_IMAGE_2025_EDIT_3IMG, QWEN_IMAGE_2025_EDIT_3IMG_INFER_SIZE),
+}
+# (image count, variant) -> template; variant is "normal" (explicit size),
+# "infer" or "infer_batch" (infer size, batch_size > 1)
+QWEN_IMAGE_2025_EDIT_TEMPLATES = {}
+for _count, (_normal, _infer) in _EDIT_GRAPHS.items():
+    QWEN_IMAGE_2025_EDIT_TEMPLATES[(_count, "normal")] = WorkflowTemplate(
+        _normal, **_IMAGE_SLOTS[_count], **_EDIT_SLOTS,
+        width=[("112", "width")], height=[("112", "height")], batch_size=[("112", "batch_size")],
+    )
+    QWEN_IMAGE_2025_EDIT_TEMPLATES[(_count, "infer")] = WorkflowTemplate(_infer, **_IMAGE_SLOTS[_count], **_EDIT_SLOTS)
+    QWEN_IMAGE_2025_EDIT_TEMPLATES[(_count, "infer_batch")] = WorkflowTemplate(
+        _repeat_latent_batch(_infer), **_IMAGE_SLOTS[_count], **_EDIT_SLOTS, batch_size=[("113", "amount")],
+    )
+
 
 def get_workflow(
     mode: str = "gen",
@@ -528,6 +585,7 @@ def get_workflow(
     width: int = 0,
     height: int = 0,
     seed: int = 0,
+    batch_size: int = 1,
     images=None,
     **kwargs
 ):
@@ -539,42 +597,37 @@ def get_workflow(
         print(f"[{MODEL_ID}] Ignoring unsupported parameters: {list(ignored.keys())}")
 
     if mode == "gen":
-        wf = copy.deepcopy(QWEN_IMAGE_2025_GEN)
-        wf["91"]["inputs"]["value"] = (prompt or "").rstrip() + "\n"
-        wf["92:3"]["inputs"]["seed"] = int(seed or 0)
-        wf["92:58"]["inputs"]["width"] = int(width)
-        wf["92:58"]["inputs"]["height"] = int(height)
-        return wf
+        return QWEN_IMAGE_2025_GEN_TEMPLATE.render(
+            prompt=(prompt or "").rstrip() + "\n",
+            seed=int(seed or 0),
+            width=int(width),
+            height=int(height),
+            batch_size=int(batch_size),
+        )
 
     # edit mode
     if len(images) < 1:
         raise ValueError(f"{MODEL_ID} edit requires at least 1 image")
+
     if len(images) > 3:
         print(f"[{MODEL_ID}] Received {len(images)} images; only 3 supported. Extra images will be ignored.")
         images = images[:3]
 
     use_infer = _should_use_infer_size(width, height)
 
-    if len(images) == 1:
-        wf = copy.deepcopy(QWEN_IMAGE_2025_EDIT_1IMG_INFER_SIZE if use_infer else QWEN_IMAGE_2025_EDIT_1IMG)
-        wf["78"]["inputs"]["image"] = images[0]
-    elif len(images) == 2:
-        wf = copy.deepcopy(QWEN_IMAGE_2025_EDIT_2IMG_INFER_SIZE if use_infer else QWEN_IMAGE_2025_EDIT_2IMG)
-        wf["78"]["inputs"]["image"] = images[0]
-        wf["106"]["inputs"]["image"] = images[1]
-    else:
-        wf = copy.deepcopy(QWEN_IMAGE_2025_EDIT_3IMG_INFER_SIZE if use_infer else QWEN_IMAGE_2025_EDIT_3IMG)
-        wf["78"]["inputs"]["image"] = images[0]
-        wf["106"]["inputs"]["image"] = images[1]
-        wf["108"]["inputs"]["image"] = images[2]
-
     # prompt + seed
-    wf["111"]["inputs"]["prompt"] = prompt or ""
-    wf["3"]["inputs"]["seed"] = int(seed or 0)
+    values = dict(prompt=prompt or "", seed=int(seed or 0))
+    for i, name in enumerate(images):
+        values[f"image_{i}"] = name
 
     # If NOT infer-size, honor explicit width/height
     if not use_infer:
-        wf["112"]["inputs"]["width"] = int(width)
-        wf["112"]["inputs"]["height"] = int(height)
+        variant = "normal"
+        values.update(width=int(width), height=int(height), batch_size=int(batch_size))
+    elif int(batch_size) > 1:
+        variant = "infer_batch"
+        values["batch_size"] = int(batch_size)
+    else:
+        variant = "infer"
 
-    return wf
\ No newline at end of file
+    return QWEN_IMAGE_2025_EDIT_TEMPLATES[(len(images), variant)].render(**values)
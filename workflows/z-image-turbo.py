@@ -1,7 +1,10 @@
-import copy
+from workflows import WorkflowTemplate
 
 MODEL_ID = "z-image-turbo"
 
+# Modes whose latent honors batch_size (n images from one execution)
+BATCH_MODES = ("gen",)
+
 Z_IMAGE_TURBO_GEN = {
   "9": {
     "inputs": {"filename_prefix": "z-image", "images": ["57:8", 0]},
@@ -67,6 +70,16 @@ Z_IMAGE_TURBO_GEN = {
   }
 }
 
+# Compiled once at import; get_workflow only fills the slots
+Z_IMAGE_TURBO_GEN_TEMPLATE = WorkflowTemplate(
+    Z_IMAGE_TURBO_GEN,
+    prompt=[("58", "value")],
+    seed=[("57:3", "seed")],
+    width=[("57:13", "width")],
+    height=[("57:13", "height")],
+    batch_size=[("57:13", "batch_size")],
+)
+
 
 def get_workflow(
     mode: str = "gen",
@@ -74,6 +87,7 @@ def get_workflow(
     width: int = 1232,
     height: int = 1232,
     seed: int = 0,
+    batch_size: int = 1,
     **kwargs
 ):
     if mode != "gen":
@@ -83,11 +97,10 @@ def get_workflow(
     if ignored:
         print(f"[{MODEL_ID}] Ignoring unsupported parameters: {list(ignored.keys())}")
 
-    wf = copy.deepcopy(Z_IMAGE_TURBO_GEN)
-
-    wf["58"]["inputs"]["value"] = (prompt or "").rstrip() + "\n"
-    wf["57:3"]["inputs"]["seed"] = int(seed or 0)
-    wf["57:13"]["inputs"]["width"] = int(width)
-    wf["57:13"]["inputs"]["height"] = int(height)
-
-    return wf
\ No newline at end of file
+    return Z_IMAGE_TURBO_GEN_TEMPLATE.render(
+        prompt=(prompt or "").rstrip() + "\n",
+        seed=int(seed or 0),
+        width=int(width),
+        height=int(height),
+        batch_size=int(batch_size),
+    )